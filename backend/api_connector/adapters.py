@@ -0,0 +1,431 @@
+"""
+API提供商适配器
+
+每种提供商类型对应一个 ProviderAdapter 子类，负责该提供商与平台之间的全部差异：
+认证请求头、URL模板、固定的URL参数、动态认证参数（如百度access_token）、
+对话和嵌入请求体的构建以及响应和流式数据块的规范化。
+
+适配器在解析连接时（见 registry）为每个连接创建一次，请求头和固定参数在此时计算好并
+保存为只读映射，调用时只需复制一份。新增提供商只需要编写一个子类并用 register_adapter 注册，
+APIConnector 和视图中不再按 provider_type 分支。
+"""
+
+import logging
+from types import MappingProxyType
+
+from .baidu_token import baidu_token_manager, BAIDU_TOKEN_ERROR_CODES
+
+logger = logging.getLogger(__name__)
+
+OPENAI_CHAT_ENDPOINT = "chat/completions"
+BAIDU_CHAT_ENDPOINT = "rpc/2.0/ai_custom/v1/wenxinworkshop/chat/completions"
+BAIDU_EMBEDDING_ENDPOINT = "rpc/2.0/ai_custom/v1/wenxinworkshop/embeddings/{model}"
+OPENAI_EMBEDDING_ENDPOINT = "embeddings"
+ANTHROPIC_CHAT_ENDPOINT = "messages"
+ANTHROPIC_VERSION = "2023-06-01"
+ANTHROPIC_DEFAULT_MAX_TOKENS = 1024
+AZURE_API_VERSION = "2024-02-01"
+
+
+def build_openai_chat_request(prompt, model="gpt-3.5-turbo", stream=False):
+    """构建OpenAI对话请求体"""
+    request = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.7
+    }
+    if stream:
+        # 要求在最后一个数据块中返回令牌使用量
+        request["stream"] = True
+        request["stream_options"] = {"include_usage": True}
+    return request
+
+def build_baidu_chat_request(prompt, stream=False):
+    """构建百度文心对话请求体"""
+    request = {
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    if stream:
+        request["stream"] = True
+    return request
+
+def parse_openai_chat_response(response):
+    """将OpenAI对话响应转换为统一的结果格式"""
+    if response and not response.get('error', False):
+        if 'choices' in response and len(response['choices']) > 0:
+            return {
+                'success': True,
+                'content': response['choices'][0]['message']['content'],
+                'usage': response.get('usage', {})
+            }
+
+    return {
+        'success': False,
+        'error': response.get('message', '未知错误'),
+        'details': response
+    }
+
+def parse_baidu_chat_response(response):
+    """将百度文心对话响应转换为统一的结果格式"""
+    if response and not response.get('error', False):
+        return {
+            'success': True,
+            'content': response.get('result', ''),
+            'usage': response.get('usage', {})
+        }
+
+    return {
+        'success': False,
+        'error': response.get('message', '未知错误'),
+        'details': response
+    }
+
+def parse_openai_embedding_response(response):
+    """
+    取出嵌入响应中的向量，按输入顺序排列
+
+    Returns:
+        向量列表，响应不是成功的嵌入结果时返回None
+    """
+    if not response or response.get('error', False):
+        return None
+    data = response.get('data')
+    if not isinstance(data, list):
+        return None
+    try:
+        return [item['embedding'] for item in sorted(data, key=lambda item: item.get('index', 0))]
+    except (KeyError, TypeError):
+        return None
+
+def parse_openai_stream_chunk(chunk):
+    """将OpenAI流式数据块转换为统一的格式"""
+    if chunk.get('error', False):
+        return {
+            'success': False,
+            'error': chunk.get('message', '未知错误'),
+            'details': chunk
+        }
+
+    choices = chunk.get('choices') or []
+    choice = choices[0] if choices else {}
+    return {
+        'success': True,
+        'content': (choice.get('delta') or {}).get('content') or '',
+        'finish_reason': choice.get('finish_reason'),
+        'usage': chunk.get('usage')
+    }
+
+def parse_baidu_stream_chunk(chunk):
+    """将百度文心流式数据块转换为统一的格式"""
+    if chunk.get('error', False):
+        return {
+            'success': False,
+            'error': chunk.get('message', '未知错误'),
+            'details': chunk
+        }
+
+    is_end = chunk.get('is_end', False)
+    return {
+        'success': True,
+        'content': chunk.get('result', ''),
+        'finish_reason': chunk.get('finish_reason') or ('stop' if is_end else None),
+        'usage': chunk.get('usage') if is_end else None
+    }
+
+
+class ProviderAdapter:
+    """提供商适配器基类，默认实现为OpenAI兼容接口"""
+
+    provider_type = None
+    chat_endpoint = OPENAI_CHAT_ENDPOINT
+    default_model = "gpt-3.5-turbo"
+    test_prompt = "Hello, I'm testing the API connection. Please respond with 'Connection successful'."
+    # 是否需要在每次请求时获取认证参数（见 auth_params）
+    dynamic_auth = False
+    # 嵌入接口：是否支持、端点、未配置嵌入模型时使用的模型和单个请求最多的输入条数
+    supports_embeddings = True
+    embedding_endpoint = OPENAI_EMBEDDING_ENDPOINT
+    default_embedding_model = "text-embedding-3-small"
+    max_embedding_batch = 2048
+
+    def __init__(self, connection):
+        """
+        为连接预先计算请求头、基础URL和固定的URL参数
+
+        Args:
+            connection: API连接（已加载提供商）
+        """
+        self.connection = connection
+        self.base_url = connection.provider.base_url.rstrip('/') + '/'
+        self.headers = MappingProxyType(self.build_headers())
+        self.params = MappingProxyType(self.build_params())
+
+    def build_headers(self):
+        """构建认证请求头"""
+        return {'Content-Type': 'application/json'}
+
+    def build_params(self):
+        """构建每次请求都携带的URL参数（连接的自定义参数）"""
+        params = {}
+        if self.connection.custom_params:
+            try:
+                params.update(self.connection.custom_params)
+            except Exception as e:
+                logger.error(f"解析自定义参数时出错: {str(e)}")
+        return params
+
+    def url(self, endpoint):
+        """端点的完整URL"""
+        return self.base_url + endpoint.lstrip('/')
+
+    def auth_params(self):
+        """每次请求时动态获取的认证参数，dynamic_auth 为True时才会被调用"""
+        return {}
+
+    def is_auth_error(self, response_data):
+        """响应是否表示认证信息失效"""
+        return False
+
+    def invalidate_auth(self):
+        """丢弃缓存的动态认证信息"""
+
+    def chat_endpoint_for(self, model=None):
+        """对话接口的端点"""
+        return self.chat_endpoint
+
+    def build_chat_request(self, prompt, model=None, stream=False):
+        """构建对话请求体"""
+        return build_openai_chat_request(prompt, model or self.default_model, stream=stream)
+
+    @staticmethod
+    def _usage(usage):
+        """把响应中的usage转换为统一格式（prompt_tokens、completion_tokens、total_tokens）"""
+        return usage
+
+    def parse_chat_response(self, response):
+        """将对话响应转换为统一的结果格式"""
+        return parse_openai_chat_response(response)
+
+    def parse_stream_chunk(self, chunk):
+        """将流式数据块转换为统一的格式"""
+        return parse_openai_stream_chunk(chunk)
+
+    def embedding_endpoint_for(self, model=None):
+        """嵌入接口的端点"""
+        return self.embedding_endpoint
+
+    def build_embedding_request(self, texts, model):
+        """构建嵌入请求体"""
+        return {"model": model, "input": list(texts)}
+
+    def parse_embedding_response(self, response):
+        """取出嵌入响应中按输入顺序排列的向量，失败时返回None"""
+        return parse_openai_embedding_response(response)
+
+
+# provider_type -> 适配器类
+ADAPTERS = {}
+
+
+def register_adapter(adapter_class):
+    """注册适配器类（可用作类装饰器）"""
+    ADAPTERS[adapter_class.provider_type] = adapter_class
+    return adapter_class
+
+
+def get_adapter_class(provider_type):
+    """获取提供商类型的适配器类，未注册的类型按自定义API处理"""
+    return ADAPTERS.get(provider_type) or ADAPTERS['custom']
+
+
+def build_adapter(connection):
+    """为连接创建适配器"""
+    return get_adapter_class(connection.provider.provider_type)(connection)
+
+
+@register_adapter
+class OpenAIAdapter(ProviderAdapter):
+    provider_type = 'openai'
+
+    def build_headers(self):
+        headers = super().build_headers()
+        headers['Authorization'] = f"Bearer {self.connection.api_key}"
+        if self.connection.org_id:
+            headers['OpenAI-Organization'] = self.connection.org_id
+        return headers
+
+
+@register_adapter
+class GoogleAdapter(ProviderAdapter):
+    """Google AI（OpenAI兼容接口）"""
+
+    provider_type = 'google'
+    default_model = "gemini-1.5-flash"
+
+    def build_headers(self):
+        headers = super().build_headers()
+        headers['Authorization'] = f"Bearer {self.connection.api_key}"
+        return headers
+
+
+@register_adapter
+class AzureOpenAIAdapter(ProviderAdapter):
+    """Azure OpenAI：模型即部署名称，出现在URL路径中"""
+
+    provider_type = 'azure'
+
+    def build_headers(self):
+        headers = super().build_headers()
+        headers['api-key'] = self.connection.api_key
+        return headers
+
+    def build_params(self):
+        params = super().build_params()
+        params.setdefault('api-version', AZURE_API_VERSION)
+        return params
+
+    def chat_endpoint_for(self, model=None):
+        return f"openai/deployments/{model or self.default_model}/chat/completions"
+
+    def embedding_endpoint_for(self, model=None):
+        return f"openai/deployments/{model or self.default_embedding_model}/embeddings"
+
+
+@register_adapter
+class AnthropicAdapter(ProviderAdapter):
+    """Anthropic Messages API"""
+
+    provider_type = 'anthropic'
+    chat_endpoint = ANTHROPIC_CHAT_ENDPOINT
+    default_model = "claude-3-haiku-20240307"
+    supports_embeddings = False
+
+    def build_headers(self):
+        headers = super().build_headers()
+        headers['x-api-key'] = self.connection.api_key
+        headers['anthropic-version'] = ANTHROPIC_VERSION
+        return headers
+
+    def build_chat_request(self, prompt, model=None, stream=False):
+        request = {
+            "model": model or self.default_model,
+            "max_tokens": ANTHROPIC_DEFAULT_MAX_TOKENS,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        if stream:
+            request["stream"] = True
+        return request
+
+    @staticmethod
+    def _usage(usage):
+        """把input_tokens/output_tokens换算为统一的usage格式"""
+        if not usage:
+            return usage
+        prompt_tokens = usage.get('input_tokens', 0) or 0
+        completion_tokens = usage.get('output_tokens', 0) or 0
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+
+    def parse_chat_response(self, response):
+        if response and not response.get('error', False):
+            content = ''.join(
+                block.get('text', '') for block in response.get('content') or []
+                if block.get('type') == 'text'
+            )
+            return {
+                'success': True,
+                'content': content,
+                'usage': self._usage(response.get('usage')) or {}
+            }
+        return {
+            'success': False,
+            'error': response.get('message', '未知错误'),
+            'details': response
+        }
+
+    def parse_stream_chunk(self, chunk):
+        if chunk.get('error', False) is True:
+            return {
+                'success': False,
+                'error': chunk.get('message', '未知错误'),
+                'details': chunk
+            }
+        delta = chunk.get('delta') or {}
+        return {
+            'success': True,
+            'content': delta.get('text', '') if chunk.get('type') == 'content_block_delta' else '',
+            'finish_reason': delta.get('stop_reason'),
+            'usage': self._usage(chunk.get('usage'))
+        }
+
+
+@register_adapter
+class HuggingFaceAdapter(ProviderAdapter):
+    """HuggingFace推理接口（OpenAI兼容接口）"""
+
+    provider_type = 'huggingface'
+
+    def build_headers(self):
+        headers = super().build_headers()
+        headers['Authorization'] = f"Bearer {self.connection.api_key}"
+        return headers
+
+
+@register_adapter
+class BaiduAdapter(ProviderAdapter):
+    """百度智能云：在URL参数中携带access_token，模型由端点决定"""
+
+    provider_type = 'baidu'
+    chat_endpoint = BAIDU_CHAT_ENDPOINT
+    default_model = None
+    test_prompt = "你好，我正在测试API连接。请回复'连接成功'。"
+    dynamic_auth = True
+    default_embedding_model = "embedding-v1"
+    max_embedding_batch = 16
+
+    def auth_params(self):
+        return {'access_token': baidu_token_manager.get_token(self.connection)}
+
+    def is_auth_error(self, response_data):
+        return isinstance(response_data, dict) and response_data.get('error_code') in BAIDU_TOKEN_ERROR_CODES
+
+    def invalidate_auth(self):
+        # token失效（如被吊销），丢弃缓存，下一次调用会重新获取
+        logger.warning(f"百度API连接 {self.connection.name} 的access_token已失效，重新获取")
+        baidu_token_manager.invalidate(self.connection)
+
+    def build_chat_request(self, prompt, model=None, stream=False):
+        return build_baidu_chat_request(prompt, stream=stream)
+
+    def parse_chat_response(self, response):
+        return parse_baidu_chat_response(response)
+
+    def parse_stream_chunk(self, chunk):
+        return parse_baidu_stream_chunk(chunk)
+
+    def embedding_endpoint_for(self, model=None):
+        # 百度的嵌入模型由端点决定
+        return BAIDU_EMBEDDING_ENDPOINT.format(model=model or self.default_embedding_model)
+
+    def build_embedding_request(self, texts, model):
+        return {"input": list(texts)}
+
+
+@register_adapter
+class CustomAdapter(ProviderAdapter):
+    """自定义API：使用连接中保存的自定义请求头，请求格式按OpenAI兼容接口处理"""
+
+    provider_type = 'custom'
+
+    def build_headers(self):
+        headers = super().build_headers()
+        if self.connection.custom_headers:
+            try:
+                for key, value in self.connection.custom_headers.items():
+                    headers[key] = value
+            except Exception as e:
+                logger.error(f"解析自定义请求头时出错: {str(e)}")
+        return headers
@@ -0,0 +1,218 @@
+"""
+API使用日志的归档和保留
+
+APIUsageLog 保存了每次调用完整的请求和响应数据，表和它的TOAST存储会无限增长。
+archive_usage_logs（由Celery beat每天调用）把创建时间早于保留期的日志按日期写入
+MEDIA_ROOT 下的压缩JSONL文件，边写边在同一事务中分批删除对应的行，文件落盘后才提交：
+
+    <API_USAGE_ARCHIVE_DIR>/YYYY/MM/DD/usage-YYYYMMDD-<归档时间>-<随机串>.jsonl.zst
+
+安装了 zstandard 时使用zstd压缩，否则使用gzip（.jsonl.gz）；读取时两种格式都支持。
+同一天可能分多次归档（例如迟到的日志），因此每次归档写入新的文件。
+
+统计汇总的定期校正（rebuild_usage_rollups）会从原始日志重算最近 API_USAGE_ROLLUP_REBUILD_DAYS 天，
+保留期必须比这个窗口长，否则校正时会把已归档日期的汇总清零。
+
+iter_archived_logs 按日期范围流式读取归档文件，不需要把日志写回数据库。
+"""
+
+import io
+import os
+import gzip
+import json
+import uuid
+import logging
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import APIUsageLog
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时使用gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = (
+    'id', 'connection_id', 'endpoint', 'request_data', 'response_data', 'status', 'error_message',
+    'tokens_used', 'estimated_tokens', 'response_time', 'user_ip', 'cache_hit', 'attempt', 'created_at',
+)
+ARCHIVE_SUFFIXES = ('.jsonl.zst', '.jsonl.gz')
+
+
+def archive_dir():
+    """归档文件的根目录"""
+    return getattr(settings, 'API_USAGE_ARCHIVE_DIR', os.path.join(settings.MEDIA_ROOT, 'api_usage_archive'))
+
+
+def day_dir(day):
+    """某一天的归档目录"""
+    return os.path.join(archive_dir(), f'{day:%Y}', f'{day:%m}', f'{day:%d}')
+
+
+def _day_range(day):
+    """某一天（当前时区）的起止时间"""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()), tz)
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()), tz)
+    return start, end
+
+
+def min_retention_days():
+    """允许的最短保留天数：必须超出统计汇总的校正窗口"""
+    return getattr(settings, 'API_USAGE_ROLLUP_REBUILD_DAYS', 2) + 1
+
+
+def _open_writer(path):
+    """打开压缩的文本写入流"""
+    if zstandard is not None:
+        stream = zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'), closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+
+
+def _open_reader(path):
+    """打开压缩的文本读取流"""
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"读取归档文件 {path} 需要安装 zstandard")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return gzip.open(path, 'rt', encoding='utf-8')
+
+
+def _write_day(day, queryset, batch_size):
+    """
+    把一天的日志写入一个新的归档文件，边写边分批删除已写入的行
+
+    删除与写入在同一事务中，文件完整落盘后才提交；写入失败时事务回滚，
+    数据库中的行保持不变。
+
+    Returns:
+        (文件路径, 已归档的行数)；没有日志时返回 (None, 0)
+    """
+    directory = day_dir(day)
+    os.makedirs(directory, exist_ok=True)
+    suffix = ARCHIVE_SUFFIXES[0] if zstandard is not None else ARCHIVE_SUFFIXES[1]
+    name = f'usage-{day:%Y%m%d}-{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}{suffix}'
+    path = os.path.join(directory, name)
+    tmp_path = f'{path}.tmp'
+
+    count = 0
+    try:
+        with transaction.atomic():
+            with _open_writer(tmp_path) as writer:
+                # 已写入的行随即删除，每次读取剩余行的第一页，不需要一次加载一整天的数据
+                rows = queryset.order_by('created_at', 'id').values(*ARCHIVE_FIELDS)
+                while True:
+                    page = list(rows[:batch_size])
+                    if not page:
+                        break
+                    for row in page:
+                        writer.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+                        writer.write('\n')
+                    APIUsageLog.objects.filter(id__in=[row['id'] for row in page]).delete()
+                    count += len(page)
+
+            if not count:
+                os.remove(tmp_path)
+                return None, 0
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, count
+
+
+def archive_usage_logs(older_than_days=None, batch_size=None):
+    """
+    归档并删除早于保留期的使用日志
+
+    Args:
+        older_than_days: 保留天数，默认读取 API_USAGE_LOG_RETENTION_DAYS；
+            不能小于 min_retention_days()
+        batch_size: 每批读取和删除的行数，默认读取 API_USAGE_ARCHIVE_BATCH_SIZE
+
+    Returns:
+        {'cutoff': 截止日期, 'archived': 归档行数, 'files': [文件路径]}
+
+    Raises:
+        ValueError: 保留天数不足以覆盖统计汇总的校正窗口
+    """
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'API_USAGE_LOG_RETENTION_DAYS', 30)
+    if older_than_days < min_retention_days():
+        raise ValueError(f"日志保留天数必须不少于{min_retention_days()}天，否则统计汇总校正时会丢失已归档的数据")
+    batch_size = batch_size or getattr(settings, 'API_USAGE_ARCHIVE_BATCH_SIZE', 5000)
+
+    # 截止到保留期第一天的零点，归档的总是完整的自然日
+    cutoff = timezone.localdate() - timedelta(days=older_than_days)
+    cutoff_at, _ = _day_range(cutoff)
+
+    oldest = APIUsageLog.objects.filter(created_at__lt=cutoff_at).order_by('created_at').values_list(
+        'created_at', flat=True
+    ).first()
+    archived = 0
+    files = []
+    if oldest is None:
+        return {'cutoff': cutoff.isoformat(), 'archived': 0, 'files': []}
+
+    day = timezone.localdate(oldest)
+    while day < cutoff:
+        start, end = _day_range(day)
+        path, count = _write_day(day, APIUsageLog.objects.filter(created_at__gte=start, created_at__lt=end), batch_size)
+        if path is not None:
+            archived += count
+            files.append(path)
+            logger.info(f"已归档 {day} 的 {count} 条API使用日志到 {path}")
+        day += timedelta(days=1)
+
+    return {'cutoff': cutoff.isoformat(), 'archived': archived, 'files': files}
+
+
+def archive_files(start_date, end_date):
+    """日期范围（包含两端）内的归档文件，按日期和文件名排序"""
+    day = start_date
+    while day <= end_date:
+        directory = day_dir(day)
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(ARCHIVE_SUFFIXES):
+                    yield os.path.join(directory, name)
+        day += timedelta(days=1)
+
+
+def iter_archived_logs(start_date, end_date, connection_id=None, status=None):
+    """
+    流式读取日期范围（包含两端）内的归档日志
+
+    Args:
+        start_date: 开始日期
+        end_date: 结束日期
+        connection_id: 只返回该连接的日志
+        status: 只返回该状态的日志
+
+    Yields:
+        每条日志的JSON文本（不含换行符）
+    """
+    connection_id = str(connection_id) if connection_id else None
+    for path in archive_files(start_date, end_date):
+        with _open_reader(path) as reader:
+            for line in reader:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                if connection_id or status:
+                    row = json.loads(line)
+                    if connection_id and row.get('connection_id') != connection_id:
+                        continue
+                    if status and row.get('status') != status:
+                        continue
+                yield line
@@ -0,0 +1,376 @@
+"""
+API连接器的asyncio版本
+
+AsyncAPIConnector 与 APIConnector 共享请求头、URL参数和百度access_token的处理逻辑，
+但使用 httpx.AsyncClient 发送请求，等待上游响应时不会占用工作线程。
+gather_calls 可以在一个事件循环中以有限并发批量发起调用；
+astream_chat 以异步生成器的方式转发上游的流式(SSE)响应。
+"""
+
+import time
+import json
+import asyncio
+import logging
+import weakref
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .rate_limit import rate_limiter, RateLimitExceeded
+from .response_cache import response_cache, request_cache_key
+from .metrics import latency_metrics
+from .tokens import token_budget
+from .retry import RetryPolicy
+from .utils import APIConnector, StreamStats, parse_sse_line, SSE_DONE
+
+logger = logging.getLogger(__name__)
+
+# 每个事件循环各自持有的客户端：loop -> {(connection_id, base_url): AsyncClient}
+_loop_clients = weakref.WeakKeyDictionary()
+# 每个事件循环的关闭钩子，事件循环只弱引用异步生成器，需要在这里保持强引用
+_loop_closers = weakref.WeakKeyDictionary()
+
+
+async def _close_clients_on_shutdown(clients):
+    """
+    事件循环关闭时关闭该循环的客户端
+
+    asyncio.run 和 async_to_sync 在关闭事件循环前都会调用 shutdown_asyncgens，
+    停在yield处的异步生成器此时会被关闭，从而执行finally中的清理。
+    """
+    try:
+        yield
+    finally:
+        for client in list(clients.values()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭AsyncClient失败: {str(e)}")
+        clients.clear()
+
+
+def _loop_client_map(loop):
+    """获取事件循环的客户端字典，首次访问时注册关闭钩子"""
+    clients = _loop_clients.get(loop)
+    if clients is None:
+        clients = _loop_clients[loop] = {}
+        closer = _loop_closers[loop] = _close_clients_on_shutdown(clients)
+        # 同步推进到第一个yield，使事件循环开始跟踪该异步生成器
+        try:
+            closer.__anext__().send(None)
+        except StopIteration:
+            pass
+    return clients
+
+
+def _get_client(connection):
+    """获取当前事件循环中该连接复用的AsyncClient，事件循环关闭时自动关闭"""
+    loop = asyncio.get_running_loop()
+    clients = _loop_client_map(loop)
+    key = (str(connection.id), connection.provider.base_url)
+    client = clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=60,
+            limits=httpx.Limits(
+                max_connections=getattr(settings, 'API_CONNECTOR_POOL_MAXSIZE', 20),
+                max_keepalive_connections=getattr(settings, 'API_CONNECTOR_POOL_MAXSIZE', 20),
+            ),
+        )
+        clients[key] = client
+    return client
+
+
+class AsyncAPIConnector(APIConnector):
+    """异步API连接器，在事件循环中调用外部API"""
+
+    def __init__(self, connection_id=None, provider_type=None, client=None):
+        """
+        初始化异步API连接器（会查询数据库，在异步代码中请使用 create）
+
+        Args:
+            connection_id: API连接的ID
+            provider_type: API提供商类型
+            client: 可选的 httpx.AsyncClient，未提供时使用当前事件循环的共享客户端
+        """
+        super().__init__(connection_id=connection_id, provider_type=provider_type)
+        # 预先加载提供商，避免在事件循环中触发惰性查询
+        self.connection.provider
+        self.client = client
+
+    @classmethod
+    async def create(cls, connection_id=None, provider_type=None, client=None):
+        """在异步上下文中创建连接器"""
+        return await sync_to_async(cls)(
+            connection_id=connection_id, provider_type=provider_type, client=client
+        )
+
+    def _client(self):
+        return getattr(self, 'client', None) or _get_client(self.connection)
+
+    async def _aauth_params(self):
+        """获取动态认证参数（如百度access_token），可能需要请求OAuth接口，在线程池中执行"""
+        return await sync_to_async(self.adapter.auth_params, thread_sensitive=False)()
+
+    async def acall_api(self, endpoint, method='POST', data=None, params=None,
+                        additional_headers=None, user_ip=None, log_usage=True,
+                        rate_limit_mode=None, use_cache=False, cache_timeout=None,
+                        token_limit_mode=None):
+        """
+        异步调用API接口，参数和返回值与 APIConnector.call_api 一致
+
+        只发送一个请求，不按提供商的重试策略重试。
+        """
+        url, headers, request_params = self._prepare_request(endpoint, params, additional_headers)
+
+        # 相同请求命中缓存时直接返回
+        cache_key = None
+        if use_cache:
+            cache_key = request_cache_key(self.connection.id, method, endpoint, data, request_params)
+            cached = await sync_to_async(self._cached_response)(
+                cache_key, endpoint, data, user_ip, log_usage
+            )
+            if cached is not None:
+                return cached
+
+        # 检查令牌限制和每日预算
+        data, estimated_tokens, reserved, rejected = await sync_to_async(self._check_tokens)(
+            endpoint, data, user_ip, log_usage, token_limit_mode
+        )
+        if rejected is not None:
+            return rejected
+
+        # 检查速率限制
+        try:
+            await rate_limiter.aacquire(self.connection, mode=rate_limit_mode)
+        except RateLimitExceeded as e:
+            if reserved:
+                await sync_to_async(self._settle_tokens)(reserved, None)
+            return await sync_to_async(self._rate_limited_response)(
+                e, endpoint, data, user_ip, log_usage
+            )
+
+        # 需要动态认证参数的提供商（如百度access_token）
+        if self.adapter.dynamic_auth:
+            request_params.update(await self._aauth_params())
+
+        # 记录开始时间
+        start_time = time.time()
+        status = 'failed'
+        error_message = None
+        tokens_used = 0
+        response_data = None
+
+        try:
+            client = self._client()
+            if method.upper() == 'GET':
+                response = await client.get(url, headers=headers, params=request_params)
+            elif method.upper() == 'POST':
+                json_data = json.dumps(data) if data else None
+                response = await client.post(url, headers=headers, params=request_params, content=json_data)
+            else:
+                response = await client.request(method, url, headers=headers, params=request_params, json=data)
+
+            # 处理响应
+            response_data = self._handle_response(response, endpoint)
+            status, error_message, tokens_used = self._parse_result(response_data)
+            if self.adapter.dynamic_auth and self.adapter.is_auth_error(response_data):
+                await sync_to_async(self.adapter.invalidate_auth)()
+            if cache_key and status == 'success':
+                await sync_to_async(response_cache.set)(cache_key, response_data, cache_timeout)
+        except httpx.TimeoutException:
+            status = 'failed'
+            error_message = "API请求超时"
+            response_data = {'error': True, 'message': error_message}
+        except httpx.HTTPError as e:
+            status = 'failed'
+            error_message = f"API请求异常: {str(e)}"
+            response_data = {'error': True, 'message': error_message}
+        except asyncio.CancelledError:
+            if reserved:
+                await sync_to_async(self._settle_tokens)(reserved, None)
+            if log_usage:
+                await sync_to_async(self._log_usage)(
+                    endpoint=endpoint,
+                    request_data=data,
+                    response_data=None,
+                    status='cancelled',
+                    error_message="请求已取消",
+                    response_time=(time.time() - start_time) * 1000,
+                    user_ip=user_ip,
+                    estimated_tokens=estimated_tokens
+                )
+            raise
+        except Exception as e:
+            status = 'error'
+            error_message = f"API调用过程中发生错误: {str(e)}"
+            response_data = {'error': True, 'message': error_message}
+
+        # 计算响应时间
+        response_time = (time.time() - start_time) * 1000  # 转换为毫秒
+        self._record_latency(endpoint, status, response_time)
+        if reserved:
+            await sync_to_async(self._settle_tokens)(reserved, response_data)
+
+        # 记录使用日志
+        if log_usage:
+            await sync_to_async(self._log_usage)(
+                endpoint=endpoint,
+                request_data=data,
+                response_data=response_data,
+                status=status,
+                error_message=error_message,
+                tokens_used=tokens_used,
+                response_time=response_time,
+                user_ip=user_ip,
+                estimated_tokens=estimated_tokens
+            )
+
+        return response_data
+
+    async def astream_api(self, endpoint, data=None, params=None, additional_headers=None,
+                          user_ip=None, log_usage=True, rate_limit_mode=None, token_limit_mode=None):
+        """
+        异步流式调用API接口，参数和产出的数据与 APIConnector.stream_api 一致
+        """
+        # 检查令牌限制和每日预算
+        data, estimated_tokens, reserved, rejected = await sync_to_async(self._check_tokens)(
+            endpoint, dict(data or {}), user_ip, log_usage, token_limit_mode
+        )
+        if rejected is not None:
+            yield rejected
+            return
+
+        # 检查速率限制
+        try:
+            await rate_limiter.aacquire(self.connection, mode=rate_limit_mode)
+        except RateLimitExceeded as e:
+            if reserved:
+                await sync_to_async(self._settle_tokens)(reserved, None)
+            yield await sync_to_async(self._rate_limited_response)(
+                e, endpoint, data, user_ip, log_usage
+            )
+            return
+
+        url, headers, request_params = self._prepare_request(endpoint, params, additional_headers)
+        headers['Accept'] = 'text/event-stream'
+        if self.adapter.dynamic_auth:
+            request_params.update(await self._aauth_params())
+
+        request_data = dict(data or {})
+        request_data.setdefault('stream', True)
+
+        timeout = RetryPolicy.for_provider(self.connection.provider).timeout
+        stats = StreamStats()
+        try:
+            async with self._client().stream('POST', url, headers=headers, params=request_params,
+                                             content=json.dumps(request_data), timeout=timeout) as response:
+                if not 200 <= response.status_code < 300:
+                    await response.aread()
+                    error = self._handle_response(response, endpoint)
+                    yield stats.fail(error.get('message', '未知错误'), 'error')
+                    return
+
+                async for line in response.aiter_lines():
+                    chunk = parse_sse_line(line)
+                    if chunk is None:
+                        continue
+                    if chunk == SSE_DONE:
+                        break
+                    error = stats.add_chunk(chunk)
+                    if error:
+                        yield error
+                        return
+                    yield chunk
+            stats.status = 'success'
+        except (GeneratorExit, asyncio.CancelledError):
+            # 客户端断开连接
+            stats.fail('客户端在流式响应结束前断开连接')
+            raise
+        except httpx.TimeoutException:
+            yield stats.fail("API请求超时")
+        except httpx.HTTPError as e:
+            yield stats.fail(f"API请求异常: {str(e)}")
+        except Exception as e:
+            yield stats.fail(f"API调用过程中发生错误: {str(e)}", 'error')
+        finally:
+            latency_metrics.observe(self.connection.id, endpoint, stats.status, stats.response_time)
+            if reserved:
+                await sync_to_async(token_budget.settle)(
+                    self.connection, reserved, stats.settled_tokens(reserved.tokens)
+                )
+            if log_usage:
+                await sync_to_async(self._log_usage)(
+                    endpoint=endpoint,
+                    request_data=request_data,
+                    response_data=stats.response_data(),
+                    status=stats.status,
+                    error_message=stats.error_message,
+                    tokens_used=stats.tokens_used,
+                    response_time=stats.response_time,
+                    user_ip=user_ip,
+                    estimated_tokens=estimated_tokens
+                )
+
+
+async def acall_chat(connector, prompt, model=None, user_ip=None):
+    """使用异步连接器发送一次对话请求，返回格式与 call_openai_api 一致"""
+    adapter = connector.adapter
+    response = await connector.acall_api(
+        endpoint=adapter.chat_endpoint_for(model),
+        data=adapter.build_chat_request(prompt, model),
+        user_ip=user_ip
+    )
+    return adapter.parse_chat_response(response)
+
+
+async def astream_chat(connector, prompt, model=None, user_ip=None):
+    """使用异步连接器发送一次流式对话请求，产出格式与 call_openai_api(stream=True) 一致"""
+    adapter = connector.adapter
+    chunks = connector.astream_api(
+        endpoint=adapter.chat_endpoint_for(model),
+        data=adapter.build_chat_request(prompt, model, stream=True),
+        user_ip=user_ip
+    )
+    async for chunk in chunks:
+        yield adapter.parse_stream_chunk(chunk)
+
+
+async def gather_calls(prompts, concurrency=10, connection_id=None, provider_type='openai',
+                       model=None, user_ip=None):
+    """
+    在一个事件循环中并发发送多条提示词，最多同时进行 concurrency 个请求
+
+    同步代码（如Celery任务）可以通过 asyncio.run(gather_calls(...)) 调用。
+
+    Args:
+        prompts: 提示词列表
+        concurrency: 最大并发请求数
+        connection_id: API连接ID，未提供时使用 provider_type 的默认连接
+        provider_type: API提供商类型
+        model: 使用的模型，未提供时使用提供商适配器的默认模型
+        user_ip: 用户IP，用于日志记录
+
+    Returns:
+        与 prompts 顺序一致的结果列表
+    """
+    concurrency = max(1, int(concurrency))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        connector = await AsyncAPIConnector.create(
+            connection_id=connection_id,
+            provider_type=provider_type if not connection_id else None,
+            client=client
+        )
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(prompt):
+            async with semaphore:
+                try:
+                    return await acall_chat(connector, prompt, model=model, user_ip=user_ip)
+                except Exception as e:
+                    logger.exception(f"并发调用API时出错: {str(e)}")
+                    return {'success': False, 'error': str(e)}
+
+        return await asyncio.gather(*(run(prompt) for prompt in prompts))
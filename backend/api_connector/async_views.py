@@ -0,0 +1,178 @@
+"""
+API连接服务的异步视图
+
+这些视图是原生的Django异步视图，需要通过 big_model_app/asgi.py 以ASGI方式部署，
+在等待上游API响应期间不会占用工作线程。
+"""
+
+import json
+import uuid
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .async_utils import AsyncAPIConnector, astream_chat, gather_calls
+from .utils import format_sse_event, SSE_DONE
+
+logger = logging.getLogger(__name__)
+
+
+def _authenticate(request):
+    """使用JWT认证请求，返回用户或None"""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if result is None:
+        return None
+    user, _ = result
+    return user if user.is_active else None
+
+
+def _get_client_ip(request):
+    """获取客户端IP"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return request.META.get('REMOTE_ADDR')
+
+
+def _invalid_connection_id(connection_id):
+    """connection_id不是合法的UUID时返回400响应，否则返回None"""
+    if not connection_id:
+        return None
+    try:
+        uuid.UUID(str(connection_id))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'connection_id格式无效'}, status=400)
+    return None
+
+
+async def gather_view(request):
+    """
+    并发调用API
+
+    请求体:
+        prompts: 提示词列表
+        connection_id: API连接ID（可选）
+        provider_type: API提供商类型，未指定connection_id时使用，默认openai
+        model: 模型标识符（可选）
+        concurrency: 最大并发数（可选）
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'status': 'error', 'message': '身份认证失败'}, status=401)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': '请求体必须是JSON格式'}, status=400)
+
+    prompts = payload.get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        return JsonResponse({'status': 'error', 'message': 'prompts必须是非空列表'}, status=400)
+
+    max_prompts = getattr(settings, 'API_CONNECTOR_GATHER_MAX_PROMPTS', 1000)
+    if len(prompts) > max_prompts:
+        return JsonResponse(
+            {'status': 'error', 'message': f'单次最多提交{max_prompts}条提示词'}, status=400
+        )
+
+    max_concurrency = getattr(settings, 'API_CONNECTOR_GATHER_MAX_CONCURRENCY', 50)
+    try:
+        concurrency = min(int(payload.get('concurrency', 10)), max_concurrency)
+    except (TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'concurrency必须是整数'}, status=400)
+
+    invalid = _invalid_connection_id(payload.get('connection_id'))
+    if invalid is not None:
+        return invalid
+
+    kwargs = {
+        'concurrency': concurrency,
+        'connection_id': payload.get('connection_id'),
+        'provider_type': payload.get('provider_type', 'openai'),
+        'user_ip': _get_client_ip(request),
+    }
+    if payload.get('model'):
+        kwargs['model'] = payload['model']
+
+    try:
+        results = await gather_calls(prompts, **kwargs)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    except Exception as e:
+        logger.exception(f"并发调用API时出错: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': f'并发调用发生错误: {str(e)}'}, status=500)
+
+    return JsonResponse({
+        'status': 'success',
+        'total': len(results),
+        'succeeded': sum(1 for result in results if result.get('success')),
+        'results': results
+    })
+
+
+async def stream_view(request):
+    """
+    流式对话，以SSE格式逐块返回生成的内容
+
+    请求体:
+        prompt: 提示词
+        connection_id: API连接ID（可选）
+        provider_type: API提供商类型，未指定connection_id时使用，默认openai
+        model: 模型标识符（可选）
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'status': 'error', 'message': '身份认证失败'}, status=401)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': '请求体必须是JSON格式'}, status=400)
+
+    prompt = payload.get('prompt')
+    if not prompt:
+        return JsonResponse({'status': 'error', 'message': 'prompt不能为空'}, status=400)
+
+    connection_id = payload.get('connection_id')
+    invalid = _invalid_connection_id(connection_id)
+    if invalid is not None:
+        return invalid
+    try:
+        connector = await AsyncAPIConnector.create(
+            connection_id=connection_id,
+            provider_type=payload.get('provider_type', 'openai') if not connection_id else None
+        )
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    kwargs = {'user_ip': _get_client_ip(request)}
+    if payload.get('model'):
+        kwargs['model'] = payload['model']
+
+    async def events():
+        async for chunk in astream_chat(connector, prompt, **kwargs):
+            yield format_sse_event(chunk)
+        yield format_sse_event(SSE_DONE)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 禁止Nginx缓冲，数据块到达后立即转发给客户端
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Django 4.2 的 csrf_exempt 装饰器不支持异步视图，直接标记豁免；接口仅接受JWT认证
+gather_view.csrf_exempt = True
+stream_view.csrf_exempt = True
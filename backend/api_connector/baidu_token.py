@@ -0,0 +1,164 @@
+"""
+百度API access_token 的获取与刷新
+
+token在缓存中保存为 {'token': ..., 'expires_at': ...}，过期时间取自百度返回的 expires_in。
+- 距离过期不足 API_CONNECTOR_BAIDU_TOKEN_REFRESH_MARGIN 秒时，由一个后台线程提前刷新，
+  刷新期间和刷新失败时调用方继续使用仍然有效的旧token，token过期不会造成请求延迟尖峰
+- 缓存中没有可用token时，同一进程内用线程锁、多个进程之间用缓存锁保证只有一个请求
+  访问OAuth接口，其他请求等待它的结果（single-flight）
+- 获取失败时不写入缓存，下一次调用会重新获取
+"""
+
+import time
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import cache
+
+from .session_pool import get_session
+
+logger = logging.getLogger(__name__)
+
+BAIDU_TOKEN_URL = "https://aip.baidubce.com/oauth/2.0/token"
+BAIDU_TOKEN_DEFAULT_LIFETIME = 60 * 60 * 23  # 响应中没有expires_in时假定的有效期(秒)
+# 表示access_token无效或过期的百度错误码
+BAIDU_TOKEN_ERROR_CODES = {110, 111}
+
+
+class BaiduTokenManager:
+    """按API连接管理百度access_token"""
+
+    def __init__(self, refresh_margin=None, request_timeout=None):
+        """
+        初始化token管理器
+
+        Args:
+            refresh_margin: 距离过期多少秒时提前刷新，默认读取 API_CONNECTOR_BAIDU_TOKEN_REFRESH_MARGIN
+            request_timeout: 请求OAuth接口的超时时间(秒)，默认读取 API_CONNECTOR_BAIDU_TOKEN_TIMEOUT
+        """
+        self.refresh_margin = refresh_margin or getattr(settings, 'API_CONNECTOR_BAIDU_TOKEN_REFRESH_MARGIN', 3600)
+        self.request_timeout = request_timeout or getattr(settings, 'API_CONNECTOR_BAIDU_TOKEN_TIMEOUT', 10)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._refreshing = set()
+
+    @staticmethod
+    def cache_key(connection):
+        return f'baidu_access_token_{connection.id}'
+
+    def _local_lock(self, connection):
+        with self._locks_lock:
+            return self._locks.setdefault(connection.id, threading.Lock())
+
+    def _read(self, connection):
+        """读取缓存中的token，返回 (token, expires_at)，没有时返回 (None, 0)"""
+        entry = cache.get(self.cache_key(connection))
+        if isinstance(entry, dict) and entry.get('token'):
+            return entry['token'], entry.get('expires_at', 0)
+        return None, 0
+
+    def fetch(self, connection):
+        """
+        请求OAuth接口获取新的token并写入缓存
+
+        Returns:
+            (token, expires_at)，失败时返回 (None, 0)
+        """
+        params = {
+            'grant_type': 'client_credentials',
+            'client_id': connection.api_key,
+            'client_secret': connection.api_secret
+        }
+
+        try:
+            response = get_session(connection).post(BAIDU_TOKEN_URL, params=params, timeout=self.request_timeout)
+            result = response.json()
+        except Exception as e:
+            logger.exception(f"获取百度API access_token时出错: {str(e)}")
+            return None, 0
+
+        token = result.get('access_token')
+        if not token:
+            logger.error(f"获取百度API access_token失败: {result.get('error_description') or result}")
+            return None, 0
+
+        lifetime = int(result.get('expires_in') or BAIDU_TOKEN_DEFAULT_LIFETIME)
+        expires_at = time.time() + lifetime
+        cache.set(self.cache_key(connection), {'token': token, 'expires_at': expires_at}, lifetime)
+        return token, expires_at
+
+    def _fetch_single_flight(self, connection):
+        """跨进程只允许一个调用方获取token，其他调用方等待其结果"""
+        lock_key = f'{self.cache_key(connection)}_lock'
+        lock_timeout = self.request_timeout + 5
+        if cache.add(lock_key, 1, lock_timeout):
+            try:
+                return self.fetch(connection)
+            finally:
+                cache.delete(lock_key)
+
+        # 其他进程正在获取，等待它写入缓存
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            token, expires_at = self._read(connection)
+            if token and expires_at > time.time():
+                return token, expires_at
+            if cache.get(lock_key) is None:
+                break
+        # 持有锁的进程失败或超时，自己获取
+        return self.fetch(connection)
+
+    def _refresh_in_background(self, connection):
+        """在后台线程中提前刷新token，同一连接同时只有一个刷新线程"""
+        with self._locks_lock:
+            if connection.id in self._refreshing:
+                return
+            self._refreshing.add(connection.id)
+
+        def run():
+            try:
+                lock_key = f'{self.cache_key(connection)}_lock'
+                # 其他进程已经在刷新时直接放弃
+                if cache.add(lock_key, 1, self.request_timeout + 5):
+                    try:
+                        self.fetch(connection)
+                    finally:
+                        cache.delete(lock_key)
+            except Exception as e:
+                logger.exception(f"后台刷新百度API access_token时出错: {str(e)}")
+            finally:
+                with self._locks_lock:
+                    self._refreshing.discard(connection.id)
+
+        threading.Thread(target=run, name='baidu-token-refresh', daemon=True).start()
+
+    def get_token(self, connection):
+        """
+        获取连接的access_token
+
+        Returns:
+            有效的token，获取失败且没有可用的旧token时返回None
+        """
+        token, expires_at = self._read(connection)
+        now = time.time()
+        if token and expires_at > now:
+            if expires_at - now < self.refresh_margin:
+                self._refresh_in_background(connection)
+            return token
+
+        with self._local_lock(connection):
+            # 等待锁期间其他线程可能已经获取到了
+            token, expires_at = self._read(connection)
+            if token and expires_at > time.time():
+                return token
+            token, _ = self._fetch_single_flight(connection)
+            return token
+
+    def invalidate(self, connection):
+        """丢弃缓存的token（密钥变更或上游报告token无效时）"""
+        cache.delete(self.cache_key(connection))
+
+
+# 进程级的全局token管理器
+baidu_token_manager = BaiduTokenManager()
@@ -0,0 +1,278 @@
+"""
+同一提供商多个API连接之间的负载均衡和故障转移
+
+BalancedAPIConnector 把调用分散到某个提供商类型的全部活跃连接上：
+- least_outstanding：选择当前未完成请求最少的连接，相同时选择EWMA延迟较低的连接
+- ewma：按 EWMA延迟 × (未完成请求数 + 1) 选择得分最低的连接
+
+每个连接有一个熔断器：连续失败 API_CONNECTOR_BREAKER_FAILURES 次后断开（open），
+在 API_CONNECTOR_BREAKER_COOLDOWN 秒内不再被选中；冷却结束后进入半开（half_open）
+状态，只放行一个探测请求，成功则恢复（closed），失败则重新断开。
+遇到超时、网络错误、429、5xx 或本地限流等可重试的错误时，改用另一个健康的连接重试。
+
+这些状态只保存在当前进程内，各个工作进程独立地做出判断。
+"""
+
+import time
+import logging
+import threading
+from django.conf import settings
+
+from .registry import connection_registry
+from .utils import APIConnector
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+EWMA_ALPHA = 0.3  # 新样本在EWMA延迟中的权重
+
+# 可以换一个连接重试的上游状态码
+RETRIABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_retriable(response_data):
+    """判断调用结果是否为可以换连接重试的错误"""
+    if not isinstance(response_data, dict) or not response_data.get('error'):
+        return False
+    if response_data.get('rate_limited'):
+        return True
+    status_code = response_data.get('status_code')
+    # 没有状态码说明是超时或网络错误
+    return status_code is None or status_code in RETRIABLE_STATUS_CODES
+
+
+class ConnectionHealth:
+    """单个连接的负载和熔断状态"""
+
+    def __init__(self):
+        self.outstanding = 0
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+        self.total_requests = 0
+        self.total_failures = 0
+
+    def available(self, now, cooldown):
+        """连接当前是否可以被选中；冷却结束的断开连接转为半开状态"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= cooldown:
+            self.state = HALF_OPEN
+            self.probing = False
+        # 半开状态只放行一个探测请求
+        return self.state == HALF_OPEN and not self.probing
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'outstanding': self.outstanding,
+            'ewma_latency': self.ewma_latency,
+            'consecutive_failures': self.consecutive_failures,
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures,
+        }
+
+
+class LoadBalancer:
+    """进程内的连接选择器和熔断器"""
+
+    def __init__(self, strategy=None, failure_threshold=None, cooldown=None):
+        """
+        初始化负载均衡器
+
+        Args:
+            strategy: 选择策略，'least_outstanding' 或 'ewma'，默认读取 API_CONNECTOR_BALANCE_STRATEGY
+            failure_threshold: 连续失败多少次后断开，默认读取 API_CONNECTOR_BREAKER_FAILURES
+            cooldown: 断开后多少秒再探测，默认读取 API_CONNECTOR_BREAKER_COOLDOWN
+        """
+        self.strategy = strategy or getattr(settings, 'API_CONNECTOR_BALANCE_STRATEGY', 'least_outstanding')
+        self.failure_threshold = failure_threshold or getattr(settings, 'API_CONNECTOR_BREAKER_FAILURES', 5)
+        self.cooldown = cooldown or getattr(settings, 'API_CONNECTOR_BREAKER_COOLDOWN', 30)
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def _get_health(self, connection_id):
+        health = self._health.get(connection_id)
+        if health is None:
+            health = self._health.setdefault(connection_id, ConnectionHealth())
+        return health
+
+    def _score(self, health):
+        # 还没有延迟样本的连接优先被选中，以便尽快获得样本
+        latency = health.ewma_latency or 0.0
+        if self.strategy == 'ewma':
+            return (latency * (health.outstanding + 1), health.outstanding)
+        return (health.outstanding, latency)
+
+    def acquire(self, candidates, exclude=()):
+        """
+        从候选连接中选择一个并把它的未完成请求数加一
+
+        Args:
+            candidates: ResolvedConnection 列表
+            exclude: 本次调用中已经尝试过的连接ID
+
+        Returns:
+            选中的 ResolvedConnection，没有可用连接时返回None
+        """
+        now = time.monotonic()
+        with self._lock:
+            best = None
+            best_score = None
+            for resolved in candidates:
+                connection_id = resolved.connection.id
+                if connection_id in exclude:
+                    continue
+                health = self._get_health(connection_id)
+                if not health.available(now, self.cooldown):
+                    continue
+                score = self._score(health)
+                if best is None or score < best_score:
+                    best, best_score = resolved, score
+            if best is not None:
+                health = self._get_health(best.connection.id)
+                health.outstanding += 1
+                health.total_requests += 1
+                if health.state == HALF_OPEN:
+                    health.probing = True
+            return best
+
+    def release(self, connection_id, latency, success):
+        """
+        记录一次调用的结果
+
+        Args:
+            connection_id: 连接ID
+            latency: 响应时间(ms)
+            success: 是否成功；可重试的错误视为失败，计入熔断
+        """
+        with self._lock:
+            health = self._get_health(connection_id)
+            health.outstanding = max(0, health.outstanding - 1)
+            if success:
+                if health.ewma_latency is None:
+                    health.ewma_latency = latency
+                else:
+                    health.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * health.ewma_latency
+                health.consecutive_failures = 0
+                if health.state != CLOSED:
+                    logger.info(f"API连接 {connection_id} 探测成功，恢复使用")
+                health.state = CLOSED
+                health.probing = False
+                return
+
+            health.total_failures += 1
+            health.consecutive_failures += 1
+            if health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+                if health.state != OPEN:
+                    logger.warning(
+                        f"API连接 {connection_id} 连续失败{health.consecutive_failures}次，"
+                        f"暂停使用{self.cooldown}秒"
+                    )
+                health.state = OPEN
+                health.opened_at = time.monotonic()
+                health.probing = False
+
+    def cancel(self, connection_id):
+        """调用没有真正发往上游（如被本地限流拒绝），只释放未完成请求计数"""
+        with self._lock:
+            health = self._get_health(connection_id)
+            health.outstanding = max(0, health.outstanding - 1)
+            health.probing = False
+
+    def snapshot(self, connection_ids):
+        """返回连接的负载和熔断状态"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for connection_id in connection_ids:
+                health = self._get_health(connection_id)
+                # 刷新冷却结束的连接状态
+                health.available(now, self.cooldown)
+                result[str(connection_id)] = health.snapshot()
+            return result
+
+
+# 进程级的全局负载均衡器
+load_balancer = LoadBalancer()
+
+
+class BalancedAPIConnector:
+    """在某个提供商类型的全部活跃连接之间负载均衡的API连接器"""
+
+    def __init__(self, provider_type, balancer=None, max_attempts=None):
+        """
+        初始化负载均衡连接器
+
+        Args:
+            provider_type: API提供商类型
+            balancer: 负载均衡器，默认使用进程级的全局实例
+            max_attempts: 单次调用最多尝试的连接数，默认读取 API_CONNECTOR_FAILOVER_ATTEMPTS
+        """
+        self.provider_type = provider_type
+        self.balancer = balancer or load_balancer
+        self.max_attempts = max_attempts or getattr(settings, 'API_CONNECTOR_FAILOVER_ATTEMPTS', 3)
+        if not connection_registry.get_pool(provider_type):
+            raise ValueError(f"无法找到类型为{provider_type}的活跃API连接")
+
+    def call_api(self, endpoint, method='POST', data=None, params=None,
+                 additional_headers=None, user_ip=None, log_usage=True,
+                 rate_limit_mode=None, **kwargs):
+        """
+        调用API接口，参数和返回值与 APIConnector.call_api 一致
+
+        遇到可重试的错误时换用另一个连接，最多尝试 max_attempts 个连接；
+        除最后一次外都不等待本地限流令牌，被限流的连接直接让给其他连接。
+        """
+        pool = connection_registry.get_pool(self.provider_type)
+        attempts = min(self.max_attempts, len(pool))
+        tried = set()
+        response_data = None
+
+        for attempt in range(attempts):
+            resolved = self.balancer.acquire(pool, exclude=tried)
+            if resolved is None:
+                break
+            connection = resolved.connection
+            tried.add(connection.id)
+            last_attempt = attempt == attempts - 1
+
+            connector = APIConnector.from_resolved(resolved)
+            start_time = time.time()
+            result = None
+            try:
+                result = connector.call_api(
+                    endpoint, method=method, data=data, params=params,
+                    additional_headers=additional_headers, user_ip=user_ip,
+                    log_usage=log_usage,
+                    rate_limit_mode=rate_limit_mode if last_attempt else 'reject',
+                    **kwargs
+                )
+            finally:
+                if isinstance(result, dict) and result.get('rate_limited'):
+                    # 本地限流不是连接故障
+                    self.balancer.cancel(connection.id)
+                else:
+                    latency = (time.time() - start_time) * 1000
+                    self.balancer.release(connection.id, latency, result is not None and not is_retriable(result))
+
+            response_data = result
+            if not is_retriable(response_data):
+                return response_data
+            logger.warning(
+                f"API连接 {connection.name} 调用失败({response_data.get('message', '未知错误')})，"
+                f"尝试其他连接"
+            )
+
+        if response_data is None:
+            return {
+                'error': True,
+                'status_code': 503,
+                'message': f"类型为{self.provider_type}的API连接均暂时不可用"
+            }
+        return response_data
@@ -0,0 +1,211 @@
+"""
+批量提示词调用
+
+run_batch 以有限并发把一批提示词发往同一个API连接，遵守连接的速率限制（等待令牌），
+按完成顺序逐条产出结果；APIConnectionViewSet.batch 把结果以NDJSON流式返回。
+异步模式下输入写入 MEDIA_ROOT/api_batches/<任务ID>/，由Celery任务 run_prompt_batch 执行，
+结果逐行追加到同目录的 results.jsonl，进度保存在 status.json 中。
+"""
+
+import os
+import json
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .utils import APIConnector, call_chat
+
+logger = logging.getLogger(__name__)
+
+# 单条提示词被本地限流拒绝后的最大重试次数
+RATE_LIMIT_RETRIES = 3
+
+
+def parse_jsonl(lines):
+    """
+    解析JSONL格式的提示词，每行一个JSON字符串或JSON对象，格式见 parse_prompts
+
+    Raises:
+        ValueError: 某一行不是合法的JSON或缺少prompt
+    """
+    entries = []
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            raise ValueError(f"第{line_no}行不是合法的JSON")
+    return parse_prompts(entries)
+
+
+def parse_prompts(entries):
+    """
+    规范化提示词列表
+
+    每一项可以是提示词字符串，也可以是包含 prompt（以及可选的 id、model）的字典。
+
+    Returns:
+        [{'index': 序号, 'id': 调用方ID, 'prompt': 提示词, 'model': 模型或None}]
+
+    Raises:
+        ValueError: 某一项缺少prompt
+    """
+    items = []
+    for position, entry in enumerate(entries, start=1):
+        if isinstance(entry, str):
+            entry = {'prompt': entry}
+        if not isinstance(entry, dict) or not entry.get('prompt'):
+            raise ValueError(f"第{position}条提示词缺少prompt")
+
+        index = len(items)
+        items.append({
+            'index': index,
+            'id': entry.get('id', index),
+            'prompt': entry['prompt'],
+            'model': entry.get('model'),
+        })
+    return items
+
+
+def _run_one(connector, item, model, user_ip):
+    """执行一条提示词，被本地限流拒绝时重试"""
+    try:
+        return _call_with_retries(connector, item, model, user_ip)
+    finally:
+        # 在线程池线程中执行，调用过程中会读写数据库（令牌预算、使用日志），用完后关闭本线程的连接
+        close_old_connections()
+
+
+def _call_with_retries(connector, item, model, user_ip):
+    for _ in range(RATE_LIMIT_RETRIES + 1):
+        try:
+            result = call_chat(
+                connector, item['prompt'], model=item['model'] or model,
+                user_ip=user_ip, rate_limit_mode='wait'
+            )
+        except Exception as e:
+            logger.exception(f"批量调用第{item['index']}条提示词时出错: {str(e)}")
+            result = {'success': False, 'error': str(e)}
+        details = result.get('details') or {}
+        # 超出每日令牌预算时重试没有意义
+        if result.get('success') or not details.get('rate_limited') or details.get('budget_exceeded'):
+            break
+    return dict(result, index=item['index'], id=item['id'])
+
+
+def run_batch(connection, items, concurrency=5, model=None, user_ip=None):
+    """
+    以有限并发执行一批提示词，按完成顺序产出结果
+
+    Args:
+        connection: API连接（已加载提供商）
+        items: parse_prompts 的返回值
+        concurrency: 最大并发数
+        model: 未逐条指定时使用的模型，为None时使用提供商适配器的默认模型
+        user_ip: 用户IP，用于日志记录
+
+    Yields:
+        {'index', 'id', 'success', 'content' 或 'error', 'usage'}
+    """
+    connector = APIConnector.from_connection(connection)
+    executor = ThreadPoolExecutor(max_workers=max(1, int(concurrency)), thread_name_prefix='api-batch')
+    try:
+        futures = [executor.submit(_run_one, connector, item, model, user_ip) for item in items]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # 客户端断开时取消尚未开始的调用
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_job_dir(job_id):
+    """异步批量任务的目录"""
+    return os.path.join(settings.MEDIA_ROOT, 'api_batches', str(job_id))
+
+
+def write_job_status(job_id, **status):
+    """更新异步批量任务的状态文件"""
+    path = os.path.join(batch_job_dir(job_id), 'status.json')
+    current = read_job_status(job_id) or {}
+    current.update(status, updated_at=timezone.now().isoformat())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return current
+
+
+def read_job_status(job_id):
+    """读取异步批量任务的状态，任务不存在时返回None"""
+    path = os.path.join(batch_job_dir(job_id), 'status.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def create_batch_job(connection, items, concurrency, model, user_ip):
+    """保存输入并创建异步批量任务的状态文件，返回任务ID"""
+    job_id = uuid.uuid4().hex
+    job_dir = batch_job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    with open(os.path.join(job_dir, 'input.jsonl'), 'w', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    write_job_status(
+        job_id,
+        id=job_id,
+        connection_id=str(connection.id),
+        status='pending',
+        total=len(items),
+        completed=0,
+        succeeded=0,
+        concurrency=concurrency,
+        model=model,
+        user_ip=user_ip,
+        created_at=timezone.now().isoformat(),
+    )
+    return job_id
+
+
+def execute_batch_job(job_id):
+    """执行异步批量任务，结果逐行写入 results.jsonl"""
+    from .models import APIConnection
+
+    status = read_job_status(job_id)
+    if status is None:
+        raise ValueError(f"批量任务 {job_id} 不存在")
+
+    job_dir = batch_job_dir(job_id)
+    connection = APIConnection.objects.select_related('provider').get(id=status['connection_id'])
+    with open(os.path.join(job_dir, 'input.jsonl'), encoding='utf-8') as f:
+        items = [json.loads(line) for line in f if line.strip()]
+
+    write_job_status(job_id, status='running', started_at=timezone.now().isoformat())
+    completed = succeeded = 0
+    try:
+        with open(os.path.join(job_dir, 'results.jsonl'), 'w', encoding='utf-8') as out:
+            for result in run_batch(connection, items, status['concurrency'], status['model'], status['user_ip']):
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                completed += 1
+                succeeded += 1 if result.get('success') else 0
+                # 每100条刷新一次进度
+                if completed % 100 == 0:
+                    out.flush()
+                    write_job_status(job_id, completed=completed, succeeded=succeeded)
+    except Exception as e:
+        write_job_status(job_id, status='failed', completed=completed, succeeded=succeeded, error=str(e))
+        raise
+    finally:
+        close_old_connections()
+
+    return write_job_status(
+        job_id, status='completed', completed=completed, succeeded=succeeded,
+        finished_at=timezone.now().isoformat()
+    )
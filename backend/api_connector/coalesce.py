@@ -0,0 +1,154 @@
+"""
+相同上游请求的合并（request coalescing）
+
+仪表盘或批量任务经常在多个工作线程/进程中同时发出完全相同的请求。
+RequestCoalescer 按请求的规范化哈希（见 response_cache.request_cache_key）合并它们：
+同一个键的请求还在进行时，后来的调用方等待第一个请求的结果，而不是各自请求上游。
+
+- 进程内：用 concurrent.futures.Future 共享结果
+- 跨进程（可选）：用缓存锁选出一个进程发送请求，锁的值是这次请求独有的令牌，结果写入
+  以该令牌命名的短期结果键，其他进程读取锁中的令牌后轮询对应的结果键；缓存后端为Redis时
+  即为Redis锁加结果键。结果键按令牌区分，之后的相同请求不会拿到已经结束的请求的结果
+
+等待超过超时时间（或发送请求的一方失败）时，调用方自己发送请求。
+"""
+
+import copy
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.05  # 跨进程等待时轮询结果键的间隔(秒)
+
+
+class RequestCoalescer:
+    """按键合并进行中的相同请求"""
+
+    def __init__(self, wait_timeout=None, cross_process=None, result_ttl=None):
+        """
+        初始化请求合并器
+
+        Args:
+            wait_timeout: 等待其他调用方结果的默认超时(秒)，默认读取 API_CONNECTOR_COALESCE_TIMEOUT
+            cross_process: 是否跨进程合并，默认读取 API_CONNECTOR_COALESCE_CROSS_PROCESS
+            result_ttl: 跨进程结果键的保留时间(秒)，默认读取 API_CONNECTOR_COALESCE_RESULT_TTL
+        """
+        self.wait_timeout = wait_timeout or getattr(settings, 'API_CONNECTOR_COALESCE_TIMEOUT', 65)
+        if cross_process is None:
+            cross_process = getattr(settings, 'API_CONNECTOR_COALESCE_CROSS_PROCESS', False)
+        self.cross_process = cross_process
+        self.result_ttl = result_ttl or getattr(settings, 'API_CONNECTOR_COALESCE_RESULT_TTL', 5)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.coalesced_count = 0
+
+    @staticmethod
+    def _lock_key(key):
+        return f'api_coalesce_lock_{key}'
+
+    @staticmethod
+    def _result_key(key, token):
+        return f'api_coalesce_result_{key}_{token}'
+
+    def _count_coalesced(self):
+        with self._lock:
+            self.coalesced_count += 1
+
+    def run(self, key, func, wait_timeout=None, cross_process=None):
+        """
+        执行 func，同一个键同时只执行一次
+
+        Args:
+            key: 请求的规范化哈希
+            func: 实际发送请求的无参函数
+            wait_timeout: 等待其他调用方结果的超时(秒)
+            cross_process: 是否跨进程合并
+
+        Returns:
+            func 的返回值（等待其他调用方时为其结果的副本）
+        """
+        wait_timeout = wait_timeout or self.wait_timeout
+        if cross_process is None:
+            cross_process = self.cross_process
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            try:
+                result = future.result(timeout=wait_timeout)
+                self._count_coalesced()
+                return copy.deepcopy(result)
+            except FutureTimeoutError:
+                logger.warning(f"等待相同请求的结果超时({wait_timeout}秒)，单独发送请求")
+            except Exception:
+                # 发送请求的一方出错，自己重新发送
+                pass
+            return func()
+
+        try:
+            if cross_process:
+                result = self._run_cross_process(key, func, wait_timeout)
+            else:
+                result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _run_cross_process(self, key, func, wait_timeout):
+        """跨进程只让持有缓存锁的一方发送请求，其他进程等待它的结果键"""
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        try:
+            acquired = cache.add(lock_key, token, int(wait_timeout) + 1)
+        except Exception as e:
+            logger.warning(f"获取请求合并锁时出错: {str(e)}")
+            return func()
+
+        if acquired:
+            try:
+                result = func()
+                cache.set(self._result_key(key, token), result, self.result_ttl)
+                return result
+            finally:
+                cache.delete(lock_key)
+
+        # 等待当前持有锁的那次请求
+        leader_token = cache.get(lock_key)
+        deadline = time.monotonic() + wait_timeout
+        while leader_token is not None and time.monotonic() < deadline:
+            result = cache.get(self._result_key(key, leader_token))
+            if result is not None:
+                self._count_coalesced()
+                return result
+            if cache.get(lock_key) != leader_token:
+                # 那次请求已经结束：结果可能刚刚写入，否则说明它失败了
+                result = cache.get(self._result_key(key, leader_token))
+                if result is not None:
+                    self._count_coalesced()
+                    return result
+                break
+            time.sleep(POLL_INTERVAL)
+        else:
+            if leader_token is not None:
+                logger.warning(f"等待其他进程的相同请求结果超时({wait_timeout}秒)，单独发送请求")
+        return func()
+
+
+# 进程级的全局请求合并器
+request_coalescer = RequestCoalescer()
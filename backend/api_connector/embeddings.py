@@ -0,0 +1,235 @@
+"""
+批量嵌入调用
+
+APIConnector.embed 把一组文本转换为嵌入向量矩阵：
+- 先查询磁盘上的嵌入缓存（按 提供商类型/模型 和文本的SHA-256定位），未变化的文本不再请求上游
+- 其余文本去重后装箱为尽量大的批次，每批的条数不超过提供商单次请求的上限
+  （ProviderAdapter.max_embedding_batch），令牌数不超过嵌入模型的 APIModel.max_tokens
+- 各批次以有限并发通过 call_api 发送（沿用速率限制、重试、令牌预算和使用日志），
+  结果写回缓存，最终按输入顺序组装成连续的float32矩阵
+"""
+
+import os
+import re
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .registry import connection_registry
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+class EmbeddingError(Exception):
+    """嵌入调用失败"""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+
+def text_hash(text):
+    """文本的SHA-256摘要，作为嵌入缓存的键"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    磁盘上的嵌入缓存
+
+    每个向量以原始的小端float32字节保存为一个文件：<目录>/<提供商类型>/<模型>/<摘要前两位>/<摘要>.f32，
+    写入时先写临时文件再原子地重命名，多个进程可以同时读写。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or getattr(
+            settings, 'API_EMBEDDING_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'embedding_cache')
+        )
+
+    def _path(self, namespace, digest):
+        # 命名空间中的 / 作为目录分隔符，各级目录名只保留安全字符，. 和 .. 不能作为目录名
+        segments = [re.sub(r'[^A-Za-z0-9._-]', '_', segment) for segment in namespace.split('/')]
+        segments = [segment if segment.strip('.') else segment.replace('.', '_') for segment in segments if segment]
+        return os.path.join(self.directory, *segments, digest[:2], f'{digest}.f32')
+
+    def get(self, namespace, digest):
+        """读取缓存的向量，不存在或损坏时返回None"""
+        try:
+            vector = np.fromfile(self._path(namespace, digest), dtype=EMBEDDING_DTYPE)
+        except (OSError, ValueError):
+            return None
+        return vector if vector.size else None
+
+    def set(self, namespace, digest, vector):
+        """保存向量，写入失败只记录警告"""
+        path = self._path(namespace, digest)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 临时文件与目标在同一目录下且名称唯一，多个线程同时写入同一向量时互不影响
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=f'{digest}.', dir=os.path.dirname(path))
+            # mkstemp 创建的文件只有所有者可读，其他进程（可能以不同用户运行）也需要读取
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入嵌入缓存时出错: {str(e)}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+
+# 进程级的全局嵌入缓存
+embedding_cache = EmbeddingCache()
+
+
+def resolve_embedding_model(connector, model=None):
+    """
+    确定嵌入使用的模型标识符和每批的令牌上限
+
+    Returns:
+        (模型标识符, 令牌上限或None)
+    """
+    api_model = connection_registry.get_model(connector.connection.provider_id, model, model_type='embedding')
+    if api_model is not None:
+        return api_model.model_identifier, api_model.max_tokens
+    return model or connector.adapter.default_embedding_model, None
+
+
+def pack_batches(texts, max_items, max_tokens=None, model=None):
+    """
+    把文本装箱为批次：按顺序尽量填满每一批，条数不超过 max_items，令牌数不超过 max_tokens
+
+    Returns:
+        [[文本在 texts 中的位置, ...], ...]
+
+    Raises:
+        ValueError: 单条文本的令牌数超过 max_tokens
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for position, text in enumerate(texts):
+        tokens = count_tokens(text, model) if max_tokens else 0
+        if max_tokens and tokens > max_tokens:
+            raise ValueError(f"第{position + 1}条文本约{tokens}个令牌，超出嵌入模型的上限{max_tokens}")
+        if current and (len(current) >= max_items or (max_tokens and current_tokens + tokens > max_tokens)):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(position)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_batch(connector, texts, model, user_ip):
+    """发送一批嵌入请求，返回按输入顺序排列的向量"""
+    adapter = connector.adapter
+    response = connector.call_api(
+        endpoint=adapter.embedding_endpoint_for(model),
+        data=adapter.build_embedding_request(texts, model),
+        user_ip=user_ip
+    )
+    vectors = adapter.parse_embedding_response(response)
+    if vectors is None or len(vectors) != len(texts):
+        message = response.get('message', '嵌入响应格式不正确') if isinstance(response, dict) else '嵌入响应格式不正确'
+        raise EmbeddingError(message, response)
+    return vectors
+
+
+def _run_batch(connector, texts, model, user_ip):
+    """在线程池线程中发送一批嵌入请求"""
+    try:
+        return _embed_batch(connector, texts, model, user_ip)
+    finally:
+        # 调用过程中会读写数据库（令牌预算、使用日志），用完后关闭本线程的连接
+        close_old_connections()
+
+
+def embed_texts(connector, texts, model=None, concurrency=None, use_cache=True, user_ip=None):
+    """
+    把文本转换为嵌入向量矩阵
+
+    Args:
+        connector: API连接器
+        texts: 文本列表
+        model: 嵌入模型标识符，未指定时使用提供商默认的嵌入模型
+        concurrency: 同时发送的批次数，默认读取 API_EMBEDDING_CONCURRENCY
+        use_cache: 是否使用磁盘上的嵌入缓存
+        user_ip: 用户IP，用于日志记录
+
+    Returns:
+        形状为 (len(texts), 维度) 的C连续float32矩阵，行顺序与输入一致
+
+    Raises:
+        ValueError: 提供商不支持嵌入或单条文本超出令牌上限
+        EmbeddingError: 上游调用失败或返回的向量维度不一致
+    """
+    adapter = connector.adapter
+    if not adapter.supports_embeddings:
+        raise ValueError(f"{connector.connection.provider.provider_type} 类型的连接不支持嵌入")
+
+    texts = [str(text) for text in texts]
+    model, max_tokens = resolve_embedding_model(connector, model)
+    namespace = f'{connector.connection.provider.provider_type}/{model}'
+
+    # 摘要 -> 向量；相同文本只请求一次
+    digests = [text_hash(text) for text in texts]
+    vectors = {}
+    missing = {}
+    for text, digest in zip(texts, digests):
+        if digest in vectors or digest in missing:
+            continue
+        vector = embedding_cache.get(namespace, digest) if use_cache else None
+        if vector is not None:
+            vectors[digest] = vector
+        else:
+            missing[digest] = text
+
+    if missing:
+        pending_digests = list(missing)
+        pending_texts = [missing[digest] for digest in pending_digests]
+        batches = pack_batches(pending_texts, adapter.max_embedding_batch, max_tokens, model)
+        concurrency = concurrency or getattr(settings, 'API_EMBEDDING_CONCURRENCY', 4)
+        executor = ThreadPoolExecutor(max_workers=max(1, min(int(concurrency), len(batches))),
+                                      thread_name_prefix='api-embed')
+        try:
+            futures = {
+                executor.submit(_run_batch, connector, [pending_texts[i] for i in batch], model, user_ip): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                for position, vector in zip(futures[future], future.result()):
+                    digest = pending_digests[position]
+                    vector = np.asarray(vector, dtype=EMBEDDING_DTYPE)
+                    vectors[digest] = vector
+                    if use_cache:
+                        embedding_cache.set(namespace, digest, vector)
+        finally:
+            # 某一批失败时取消尚未开始的批次
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    if not texts:
+        return np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+
+    dimension = len(vectors[digests[0]])
+    matrix = np.empty((len(texts), dimension), dtype=EMBEDDING_DTYPE)
+    for row, digest in enumerate(digests):
+        vector = vectors[digest]
+        if len(vector) != dimension:
+            raise EmbeddingError(f"嵌入向量的维度不一致: {len(vector)} != {dimension}")
+        matrix[row] = vector
+    return matrix
@@ -0,0 +1,324 @@
+"""
+上游请求延迟的直方图指标
+
+每个进程按 (连接, 端点, 状态) 用固定分桶的直方图记录上游请求的延迟，由后台线程每隔
+API_METRICS_FLUSH_INTERVAL 秒把增量累加到共享存储中，从而汇总所有gunicorn/Celery进程：
+- 默认缓存为Redis时写入一个哈希（HINCRBY/HINCRBYFLOAT，原子累加）
+- 其他缓存后端在缓存锁保护下读改写一个字典（进程内缓存时只能看到本进程的数据）
+
+metrics_view 以Prometheus文本格式导出直方图，latency_summary 计算每个连接的p50/p95/p99，
+容量规划不再需要扫描 APIUsageLog。
+"""
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# 分桶上界(ms)，最后一个桶为+Inf
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+SHARED_KEY = 'api_latency_histograms'
+LOCK_TIMEOUT = 2  # 非Redis后端的锁超时时间(秒)
+
+
+class Histogram:
+    """固定分桶的延迟直方图"""
+
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = list(counts) if counts else [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, latency):
+        """记录一个延迟样本(ms)"""
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                break
+        else:
+            index = len(LATENCY_BUCKETS)
+        self.counts[index] += 1
+        self.sum += latency
+
+    def merge(self, other):
+        for index, value in enumerate(other.counts):
+            self.counts[index] += value
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """估算q分位数(ms)：在所在的桶内线性插值，没有样本时返回None"""
+        total = self.count
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, value in enumerate(self.counts):
+            if value and cumulative + value >= rank:
+                if index == len(LATENCY_BUCKETS):
+                    # +Inf桶无法插值，返回最大的有限上界
+                    return float(LATENCY_BUCKETS[-1])
+                lower = LATENCY_BUCKETS[index - 1] if index else 0
+                upper = LATENCY_BUCKETS[index]
+                return lower + (upper - lower) * (rank - cumulative) / value
+            cumulative += value
+        return float(LATENCY_BUCKETS[-1])
+
+
+def _series_field(key):
+    """把 (连接ID, 端点, 状态) 编码为共享存储中的字段名前缀"""
+    return json.dumps(key, ensure_ascii=False)
+
+
+class LatencyMetrics:
+    """进程内的延迟直方图，定期汇总到共享存储"""
+
+    def __init__(self, flush_interval=None, cache_backend=None):
+        """
+        初始化延迟指标
+
+        Args:
+            flush_interval: 把本进程的增量写入共享存储的间隔(秒)，默认读取 API_METRICS_FLUSH_INTERVAL
+            cache_backend: 共享存储使用的缓存，默认为默认缓存
+        """
+        self.flush_interval = flush_interval or getattr(settings, 'API_METRICS_FLUSH_INTERVAL', 5.0)
+        self.cache = cache_backend or cache
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        """按需启动后台线程；fork出的子进程需要重新创建线程并丢弃父进程的增量"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != pid:
+                self._pending = {}
+                self._pid = pid
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='api-latency-metrics', daemon=True)
+                self._thread.start()
+
+    def observe(self, connection_id, endpoint, status, latency):
+        """记录一次上游请求的延迟(ms)"""
+        self._ensure_started()
+        key = (str(connection_id), endpoint, status)
+        with self._lock:
+            histogram = self._pending.get(key)
+            if histogram is None:
+                histogram = self._pending[key] = Histogram()
+            histogram.observe(latency)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self):
+        """把本进程的增量累加到共享存储，失败时放回下次重试"""
+        with self._flush_lock:
+            pending = self._take_pending()
+            if not pending:
+                return
+            try:
+                redis_client = self._redis_client()
+                if redis_client is not None:
+                    self._flush_redis(redis_client, pending)
+                else:
+                    self._flush_cache(pending)
+            except Exception as e:
+                logger.warning(f"写入API延迟指标时出错: {str(e)}")
+                with self._lock:
+                    for key, histogram in pending.items():
+                        self._pending.setdefault(key, Histogram()).merge(histogram)
+
+    def _redis_client(self):
+        """缓存后端为Django内置RedisCache时返回底层客户端，否则返回None"""
+        client = getattr(self.cache, '_cache', None)
+        if client is None or not hasattr(client, 'get_client'):
+            return None
+        try:
+            return client.get_client(write=True)
+        except Exception:
+            return None
+
+    def _flush_redis(self, redis_client, pending):
+        redis_key = self.cache.make_key(SHARED_KEY)
+        pipe = redis_client.pipeline(transaction=False)
+        for key, histogram in pending.items():
+            field = _series_field(key)
+            for index, value in enumerate(histogram.counts):
+                if value:
+                    pipe.hincrby(redis_key, f'{field}|{index}', value)
+            pipe.hincrbyfloat(redis_key, f'{field}|sum', histogram.sum)
+        pipe.execute()
+
+    def _flush_cache(self, pending):
+        lock_key = f'{SHARED_KEY}_lock'
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not self.cache.add(lock_key, 1, LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise TimeoutError("等待延迟指标锁超时")
+            time.sleep(0.01)
+        try:
+            shared = self.cache.get(SHARED_KEY) or {}
+            for key, histogram in pending.items():
+                field = _series_field(key)
+                counts, total = shared.get(field, (None, 0.0))
+                merged = Histogram(counts, total)
+                merged.merge(histogram)
+                shared[field] = (merged.counts, merged.sum)
+            self.cache.set(SHARED_KEY, shared, None)
+        finally:
+            self.cache.delete(lock_key)
+
+    def _read_shared(self):
+        """读取共享存储中的全部直方图"""
+        histograms = {}
+        redis_client = self._redis_client()
+        if redis_client is not None:
+            for field, value in redis_client.hgetall(self.cache.make_key(SHARED_KEY)).items():
+                field = field.decode() if isinstance(field, bytes) else field
+                series, _, suffix = field.rpartition('|')
+                histogram = histograms.setdefault(tuple(json.loads(series)), Histogram())
+                if suffix == 'sum':
+                    histogram.sum += float(value)
+                else:
+                    histogram.counts[int(suffix)] += int(value)
+            return histograms
+
+        for field, (counts, total) in (self.cache.get(SHARED_KEY) or {}).items():
+            histograms[tuple(json.loads(field))] = Histogram(counts, total)
+        return histograms
+
+    def snapshot(self):
+        """
+        返回所有进程汇总后的直方图（包括本进程尚未写入的增量）
+
+        Returns:
+            {(连接ID, 端点, 状态): Histogram}
+        """
+        try:
+            histograms = self._read_shared()
+        except Exception as e:
+            logger.warning(f"读取API延迟指标时出错: {str(e)}")
+            histograms = {}
+        with self._lock:
+            for key, histogram in self._pending.items():
+                histograms.setdefault(key, Histogram()).merge(histogram)
+        return histograms
+
+    def reset(self):
+        """清空所有进程的指标"""
+        with self._lock:
+            self._pending = {}
+        redis_client = self._redis_client()
+        if redis_client is not None:
+            redis_client.delete(self.cache.make_key(SHARED_KEY))
+        else:
+            self.cache.delete(SHARED_KEY)
+
+
+# 进程级的全局延迟指标
+latency_metrics = LatencyMetrics()
+
+# 进程退出时写入剩余增量
+atexit.register(latency_metrics.flush)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(histograms, connection_names=None):
+    """
+    把直方图格式化为Prometheus文本格式（单位为秒）
+
+    Args:
+        histograms: snapshot 的返回值
+        connection_names: {连接ID: 连接名称}，用于附加 connection 标签
+    """
+    connection_names = connection_names or {}
+    name = 'api_connector_request_duration_seconds'
+    lines = [
+        f'# HELP {name} 上游API请求延迟',
+        f'# TYPE {name} histogram',
+    ]
+    for (connection_id, endpoint, status), histogram in sorted(histograms.items()):
+        labels = (
+            f'connection_id="{_escape_label(connection_id)}",'
+            f'connection="{_escape_label(connection_names.get(connection_id, ""))}",'
+            f'endpoint="{_escape_label(endpoint)}",status="{_escape_label(status)}"'
+        )
+        cumulative = 0
+        for bound, value in zip(LATENCY_BUCKETS, histogram.counts):
+            cumulative += value
+            lines.append(f'{name}_bucket{{{labels},le="{bound / 1000:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum / 1000:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def latency_summary(histograms, connection_id=None):
+    """
+    按连接汇总延迟分位数
+
+    Args:
+        histograms: snapshot 的返回值
+        connection_id: 只汇总该连接
+
+    Returns:
+        {连接ID: {'count', 'mean', 'p50', 'p95', 'p99', 'status_counts', 'endpoints'}}，延迟单位为ms
+    """
+    merged = {}
+    for (series_connection, endpoint, status), histogram in histograms.items():
+        if connection_id and series_connection != str(connection_id):
+            continue
+        entry = merged.setdefault(series_connection, {
+            'all': Histogram(), 'status_counts': {}, 'endpoints': {}
+        })
+        entry['all'].merge(histogram)
+        entry['endpoints'].setdefault(endpoint, Histogram()).merge(histogram)
+        entry['status_counts'][status] = entry['status_counts'].get(status, 0) + histogram.count
+
+    def describe(histogram):
+        count = histogram.count
+        return {
+            'count': count,
+            'mean': round(histogram.sum / count, 2) if count else None,
+            'p50': _round(histogram.quantile(0.5)),
+            'p95': _round(histogram.quantile(0.95)),
+            'p99': _round(histogram.quantile(0.99)),
+        }
+
+    return {
+        series_connection: dict(
+            describe(entry['all']),
+            status_counts=entry['status_counts'],
+            endpoints={endpoint: describe(h) for endpoint, h in entry['endpoints'].items()},
+        )
+        for series_connection, entry in merged.items()
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
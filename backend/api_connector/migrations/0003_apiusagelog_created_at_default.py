@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_connector', '0002_apimodel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apiusagelog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='创建时间'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_connector', '0003_apiusagelog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIUsageHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('success', '成功'), ('failed', '失败'), ('rate_limited', '超出速率限制'), ('error', '错误')], max_length=20, verbose_name='状态')),
+                ('request_count', models.PositiveIntegerField(default=0, verbose_name='请求数')),
+                ('tokens_sum', models.BigIntegerField(default=0, verbose_name='令牌总数')),
+                ('latency_sum', models.FloatField(default=0, verbose_name='响应时间总和(ms)')),
+                ('latency_min', models.FloatField(default=0, verbose_name='最短响应时间(ms)')),
+                ('latency_max', models.FloatField(default=0, verbose_name='最长响应时间(ms)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('bucket', models.DateTimeField(verbose_name='小时')),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_connector.apiconnection', verbose_name='API连接')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_connector.apiprovider', verbose_name='API提供商')),
+            ],
+            options={
+                'verbose_name': 'API使用小时汇总',
+                'verbose_name_plural': 'API使用小时汇总',
+                'ordering': ['-bucket'],
+                'indexes': [models.Index(fields=['bucket'], name='api_connect_bucket_82ebdc_idx')],
+                'unique_together': {('connection', 'provider', 'status', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='APIUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('success', '成功'), ('failed', '失败'), ('rate_limited', '超出速率限制'), ('error', '错误')], max_length=20, verbose_name='状态')),
+                ('request_count', models.PositiveIntegerField(default=0, verbose_name='请求数')),
+                ('tokens_sum', models.BigIntegerField(default=0, verbose_name='令牌总数')),
+                ('latency_sum', models.FloatField(default=0, verbose_name='响应时间总和(ms)')),
+                ('latency_min', models.FloatField(default=0, verbose_name='最短响应时间(ms)')),
+                ('latency_max', models.FloatField(default=0, verbose_name='最长响应时间(ms)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('bucket', models.DateField(verbose_name='日期')),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_connector.apiconnection', verbose_name='API连接')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_connector.apiprovider', verbose_name='API提供商')),
+            ],
+            options={
+                'verbose_name': 'API使用每日汇总',
+                'verbose_name_plural': 'API使用每日汇总',
+                'ordering': ['-bucket'],
+                'indexes': [models.Index(fields=['bucket'], name='api_connect_bucket_790af9_idx')],
+                'unique_together': {('connection', 'provider', 'status', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:30
+
+from django.db import migrations
+from django.db.models import Count, Sum, Min, Max
+from django.db.models.functions import TruncHour, TruncDate
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    """根据已有的API使用日志生成小时和每日汇总"""
+    APIUsageLog = apps.get_model('api_connector', 'APIUsageLog')
+    tz = timezone.get_current_timezone()
+    for model_name, trunc in (('APIUsageHourly', TruncHour('created_at', tzinfo=tz)),
+                              ('APIUsageDaily', TruncDate('created_at', tzinfo=tz))):
+        model = apps.get_model('api_connector', model_name)
+        rows = (
+            APIUsageLog.objects.annotate(bucket_value=trunc)
+            .values('connection_id', 'connection__provider_id', 'status', 'bucket_value')
+            .annotate(
+                request_count=Count('id'),
+                tokens_sum=Sum('tokens_used'),
+                latency_sum=Sum('response_time'),
+                latency_min=Min('response_time'),
+                latency_max=Max('response_time'),
+            )
+            .order_by()
+        )
+        model.objects.bulk_create([
+            model(
+                connection_id=row['connection_id'],
+                provider_id=row['connection__provider_id'],
+                status=row['status'],
+                bucket=row['bucket_value'],
+                request_count=row['request_count'],
+                tokens_sum=row['tokens_sum'] or 0,
+                latency_sum=row['latency_sum'] or 0,
+                latency_min=row['latency_min'] or 0,
+                latency_max=row['latency_max'] or 0,
+            )
+            for row in rows.iterator()
+        ], batch_size=1000)
+
+
+def clear_rollups(apps, schema_editor):
+    apps.get_model('api_connector', 'APIUsageHourly').objects.all().delete()
+    apps.get_model('api_connector', 'APIUsageDaily').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_connector', '0004_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, clear_rollups),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_connector', '0005_backfill_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiusagelog',
+            name='cache_hit',
+            field=models.BooleanField(default=False, verbose_name='命中响应缓存'),
+        ),
+    ]
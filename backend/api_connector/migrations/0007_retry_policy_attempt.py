@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_connector', '0006_apiusagelog_cache_hit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiprovider',
+            name='retry_policy',
+            field=models.JSONField(blank=True, help_text='重试、退避、超时和对冲配置，未配置的项使用全局设置，见 api_connector.retry', null=True, verbose_name='重试策略'),
+        ),
+        migrations.AddField(
+            model_name='apiusagelog',
+            name='attempt',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='请求序号'),
+        ),
+        migrations.AlterField(
+            model_name='apiusagedaily',
+            name='status',
+            field=models.CharField(choices=[('success', '成功'), ('failed', '失败'), ('rate_limited', '超出速率限制'), ('error', '错误'), ('cancelled', '已取消')], max_length=20, verbose_name='状态'),
+        ),
+        migrations.AlterField(
+            model_name='apiusagehourly',
+            name='status',
+            field=models.CharField(choices=[('success', '成功'), ('failed', '失败'), ('rate_limited', '超出速率限制'), ('error', '错误'), ('cancelled', '已取消')], max_length=20, verbose_name='状态'),
+        ),
+        migrations.AlterField(
+            model_name='apiusagelog',
+            name='status',
+            field=models.CharField(choices=[('success', '成功'), ('failed', '失败'), ('rate_limited', '超出速率限制'), ('error', '错误'), ('cancelled', '已取消')], max_length=20, verbose_name='状态'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_connector', '0007_retry_policy_attempt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='apiusagelog',
+            index=models.Index(fields=['connection', '-created_at'], name='usagelog_conn_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='apiusagelog',
+            index=models.Index(fields=['status', '-created_at'], name='usagelog_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='apiusagelog',
+            index=models.Index(fields=['-created_at'], name='usagelog_created_idx'),
+        ),
+    ]
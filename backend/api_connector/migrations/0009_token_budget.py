@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_connector', '0008_usagelog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiconnection',
+            name='daily_token_budget',
+            field=models.PositiveIntegerField(default=0, help_text='0表示无限制', verbose_name='每日令牌预算'),
+        ),
+        migrations.AddField(
+            model_name='apiusagelog',
+            name='estimated_tokens',
+            field=models.IntegerField(blank=True, null=True, verbose_name='估算的提示词令牌数'),
+        ),
+    ]
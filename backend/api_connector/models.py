@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 
 class APIProvider(models.Model):
@@ -22,6 +23,8 @@ class APIProvider(models.Model):
     base_url = models.URLField(verbose_name='基础URL', help_text='API的基础URL，如：https://api.openai.com/v1/')
     docs_url = models.URLField(blank=True, null=True, verbose_name='文档URL')
     is_active = models.BooleanField(default=True, verbose_name='是否启用')
+    retry_policy = models.JSONField(blank=True, null=True, verbose_name='重试策略',
+                                    help_text='重试、退避、超时和对冲配置，未配置的项使用全局设置，见 api_connector.retry')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     
@@ -46,6 +49,7 @@ class APIConnection(models.Model):
     custom_headers = models.JSONField(blank=True, null=True, verbose_name='自定义请求头')
     custom_params = models.JSONField(blank=True, null=True, verbose_name='自定义参数')
     rate_limit = models.IntegerField(default=0, verbose_name='速率限制(每分钟)', help_text='0表示无限制')
+    daily_token_budget = models.PositiveIntegerField(default=0, verbose_name='每日令牌预算', help_text='0表示无限制')
     is_default = models.BooleanField(default=False, verbose_name='是否默认连接')
     is_active = models.BooleanField(default=True, verbose_name='是否启用')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
@@ -123,7 +127,8 @@ class APIUsageLog(models.Model):
         ('success', '成功'),
         ('failed', '失败'),
         ('rate_limited', '超出速率限制'),
-        ('error', '错误')
+        ('error', '错误'),
+        ('cancelled', '已取消')
     ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -134,14 +139,68 @@ class APIUsageLog(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name='状态')
     error_message = models.TextField(blank=True, null=True, verbose_name='错误信息')
     tokens_used = models.IntegerField(default=0, verbose_name='使用的令牌数')
+    estimated_tokens = models.IntegerField(blank=True, null=True, verbose_name='估算的提示词令牌数')
     response_time = models.FloatField(verbose_name='响应时间(ms)')
     user_ip = models.GenericIPAddressField(blank=True, null=True, verbose_name='用户IP')
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    cache_hit = models.BooleanField(default=False, verbose_name='命中响应缓存')
+    # 同一次调用中的请求序号：重试和对冲请求从2开始
+    attempt = models.PositiveSmallIntegerField(default=1, verbose_name='请求序号')
+    # 日志由后台线程批量写入，创建时间取调用发生的时间而不是写入数据库的时间
+    created_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='创建时间')
     
     class Meta:
         verbose_name = 'API使用日志'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        # 日志列表按连接或状态过滤后按时间倒序分页，统计和汇总按时间范围扫描
+        indexes = [
+            models.Index(fields=['connection', '-created_at'], name='usagelog_conn_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='usagelog_status_created_idx'),
+            models.Index(fields=['-created_at'], name='usagelog_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.connection.name} - {self.endpoint} - {self.status}"
+
+
+class APIUsageRollup(models.Model):
+    """API使用统计汇总的公共字段，按 (连接, 提供商, 状态, 时间桶) 聚合"""
+    
+    connection = models.ForeignKey(APIConnection, on_delete=models.CASCADE, related_name='+', verbose_name='API连接')
+    provider = models.ForeignKey(APIProvider, on_delete=models.CASCADE, related_name='+', verbose_name='API提供商')
+    status = models.CharField(max_length=20, choices=APIUsageLog.STATUS_CHOICES, verbose_name='状态')
+    request_count = models.PositiveIntegerField(default=0, verbose_name='请求数')
+    tokens_sum = models.BigIntegerField(default=0, verbose_name='令牌总数')
+    latency_sum = models.FloatField(default=0, verbose_name='响应时间总和(ms)')
+    latency_min = models.FloatField(default=0, verbose_name='最短响应时间(ms)')
+    latency_max = models.FloatField(default=0, verbose_name='最长响应时间(ms)')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    
+    class Meta:
+        abstract = True
+
+
+class APIUsageHourly(APIUsageRollup):
+    """API使用按小时汇总"""
+    
+    bucket = models.DateTimeField(verbose_name='小时')
+    
+    class Meta:
+        verbose_name = 'API使用小时汇总'
+        verbose_name_plural = verbose_name
+        ordering = ['-bucket']
+        unique_together = [('connection', 'provider', 'status', 'bucket')]
+        indexes = [models.Index(fields=['bucket'])]
+
+
+class APIUsageDaily(APIUsageRollup):
+    """API使用按天汇总（按settings.TIME_ZONE划分日期）"""
+    
+    bucket = models.DateField(verbose_name='日期')
+    
+    class Meta:
+        verbose_name = 'API使用每日汇总'
+        verbose_name_plural = verbose_name
+        ordering = ['-bucket']
+        unique_together = [('connection', 'provider', 'status', 'bucket')]
+        indexes = [models.Index(fields=['bucket'])]
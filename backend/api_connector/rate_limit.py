@@ -0,0 +1,179 @@
+"""
+API连接的速率限制
+
+基于令牌桶算法实现 APIConnection.rate_limit（每分钟请求数，0表示不限制）。
+令牌桶状态保存在Django缓存中，因此在多个gunicorn/Celery进程之间共享；
+缓存后端为Redis时使用Lua脚本原子地完成补充和扣减，其他后端使用缓存锁。
+"""
+
+import time
+import random
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# 原子地补充并尝试扣减令牌，返回需要等待的秒数（0表示已获取令牌）
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], ttl)
+return tostring(wait)
+"""
+
+
+class RateLimitExceeded(Exception):
+    """超出API连接的速率限制"""
+
+    def __init__(self, connection, retry_after):
+        self.connection = connection
+        self.retry_after = retry_after
+        super().__init__(
+            f"API连接 {connection.name} 超出速率限制({connection.rate_limit}次/分钟)，"
+            f"请在{retry_after:.1f}秒后重试"
+        )
+
+
+class TokenBucketLimiter:
+    """跨进程共享的令牌桶限流器"""
+
+    LOCK_TIMEOUT = 1  # 非Redis后端的锁超时时间(秒)
+
+    def __init__(self, cache_backend=None):
+        self.cache = cache_backend or cache
+        self._script = None
+
+    @staticmethod
+    def _bucket_key(connection):
+        return f'api_rate_limit_{connection.id}'
+
+    def _redis_client(self):
+        """缓存后端为Django内置RedisCache时返回底层客户端，否则返回None"""
+        client = getattr(self.cache, '_cache', None)
+        if client is None or not hasattr(client, 'get_client'):
+            return None
+        try:
+            return client.get_client(write=True)
+        except Exception:
+            return None
+
+    def _try_acquire_redis(self, redis_client, key, capacity, rate, ttl):
+        if self._script is None:
+            self._script = redis_client.register_script(TOKEN_BUCKET_LUA)
+        wait = self._script(keys=[self.cache.make_key(key)], args=[capacity, rate, 1, ttl],
+                            client=redis_client)
+        return float(wait)
+
+    def _try_acquire_locked(self, key, capacity, rate, ttl):
+        lock_key = f'{key}_lock'
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while not self.cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                # 拿不到锁时放行，避免缓存异常阻塞所有调用
+                logger.warning(f"获取限流锁超时: {key}")
+                return 0.0
+            time.sleep(0.002 + random.random() * 0.003)
+        try:
+            now = time.time()
+            tokens, ts = self.cache.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.cache.set(key, (tokens, now), ttl)
+            return wait
+        finally:
+            self.cache.delete(lock_key)
+
+    def try_acquire(self, connection):
+        """
+        尝试获取一个令牌
+
+        Returns:
+            0 表示已获取令牌，否则为下一个令牌可用前需要等待的秒数
+        """
+        limit = connection.rate_limit or 0
+        if limit <= 0:
+            return 0.0
+
+        capacity = float(limit)
+        rate = limit / 60.0
+        ttl = 120  # 两分钟内没有调用时令牌桶必然已满，可以直接过期
+        key = self._bucket_key(connection)
+        try:
+            redis_client = self._redis_client()
+            if redis_client is not None:
+                return self._try_acquire_redis(redis_client, key, capacity, rate, ttl)
+            return self._try_acquire_locked(key, capacity, rate, ttl)
+        except Exception as e:
+            logger.exception(f"速率限制检查失败，放行本次请求: {str(e)}")
+            return 0.0
+
+    def acquire(self, connection, mode=None, max_wait=None):
+        """
+        获取一个令牌
+
+        Args:
+            connection: API连接
+            mode: 'reject' 立即拒绝，'wait' 等待令牌（最长 max_wait 秒），
+                  默认读取 API_CONNECTOR_RATE_LIMIT_MODE
+            max_wait: 等待模式下的最长等待秒数，默认读取 API_CONNECTOR_RATE_LIMIT_MAX_WAIT
+
+        Raises:
+            RateLimitExceeded: 拒绝模式下没有可用令牌，或等待超时
+        """
+        mode = mode or getattr(settings, 'API_CONNECTOR_RATE_LIMIT_MODE', 'reject')
+        if max_wait is None:
+            max_wait = getattr(settings, 'API_CONNECTOR_RATE_LIMIT_MAX_WAIT', 10)
+
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(connection)
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if mode != 'wait' or wait > remaining:
+                raise RateLimitExceeded(connection, wait)
+            time.sleep(wait)
+
+    async def aacquire(self, connection, mode=None, max_wait=None):
+        """acquire 的异步版本，等待期间不阻塞事件循环"""
+        mode = mode or getattr(settings, 'API_CONNECTOR_RATE_LIMIT_MODE', 'reject')
+        if max_wait is None:
+            max_wait = getattr(settings, 'API_CONNECTOR_RATE_LIMIT_MAX_WAIT', 10)
+        if (connection.rate_limit or 0) <= 0:
+            return
+
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = await sync_to_async(self.try_acquire)(connection)
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if mode != 'wait' or wait > remaining:
+                raise RateLimitExceeded(connection, wait)
+            await asyncio.sleep(wait)
+
+
+# 进程级的全局限流器
+rate_limiter = TokenBucketLimiter()
@@ -0,0 +1,155 @@
+"""
+进程内的API连接解析缓存
+
+APIConnector 每次构造都要查询一到三次数据库来解析连接，随后访问 connection.provider
+又会触发一次查询。ConnectionRegistry 在进程内缓存已解析的连接（连同提供商）和为它
+创建的提供商适配器（预先计算好的请求头、URL参数，见 adapters），稳定状态下构造连接器不再访问数据库。
+
+连接或提供商变更时，signals 中的处理函数调用 invalidate：清空本进程的缓存，
+并更新默认缓存中的版本号；其他进程最多每 API_CONNECTOR_REGISTRY_CHECK_INTERVAL 秒
+检查一次版本号，发现变化后清空各自的缓存。
+"""
+
+import time
+import uuid
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import APIConnection, APIModel
+from .adapters import build_adapter
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'api_connection_registry_version'
+
+
+class ResolvedConnection:
+    """已解析的连接：连接对象（已加载提供商）和它的提供商适配器"""
+
+    __slots__ = ('connection', 'adapter')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.adapter = build_adapter(connection)
+
+    @property
+    def headers(self):
+        return self.adapter.headers
+
+
+class ConnectionRegistry:
+    """按连接ID和提供商类型缓存已解析的API连接"""
+
+    def __init__(self, check_interval=None):
+        """
+        初始化连接缓存
+
+        Args:
+            check_interval: 检查共享版本号的最小间隔(秒)，默认读取 API_CONNECTOR_REGISTRY_CHECK_INTERVAL
+        """
+        if check_interval is None:
+            check_interval = getattr(settings, 'API_CONNECTOR_REGISTRY_CHECK_INTERVAL', 1.0)
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def _check_version(self):
+        """其他进程修改了连接或提供商时清空本进程的缓存"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        try:
+            version = cache.get(VERSION_CACHE_KEY)
+        except Exception as e:
+            logger.warning(f"读取API连接缓存版本号时出错: {str(e)}")
+            return
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+
+    def _get(self, key, loader):
+        self._check_version()
+        entry = self._entries.get(key)
+        if entry is None:
+            connection = loader()
+            if connection is None:
+                # 不缓存未找到的结果，连接被创建或激活后可以立即使用
+                return None
+            entry = ResolvedConnection(connection)
+            self._entries[key] = entry
+        return entry
+
+    def get_by_id(self, connection_id):
+        """按ID解析活跃的连接，不存在时返回None"""
+        def load():
+            return APIConnection.objects.select_related('provider').filter(
+                id=connection_id, is_active=True
+            ).first()
+        return self._get(('id', str(connection_id)), load)
+
+    def get_default(self, provider_type):
+        """解析提供商类型的默认连接，没有默认连接时使用第一个活跃连接，都不存在时返回None"""
+        def load():
+            connections = APIConnection.objects.select_related('provider').filter(
+                provider__provider_type=provider_type,
+                is_active=True
+            )
+            return connections.filter(is_default=True).first() or connections.first()
+        return self._get(('type', provider_type), load)
+
+    def get_pool(self, provider_type):
+        """解析提供商类型的全部活跃连接（默认连接在前），不存在时返回空列表"""
+        self._check_version()
+        key = ('pool', provider_type)
+        entries = self._entries.get(key)
+        if entries is None:
+            connections = APIConnection.objects.select_related('provider').filter(
+                provider__provider_type=provider_type,
+                is_active=True
+            ).order_by('-is_default', 'created_at')
+            entries = [ResolvedConnection(connection) for connection in connections]
+            if not entries:
+                return []
+            self._entries[key] = entries
+        return entries
+
+    def get_model(self, provider_id, model_identifier=None, model_type=None):
+        """
+        解析提供商的活跃API模型，未指定模型标识符时使用默认模型，不存在时返回None
+
+        指定 model_type 时只查找该类型的模型（默认模型按类型区分）。
+        不存在的结果同样缓存，模型变更时由 signals 清空缓存
+        """
+        self._check_version()
+        key = ('model', str(provider_id), model_identifier, model_type)
+        if key not in self._entries:
+            models = APIModel.objects.filter(provider_id=provider_id, is_active=True)
+            if model_type:
+                models = models.filter(model_type=model_type)
+            if model_identifier:
+                model = models.filter(model_identifier=model_identifier).first()
+            else:
+                model = models.filter(is_default=True).first()
+            self._entries[key] = model
+        return self._entries[key]
+
+    def invalidate(self):
+        """清空本进程的缓存并通知其他进程"""
+        with self._lock:
+            self._entries.clear()
+            self._version = uuid.uuid4().hex
+            self._checked_at = time.monotonic()
+        try:
+            cache.set(VERSION_CACHE_KEY, self._version, None)
+        except Exception as e:
+            logger.warning(f"更新API连接缓存版本号时出错: {str(e)}")
+
+
+# 进程级的全局连接缓存
+connection_registry = ConnectionRegistry()
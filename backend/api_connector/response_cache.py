@@ -0,0 +1,116 @@
+"""
+上游API响应缓存
+
+评测和测试流量经常以 temperature=0 重复发送完全相同的请求，APIConnector.call_api
+在 use_cache=True 时会先按 (连接, 请求方法, 端点, 请求体, URL参数) 的规范化哈希查找缓存，
+命中时直接返回上次的响应，不再请求上游也不产生费用。
+
+响应保存在独立的 api_responses 缓存中（见 settings.CACHES），过期时间和容量上限
+由该缓存后端负责；每个连接的命中/未命中次数保存在默认缓存中，供 cache_stats 接口查询。
+"""
+
+import json
+import hashlib
+import logging
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+logger = logging.getLogger(__name__)
+
+
+def request_cache_key(connection_id, method, endpoint, data=None, params=None):
+    """
+    生成请求的规范化哈希
+
+    字典按键排序、去掉多余空白后再计算sha256，因此键顺序不同的相同请求得到相同的结果。
+    """
+    payload = json.dumps(
+        [str(connection_id), method.upper(), endpoint.strip('/'), data, params or {}],
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """按请求哈希缓存上游API响应，并统计每个连接的命中率"""
+
+    def __init__(self, alias=None, timeout=None):
+        """
+        初始化响应缓存
+
+        Args:
+            alias: 缓存别名，默认读取 API_RESPONSE_CACHE_ALIAS
+            timeout: 默认过期时间(秒)，默认读取 API_RESPONSE_CACHE_TIMEOUT
+        """
+        self.alias = alias or getattr(settings, 'API_RESPONSE_CACHE_ALIAS', 'api_responses')
+        self.timeout = timeout or getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 3600)
+
+    @property
+    def store(self):
+        try:
+            return caches[self.alias]
+        except InvalidCacheBackendError:
+            return cache
+
+    @staticmethod
+    def _response_key(key):
+        return f'api_response_{key}'
+
+    @staticmethod
+    def _counter_key(connection_id, name):
+        return f'api_response_cache_{name}_{connection_id}'
+
+    def _incr(self, connection_id, name):
+        key = self._counter_key(connection_id, name)
+        try:
+            cache.add(key, 0, None)
+            cache.incr(key)
+        except ValueError:
+            # 计数器恰好被清除
+            cache.set(key, 1, None)
+        except Exception as e:
+            logger.warning(f"更新响应缓存计数器时出错: {str(e)}")
+
+    def get(self, connection_id, key):
+        """查找缓存的响应，未命中返回None，同时更新命中率计数"""
+        try:
+            response_data = self.store.get(self._response_key(key))
+        except Exception as e:
+            logger.warning(f"读取API响应缓存时出错: {str(e)}")
+            response_data = None
+        self._incr(connection_id, 'hits' if response_data is not None else 'misses')
+        return response_data
+
+    def set(self, key, response_data, timeout=None):
+        """缓存一次成功的响应"""
+        try:
+            self.store.set(self._response_key(key), response_data, timeout or self.timeout)
+        except Exception as e:
+            logger.warning(f"写入API响应缓存时出错: {str(e)}")
+
+    def stats(self, connection_id):
+        """连接的命中次数、未命中次数和命中率"""
+        counters = cache.get_many([
+            self._counter_key(connection_id, 'hits'),
+            self._counter_key(connection_id, 'misses'),
+        ])
+        hits = counters.get(self._counter_key(connection_id, 'hits'), 0)
+        misses = counters.get(self._counter_key(connection_id, 'misses'), 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+        }
+
+    def reset_stats(self, connection_id):
+        """清零连接的命中率计数"""
+        cache.delete_many([
+            self._counter_key(connection_id, 'hits'),
+            self._counter_key(connection_id, 'misses'),
+        ])
+
+
+# 进程级的全局响应缓存
+response_cache = ResponseCache()
@@ -0,0 +1,208 @@
+"""
+上游调用的重试和对冲（hedged request）
+
+每个 APIProvider 可以在 retry_policy 中配置自己的重试策略，未配置的项使用
+API_CONNECTOR_RETRY_* 设置：
+- max_attempts：单次调用最多发送的请求数（含对冲请求），1 表示不重试
+- backoff_base / backoff_max：指数退避的基数和上限(秒)，实际等待时间在
+  [0, min(backoff_max, backoff_base * 2^(n-1))] 之间均匀随机（full jitter）
+- retry_on：需要重试的上游状态码；超时和网络错误（没有状态码）由 retry_on_timeout 控制
+- timeout：单个请求的超时(秒)
+- deadline：整个调用（含退避等待）的总时限(秒)，每个请求的超时不超过剩余时间
+- hedge：是否启用对冲；hedge_delay 为发出对冲请求前等待的毫秒数，
+  未配置时取该连接最近成功请求延迟的 hedge_quantile 分位数（样本不足时不对冲）
+
+对冲时第一个请求超过等待时间仍未返回，就向同一提供商类型的另一个活跃连接
+（没有时为同一个连接）再发一个请求。主请求在调用方线程中执行，只有对冲请求放到进程
+共享的线程池中；两个请求都通过各自连接的会话池发送。
+"""
+
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+from .registry import connection_registry
+
+logger = logging.getLogger(__name__)
+
+HEDGE_MIN_SAMPLES = 20  # 计算对冲等待时间所需的最少延迟样本数
+LATENCY_WINDOW = 500  # 每个连接保留的最近延迟样本数
+
+POLICY_KEYS = {
+    'max_attempts', 'backoff_base', 'backoff_max', 'retry_on', 'retry_on_timeout',
+    'timeout', 'deadline', 'hedge', 'hedge_delay', 'hedge_quantile',
+}
+
+
+class RetryPolicy:
+    """一个提供商的重试和对冲策略"""
+
+    def __init__(self, **overrides):
+        """
+        初始化重试策略
+
+        Args:
+            overrides: 覆盖默认设置的策略项，取值见模块说明
+
+        Raises:
+            ValueError: 包含未知的策略项或取值不合法
+        """
+        unknown = set(overrides) - POLICY_KEYS
+        if unknown:
+            raise ValueError(f"未知的重试策略项: {', '.join(sorted(unknown))}")
+
+        def get(key, setting, default):
+            value = overrides.get(key)
+            return getattr(settings, setting, default) if value is None else value
+
+        try:
+            self.max_attempts = int(get('max_attempts', 'API_CONNECTOR_RETRY_MAX_ATTEMPTS', 1))
+            self.backoff_base = float(get('backoff_base', 'API_CONNECTOR_RETRY_BACKOFF_BASE', 0.5))
+            self.backoff_max = float(get('backoff_max', 'API_CONNECTOR_RETRY_BACKOFF_MAX', 8.0))
+            self.retry_on = {int(code) for code in get(
+                'retry_on', 'API_CONNECTOR_RETRY_STATUS_CODES', [408, 429, 500, 502, 503, 504]
+            )}
+            self.retry_on_timeout = bool(get('retry_on_timeout', 'API_CONNECTOR_RETRY_ON_TIMEOUT', True))
+            self.timeout = float(get('timeout', 'API_CONNECTOR_REQUEST_TIMEOUT', 60))
+            self.deadline = float(get('deadline', 'API_CONNECTOR_RETRY_DEADLINE', 120))
+            self.hedge = bool(get('hedge', 'API_CONNECTOR_HEDGE', False))
+            hedge_delay = overrides.get('hedge_delay')
+            self.hedge_delay = float(hedge_delay) if hedge_delay is not None else None
+            self.hedge_quantile = float(get('hedge_quantile', 'API_CONNECTOR_HEDGE_QUANTILE', 0.95))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"重试策略取值不合法: {str(e)}")
+
+        if self.max_attempts < 1 or self.timeout <= 0 or self.deadline <= 0:
+            raise ValueError("max_attempts 必须大于等于1，timeout 和 deadline 必须大于0")
+        if not 0 < self.hedge_quantile < 1:
+            raise ValueError("hedge_quantile 必须在0和1之间")
+
+    @classmethod
+    def for_provider(cls, provider):
+        """读取提供商的重试策略，配置不合法时记录错误并使用默认策略"""
+        try:
+            return cls(**(provider.retry_policy or {}))
+        except ValueError as e:
+            logger.error(f"API提供商 {provider.name} 的重试策略不合法，使用默认策略: {str(e)}")
+            return cls()
+
+    def backoff(self, attempt):
+        """第 attempt 次请求失败后的等待时间(秒)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def should_retry(self, response_data):
+        """判断调用结果是否需要重试；本地限流不重试（由限流模式决定是否等待）"""
+        if not isinstance(response_data, dict) or not response_data.get('error'):
+            return False
+        if response_data.get('rate_limited'):
+            return False
+        status_code = response_data.get('status_code')
+        if status_code is None:
+            return self.retry_on_timeout
+        return status_code in self.retry_on
+
+    def hedge_delay_for(self, connection):
+        """
+        发出对冲请求前的等待时间(秒)
+
+        Returns:
+            等待秒数，未启用对冲或延迟样本不足时返回None
+        """
+        if not self.hedge or self.max_attempts < 2:
+            return None
+        if self.hedge_delay is not None:
+            return self.hedge_delay / 1000
+        latency = latency_tracker.quantile(connection.id, self.hedge_quantile)
+        return latency / 1000 if latency is not None else None
+
+
+class LatencyTracker:
+    """按连接保存最近成功请求的延迟，用于计算对冲等待时间"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, connection_id, latency):
+        """记录一次成功请求的延迟(ms)"""
+        with self._lock:
+            samples = self._samples.get(connection_id)
+            if samples is None:
+                samples = self._samples[connection_id] = deque(maxlen=self.window)
+            samples.append(latency)
+
+    def quantile(self, connection_id, q):
+        """返回延迟的q分位数(ms)，样本不足 HEDGE_MIN_SAMPLES 个时返回None"""
+        with self._lock:
+            samples = sorted(self._samples.get(connection_id) or ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+# 进程级的全局延迟记录
+latency_tracker = LatencyTracker()
+
+
+def hedge_connection(connection):
+    """选择对冲请求使用的连接：同一提供商类型的另一个活跃连接（已解析），没有时返回None，使用原连接"""
+    for resolved in connection_registry.get_pool(connection.provider.provider_type):
+        if resolved.connection.id != connection.id:
+            return resolved
+    return None
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def hedge_executor():
+    """对冲请求共用的线程池（每个进程一个），大小为 API_CONNECTOR_HEDGE_WORKERS"""
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'API_CONNECTOR_HEDGE_WORKERS', 16),
+                    thread_name_prefix='api-hedge'
+                )
+    return _hedge_executor
+
+
+def race_hedged(primary, hedge, delay, is_failure):
+    """
+    在调用方线程中发送主请求，delay 秒后仍未返回时在 hedge_executor 中发出对冲请求
+
+    主请求不经过线程池排队，线程池繁忙时不会因为主请求尚未开始执行而误发对冲请求。
+    同步请求无法中途取消，主请求返回可用结果时直接采用，对冲请求在后台执行到结束，
+    结果被丢弃；主请求失败时等待对冲请求的结果。
+
+    Args:
+        primary: 发送主请求的无参函数
+        hedge: 发送对冲请求的无参函数
+        delay: 发出对冲请求前的等待时间(秒)
+        is_failure: 判断结果是否需要等待另一个请求的函数
+
+    Returns:
+        (结果, 实际发出的请求数)；两个请求都失败时返回对冲请求的结果
+    """
+    hedge_futures = []
+    timer = threading.Timer(delay, lambda: hedge_futures.append(hedge_executor().submit(hedge)))
+    timer.daemon = True
+    timer.start()
+    try:
+        result = primary()
+    finally:
+        timer.cancel()
+        # 计时器可能正在提交对冲请求，等它结束后再判断是否发出过对冲请求
+        timer.join()
+
+    if not hedge_futures:
+        return result, 1
+    if not is_failure(result):
+        return result, 2
+    return hedge_futures[0].result(), 2
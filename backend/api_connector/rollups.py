@@ -0,0 +1,173 @@
+"""
+API使用统计汇总表的维护
+
+日志写入时（见 usage_logger）按 (连接, 提供商, 状态, 小时/天) 增量更新
+APIUsageHourly 和 APIUsageDaily，统计接口只读取汇总表而不再扫描 APIUsageLog。
+rebuild_rollups 从原始日志重新计算指定时间范围，用于历史数据回填和定期校正。
+"""
+
+import logging
+from datetime import datetime, timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value, Count, Sum, Min, Max
+from django.db.models.functions import Least, Greatest, TruncHour, TruncDate
+from django.utils import timezone
+
+from .models import APIUsageLog, APIUsageHourly, APIUsageDaily
+
+logger = logging.getLogger(__name__)
+
+
+def hour_bucket(value):
+    """日志时间所在的小时"""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(value):
+    """日志时间在当前时区下的日期"""
+    return timezone.localdate(value)
+
+
+def _aggregate(logs):
+    """在内存中把一批日志聚合为 {(模型, 连接ID, 提供商ID, 状态, 时间桶): [数量, 令牌, 延迟和, 最小, 最大]}"""
+    totals = {}
+    for log in logs:
+        created_at = log.created_at or timezone.now()
+        provider_id = log.connection.provider_id
+        latency = log.response_time or 0
+        for model, bucket in ((APIUsageHourly, hour_bucket(created_at)),
+                              (APIUsageDaily, day_bucket(created_at))):
+            key = (model, log.connection_id, provider_id, log.status, bucket)
+            entry = totals.get(key)
+            if entry is None:
+                totals[key] = [1, log.tokens_used or 0, latency, latency, latency]
+            else:
+                entry[0] += 1
+                entry[1] += log.tokens_used or 0
+                entry[2] += latency
+                entry[3] = min(entry[3], latency)
+                entry[4] = max(entry[4], latency)
+    return totals
+
+
+def _increment(model, key, count, tokens, latency_sum, latency_min, latency_max):
+    """对已有的汇总行做原子增量更新，返回更新的行数"""
+    return model.objects.filter(**key).update(
+        request_count=F('request_count') + count,
+        tokens_sum=F('tokens_sum') + tokens,
+        latency_sum=F('latency_sum') + latency_sum,
+        latency_min=Least(F('latency_min'), Value(latency_min)),
+        latency_max=Greatest(F('latency_max'), Value(latency_max)),
+        updated_at=timezone.now(),
+    )
+
+
+def apply_logs(logs):
+    """把一批已写入的日志累加到小时和每日汇总表"""
+    for (model, connection_id, provider_id, status, bucket), values in _aggregate(logs).items():
+        key = {
+            'connection_id': connection_id,
+            'provider_id': provider_id,
+            'status': status,
+            'bucket': bucket,
+        }
+        try:
+            # 在保存点中更新，出错时只回滚这一行，不会中断调用方的事务
+            with transaction.atomic():
+                _apply_bucket(model, key, values)
+        except Exception as e:
+            logger.exception(f"更新API使用汇总表时出错: {str(e)}")
+
+
+def _apply_bucket(model, key, values):
+    """把一个时间桶的统计值累加到汇总表，行不存在时创建"""
+    if _increment(model, key, *values):
+        return
+    try:
+        with transaction.atomic():
+            count, tokens, latency_sum, latency_min, latency_max = values
+            model.objects.create(
+                request_count=count,
+                tokens_sum=tokens,
+                latency_sum=latency_sum,
+                latency_min=latency_min,
+                latency_max=latency_max,
+                **key
+            )
+    except IntegrityError:
+        # 其他进程刚刚创建了这一行
+        _increment(model, key, *values)
+
+
+def rebuild_rollups(start=None, end=None):
+    """
+    从原始日志重新计算汇总表
+
+    Args:
+        start: 开始日期（包含），为None时从最早的日志开始
+        end: 结束日期（包含），为None时到今天
+
+    注意：只应对原始日志仍然完整保留的日期调用。
+    """
+    from .statistics import invalidate_days
+    
+    tz = timezone.get_current_timezone()
+    logs = APIUsageLog.objects.all()
+    hourly = APIUsageHourly.objects.all()
+    daily = APIUsageDaily.objects.all()
+    if start is not None:
+        start_at = timezone.make_aware(datetime.combine(start, datetime.min.time()), tz)
+        logs = logs.filter(created_at__gte=start_at)
+        hourly = hourly.filter(bucket__gte=start_at)
+        daily = daily.filter(bucket__gte=start)
+    if end is not None:
+        end_at = timezone.make_aware(datetime.combine(end + timedelta(days=1), datetime.min.time()), tz)
+        logs = logs.filter(created_at__lt=end_at)
+        hourly = hourly.filter(bucket__lt=end_at)
+        daily = daily.filter(bucket__lte=end)
+
+    aggregates = {
+        'request_count': Count('id'),
+        'tokens_sum': Sum('tokens_used'),
+        'latency_sum': Sum('response_time'),
+        'latency_min': Min('response_time'),
+        'latency_max': Max('response_time'),
+    }
+
+    with transaction.atomic():
+        hourly.delete()
+        daily.delete()
+        for model, trunc in ((APIUsageHourly, TruncHour('created_at', tzinfo=tz)),
+                             (APIUsageDaily, TruncDate('created_at', tzinfo=tz))):
+            rows = (
+                logs.annotate(bucket_value=trunc)
+                .values('connection_id', 'connection__provider_id', 'status', 'bucket_value')
+                .annotate(**aggregates)
+                .order_by()
+            )
+            model.objects.bulk_create([
+                model(
+                    connection_id=row['connection_id'],
+                    provider_id=row['connection__provider_id'],
+                    status=row['status'],
+                    bucket=row['bucket_value'],
+                    request_count=row['request_count'],
+                    tokens_sum=row['tokens_sum'] or 0,
+                    latency_sum=row['latency_sum'] or 0,
+                    latency_min=row['latency_min'] or 0,
+                    latency_max=row['latency_max'] or 0,
+                )
+                for row in rows.iterator()
+            ], batch_size=1000)
+    
+    # 已缓存的封闭日统计可能被校正，需要失效
+    if start is None:
+        first_log = APIUsageLog.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        start = day_bucket(first_log) if first_log else timezone.localdate()
+    day = start
+    last_day = end or timezone.localdate()
+    rebuilt_days = []
+    while day <= last_day:
+        rebuilt_days.append(day)
+        day += timedelta(days=1)
+    invalidate_days(rebuilt_days)
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import APIProvider, APIConnection, APIUsageLog, APIModel
+from .retry import RetryPolicy
+from .tokens import token_budget
 
 class APIProviderSerializer(serializers.ModelSerializer):
     """API提供商序列化器"""
@@ -10,13 +12,25 @@ class APIProviderSerializer(serializers.ModelSerializer):
         model = APIProvider
         fields = [
             'id', 'name', 'provider_type', 'provider_type_display', 'description',
-            'icon', 'base_url', 'docs_url', 'is_active', 'created_at', 'updated_at'
+            'icon', 'base_url', 'docs_url', 'is_active', 'retry_policy', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
     
     def get_provider_type_display(self, obj):
         """获取提供商类型显示名称"""
         return dict(APIProvider.PROVIDER_CHOICES).get(obj.provider_type, '')
+    
+    def validate_retry_policy(self, value):
+        """校验重试策略的配置项和取值"""
+        if value in (None, {}):
+            return value
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("重试策略必须是JSON对象")
+        try:
+            RetryPolicy(**value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
 
 
 class APIConnectionSerializer(serializers.ModelSerializer):
@@ -47,13 +61,15 @@ class APIConnectionDetailSerializer(serializers.ModelSerializer):
     
     provider_name = serializers.SerializerMethodField()
     provider_type = serializers.SerializerMethodField()
+    tokens_used_today = serializers.SerializerMethodField()
     
     class Meta:
         model = APIConnection
         fields = [
             'id', 'name', 'provider', 'provider_name', 'provider_type',
             'api_key', 'api_secret', 'org_id', 'custom_headers', 'custom_params',
-            'rate_limit', 'is_default', 'is_active', 'created_at', 'updated_at'
+            'rate_limit', 'daily_token_budget', 'tokens_used_today',
+            'is_default', 'is_active', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
         extra_kwargs = {
@@ -68,6 +84,10 @@ class APIConnectionDetailSerializer(serializers.ModelSerializer):
     def get_provider_type(self, obj):
         """获取提供商类型"""
         return obj.provider.provider_type if obj.provider else ''
+    
+    def get_tokens_used_today(self, obj):
+        """获取当日已用（含已预留）的令牌数，未设置每日预算时不统计"""
+        return token_budget.used(obj) if obj.daily_token_budget else None
 
 
 class APIModelSerializer(serializers.ModelSerializer):
@@ -116,7 +136,8 @@ class APIUsageLogSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'connection', 'connection_name', 'provider_name',
             'endpoint', 'request_data', 'response_data', 'status', 'status_display',
-            'error_message', 'tokens_used', 'response_time', 'user_ip', 'created_at'
+            'error_message', 'tokens_used', 'estimated_tokens', 'response_time', 'user_ip',
+            'cache_hit', 'attempt', 'created_at'
         ]
         read_only_fields = ['created_at']
     
@@ -130,4 +151,14 @@ class APIUsageLogSerializer(serializers.ModelSerializer):
     
     def get_status_display(self, obj):
         """获取状态显示名称"""
-        return dict(APIUsageLog.STATUS_CHOICES).get(obj.status, '') 
\ No newline at end of file
+        return dict(APIUsageLog.STATUS_CHOICES).get(obj.status, '') 
+
+
+class APIUsageLogListSerializer(APIUsageLogSerializer):
+    """API使用日志列表序列化器，不包含请求和响应数据"""
+    
+    class Meta(APIUsageLogSerializer.Meta):
+        fields = [
+            field for field in APIUsageLogSerializer.Meta.fields
+            if field not in ('request_data', 'response_data')
+        ]
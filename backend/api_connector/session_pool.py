@@ -0,0 +1,151 @@
+"""
+API连接器的HTTP会话池
+
+为每个 (API连接ID, 提供商base_url) 维护一个进程级的 requests.Session，
+复用底层的 TCP/TLS 连接，避免每次调用上游接口都重新握手。
+"""
+
+import os
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    """进程级的HTTP会话注册表，按 (连接ID, base_url) 复用会话"""
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, idle_timeout=None):
+        """
+        初始化会话池
+
+        Args:
+            pool_connections: 每个会话缓存的主机连接池数量，默认读取 API_CONNECTOR_POOL_CONNECTIONS
+            pool_maxsize: 每个主机连接池保持的最大连接数，默认读取 API_CONNECTOR_POOL_MAXSIZE
+            idle_timeout: 会话空闲多少秒后被回收，默认读取 API_CONNECTOR_SESSION_IDLE_TIMEOUT
+        """
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._idle_timeout = idle_timeout
+        self._sessions = {}  # (connection_id, base_url) -> [session, last_used]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_sweep = time.monotonic()
+
+    @property
+    def pool_connections(self):
+        if self._pool_connections is not None:
+            return self._pool_connections
+        return getattr(settings, 'API_CONNECTOR_POOL_CONNECTIONS', 10)
+
+    @property
+    def pool_maxsize(self):
+        if self._pool_maxsize is not None:
+            return self._pool_maxsize
+        return getattr(settings, 'API_CONNECTOR_POOL_MAXSIZE', 20)
+
+    @property
+    def idle_timeout(self):
+        if self._idle_timeout is not None:
+            return self._idle_timeout
+        return getattr(settings, 'API_CONNECTOR_SESSION_IDLE_TIMEOUT', 300)
+
+    def _create_session(self):
+        """创建带连接池的会话"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _check_fork(self):
+        """fork后的子进程不能复用父进程的套接字，需要丢弃继承来的会话"""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._sessions = {}
+            self._lock = threading.Lock()
+            self._pid = pid
+
+    def get_session(self, connection_id, base_url):
+        """获取（必要时创建）指定连接的会话"""
+        self._check_fork()
+        key = (str(connection_id), base_url)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = [self._create_session(), now]
+                self._sessions[key] = entry
+            else:
+                entry[1] = now
+            expired = self._collect_idle(now)
+        self._close_all(expired)
+        return entry[0]
+
+    def _collect_idle(self, now):
+        """取出空闲超时的会话，调用方需持有锁"""
+        idle_timeout = self.idle_timeout
+        if not idle_timeout or now - self._last_sweep < idle_timeout / 2:
+            return []
+        self._last_sweep = now
+        expired = []
+        for key, (session, last_used) in list(self._sessions.items()):
+            if now - last_used > idle_timeout:
+                expired.append(session)
+                del self._sessions[key]
+        return expired
+
+    def evict_idle(self):
+        """立即回收所有空闲超时的会话"""
+        self._check_fork()
+        with self._lock:
+            self._last_sweep = 0
+            expired = self._collect_idle(time.monotonic())
+        self._close_all(expired)
+        return len(expired)
+
+    def discard(self, connection_id):
+        """丢弃指定连接的全部会话，下次调用时按最新配置重建"""
+        self._check_fork()
+        connection_id = str(connection_id)
+        with self._lock:
+            removed = [
+                self._sessions.pop(key)[0]
+                for key in list(self._sessions)
+                if key[0] == connection_id
+            ]
+        self._close_all(removed)
+
+    def clear(self):
+        """关闭并清空所有会话"""
+        with self._lock:
+            removed = [session for session, _ in self._sessions.values()]
+            self._sessions = {}
+        self._close_all(removed)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def _close_all(sessions):
+        for session in sessions:
+            try:
+                session.close()
+            except Exception as e:
+                logger.warning(f"关闭HTTP会话时出错: {str(e)}")
+
+
+# 进程级的全局会话池
+session_pool = SessionPool()
+
+
+def get_session(connection):
+    """获取API连接对应的复用会话"""
+    return session_pool.get_session(connection.id, connection.provider.base_url)
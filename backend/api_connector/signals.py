@@ -1,7 +1,10 @@
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.core.cache import cache
-from .models import APIProvider, APIConnection
+from .models import APIProvider, APIConnection, APIModel
+from .session_pool import session_pool
+from .registry import connection_registry
+from .baidu_token import baidu_token_manager
 
 @receiver(post_save, sender=APIProvider)
 def api_provider_saved(sender, instance, created, **kwargs):
@@ -9,6 +12,10 @@ def api_provider_saved(sender, instance, created, **kwargs):
     cache.delete(f'api_provider_{instance.id}')
     cache.delete('api_providers_list')
     cache.delete('active_api_providers_list')
+    connection_registry.invalidate()
+    # base_url可能已变更，重建该提供商下连接的HTTP会话
+    for connection_id in instance.connections.values_list('id', flat=True):
+        session_pool.discard(connection_id)
 
 @receiver(post_delete, sender=APIProvider)
 def api_provider_deleted(sender, instance, **kwargs):
@@ -16,6 +23,7 @@ def api_provider_deleted(sender, instance, **kwargs):
     cache.delete(f'api_provider_{instance.id}')
     cache.delete('api_providers_list')
     cache.delete('active_api_providers_list')
+    connection_registry.invalidate()
 
 @receiver(post_save, sender=APIConnection)
 def api_connection_saved(sender, instance, created, **kwargs):
@@ -24,6 +32,11 @@ def api_connection_saved(sender, instance, created, **kwargs):
     cache.delete(f'api_connections_provider_{instance.provider.id}')
     cache.delete('api_connections_list')
     cache.delete('default_api_connections')
+    connection_registry.invalidate()
+    # 密钥可能已变更，重新获取百度access_token
+    baidu_token_manager.invalidate(instance)
+    # 连接配置变更后重建HTTP会话
+    session_pool.discard(instance.id)
 
 @receiver(post_delete, sender=APIConnection)
 def api_connection_deleted(sender, instance, **kwargs):
@@ -32,6 +45,14 @@ def api_connection_deleted(sender, instance, **kwargs):
     cache.delete(f'api_connections_provider_{instance.provider.id}')
     cache.delete('api_connections_list')
     cache.delete('default_api_connections')
+    connection_registry.invalidate()
+    session_pool.discard(instance.id)
+
+@receiver(post_save, sender=APIModel)
+@receiver(post_delete, sender=APIModel)
+def api_model_changed(sender, instance, **kwargs):
+    """当API模型保存或删除时，清除缓存的模型上下文限制"""
+    connection_registry.invalidate()
 
 @receiver(pre_save, sender=APIConnection)
 def encrypt_api_keys(sender, instance, **kwargs):
@@ -0,0 +1,230 @@
+"""
+API使用统计的计算与缓存
+
+统计数据全部来自小时/每日汇总表。已经结束的日期（"封闭日"）不会再有新的日志，
+其每日数据和截至该日的累计数据可以长期缓存（过期时间有上限，避免缓存无限增长）；只有尚未结束的日期（通常只有今天）
+需要每次重新聚合，因此任意日期范围的查询都只需要很少的数据库访问。
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, Q
+from django.utils import timezone
+
+from .models import APIProvider, APIUsageLog, APIUsageDaily, APIUsageHourly
+
+# 日期结束后再等待多久才视为封闭，留给批量写入的日志落库
+CLOSED_DAY_GRACE = timedelta(minutes=5)
+
+
+def _day_key(day):
+    return f'api_usage_daily_{day.isoformat()}'
+
+
+def _totals_key(day):
+    return f'api_usage_totals_until_{day.isoformat()}'
+
+
+def window_cache_key(period, start_date, end_date):
+    """按规范化后的查询窗口生成整个统计结果的缓存键"""
+    return f'api_usage_statistics_{period}_{start_date.isoformat()}_{end_date.isoformat()}'
+
+
+def last_closed_day(now=None):
+    """最近一个已经封闭的日期"""
+    now = timezone.localtime(now)
+    return (now - CLOSED_DAY_GRACE).date() - timedelta(days=1)
+
+
+def invalidate_days(days):
+    """汇总表被重新计算后，清除相关日期的缓存"""
+    days = list(days)
+    if not days:
+        return
+    cache.delete_many([_day_key(day) for day in days])
+    # 截至这些日期之后任意一天的累计数据都可能受影响，最近的累计缓存一并清除
+    earliest = min(days)
+    cutoff = last_closed_day()
+    keys = []
+    day = earliest
+    while day <= cutoff:
+        keys.append(_totals_key(day))
+        day += timedelta(days=1)
+    cache.delete_many(keys)
+
+
+def _daily_rows(start_date, end_date):
+    """从每日汇总表按日期聚合"""
+    rows = APIUsageDaily.objects.filter(
+        bucket__gte=start_date, bucket__lte=end_date
+    ).values('bucket').annotate(
+        requests=Sum('request_count'),
+        tokens=Sum('tokens_sum')
+    ).order_by()
+    return {
+        row['bucket']: {'requests': row['requests'] or 0, 'tokens': row['tokens'] or 0}
+        for row in rows
+    }
+
+
+def get_daily_stats(start_date, end_date):
+    """按日期统计请求数和Token消耗，封闭日的数据长期缓存"""
+    cutoff = last_closed_day()
+    days = []
+    day = start_date
+    while day <= end_date:
+        days.append(day)
+        day += timedelta(days=1)
+
+    closed = [day for day in days if day <= cutoff]
+    cached = cache.get_many([_day_key(day) for day in closed])
+    values = {day: cached[_day_key(day)] for day in closed if _day_key(day) in cached}
+
+    missing_closed = [day for day in closed if day not in values]
+    if missing_closed:
+        rows = _daily_rows(min(missing_closed), max(missing_closed))
+        fresh = {day: rows.get(day, {'requests': 0, 'tokens': 0}) for day in missing_closed}
+        cache.set_many(
+            {_day_key(day): value for day, value in fresh.items()},
+            timeout=getattr(settings, 'API_USAGE_STATISTICS_CLOSED_DAY_TIMEOUT', 60 * 60 * 24 * 7)
+        )
+        values.update(fresh)
+
+    open_days = [day for day in days if day > cutoff]
+    if open_days:
+        rows = _daily_rows(open_days[0], open_days[-1])
+        for day in open_days:
+            values[day] = rows.get(day, {'requests': 0, 'tokens': 0})
+
+    return [
+        {
+            'date': day.strftime('%Y-%m-%d'),
+            'requests': values[day]['requests'],
+            'tokens': values[day]['tokens']
+        }
+        for day in days
+    ]
+
+
+def _aggregate_totals(queryset):
+    """按状态和提供商聚合一段时间的汇总数据"""
+    status_counts = {}
+    for row in queryset.values('status').annotate(requests=Sum('request_count')).order_by():
+        status_counts[row['status']] = row['requests'] or 0
+
+    providers = {}
+    for row in queryset.values('provider_id').annotate(
+            requests=Sum('request_count'),
+            success_requests=Sum('request_count', filter=Q(status='success')),
+            tokens=Sum('tokens_sum'),
+            latency=Sum('latency_sum')).order_by():
+        providers[str(row['provider_id'])] = {
+            'requests': row['requests'] or 0,
+            'success_requests': row['success_requests'] or 0,
+            'tokens': row['tokens'] or 0,
+            'latency': row['latency'] or 0,
+        }
+    return {'status': status_counts, 'providers': providers}
+
+
+def _merge_totals(a, b):
+    status_counts = dict(a['status'])
+    for key, value in b['status'].items():
+        status_counts[key] = status_counts.get(key, 0) + value
+    providers = {key: dict(value) for key, value in a['providers'].items()}
+    for key, value in b['providers'].items():
+        target = providers.setdefault(key, {'requests': 0, 'success_requests': 0, 'tokens': 0, 'latency': 0})
+        for field, amount in value.items():
+            target[field] += amount
+    return {'status': status_counts, 'providers': providers}
+
+
+def get_all_time_totals():
+    """全部时间的累计数据：截至最近封闭日的部分走缓存，之后的部分实时聚合"""
+    cutoff = last_closed_day()
+    key = _totals_key(cutoff)
+    closed_totals = cache.get(key)
+    if closed_totals is None:
+        closed_totals = _aggregate_totals(APIUsageDaily.objects.filter(bucket__lte=cutoff))
+        # 第二天就会换用新的截止日期，保留两天足够
+        cache.set(key, closed_totals, 60 * 60 * 48)
+    open_totals = _aggregate_totals(APIUsageDaily.objects.filter(bucket__gt=cutoff))
+    return _merge_totals(closed_totals, open_totals)
+
+
+def get_hourly_stats(day):
+    """指定日期按小时的请求数和Token消耗"""
+    rows = APIUsageHourly.objects.filter(
+        bucket__date=day
+    ).values('bucket').annotate(
+        requests=Sum('request_count'),
+        tokens=Sum('tokens_sum')
+    ).order_by('bucket')
+    return [
+        {
+            'hour': timezone.localtime(row['bucket']).strftime('%Y-%m-%d %H:00'),
+            'requests': row['requests'] or 0,
+            'tokens': row['tokens'] or 0
+        }
+        for row in rows
+    ]
+
+
+def get_usage_statistics(period, start_date, end_date):
+    """
+    获取指定窗口的使用统计，整个结果按窗口缓存较短时间
+
+    Args:
+        period: 统计周期（today/week/month/custom）
+        start_date: 开始日期（包含）
+        end_date: 结束日期（包含）
+    """
+    key = window_cache_key(period, start_date, end_date)
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    totals = get_all_time_totals()
+
+    # 按状态统计（全部时间）
+    status_stats = {status_choice: 0 for status_choice, _ in APIUsageLog.STATUS_CHOICES}
+    status_stats.update(totals['status'])
+
+    # 按提供商统计
+    provider_names = dict(
+        APIProvider.objects.filter(id__in=list(totals['providers'])).values_list('id', 'name')
+    )
+    provider_names = {str(provider_id): name for provider_id, name in provider_names.items()}
+    provider_stats = []
+    for provider_id, value in totals['providers'].items():
+        if value['requests'] > 0 and provider_id in provider_names:
+            provider_stats.append({
+                'provider': provider_names[provider_id],
+                'requests': value['requests'],
+                'success_rate': value['success_requests'] / value['requests'],
+                'tokens': value['tokens'],
+                'avg_response_time': value['latency'] / value['requests']
+            })
+    provider_stats.sort(key=lambda item: item['provider'])
+
+    # 计算总计数据
+    total_requests = sum(status_stats.values())
+    success_requests = status_stats.get('success', 0)
+
+    stats = {
+        'total_requests': total_requests,
+        'success_requests': success_requests,
+        'failed_requests': total_requests - success_requests,
+        'total_tokens': sum(value['tokens'] for value in totals['providers'].values()),
+        'status_stats': status_stats,
+        'daily_stats': get_daily_stats(start_date, end_date),
+        'provider_stats': provider_stats
+    }
+
+    # 当天的统计额外返回按小时的明细
+    if period == 'today':
+        stats['hourly_stats'] = get_hourly_stats(start_date)
+
+    cache.set(key, stats, getattr(settings, 'API_USAGE_STATISTICS_CACHE_TIMEOUT', 60))
+    return stats
@@ -0,0 +1,48 @@
+"""
+API连接服务的Celery任务
+"""
+
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+from .rollups import rebuild_rollups
+from .batch import execute_batch_job
+from .archive import archive_usage_logs as archive_logs
+
+@shared_task
+def rebuild_usage_rollups(days=2):
+    """
+    根据原始日志重新计算最近几天的统计汇总，校正增量更新中可能出现的偏差
+    
+    参数:
+        days: 重新计算的天数（包含今天）
+    """
+    # 不能超出原始日志的保留期，已归档日期的原始日志不完整
+    days = min(max(1, days), getattr(settings, 'API_USAGE_LOG_RETENTION_DAYS', 30))
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    rebuild_rollups(start=start, end=today)
+    return {'start': start.isoformat(), 'end': today.isoformat()}
+
+@shared_task
+def run_prompt_batch(job_id):
+    """
+    执行异步批量提示词任务，结果写入 MEDIA_ROOT/api_batches/<job_id>/results.jsonl
+    
+    参数:
+        job_id: 批量任务ID
+    """
+    status = execute_batch_job(job_id)
+    return {'job_id': job_id, 'completed': status['completed'], 'succeeded': status['succeeded']}
+
+@shared_task
+def archive_usage_logs(older_than_days=None):
+    """
+    把早于保留期的API使用日志归档到 MEDIA_ROOT 下的压缩JSONL文件并从数据库删除
+    
+    参数:
+        older_than_days: 保留天数，默认读取 API_USAGE_LOG_RETENTION_DAYS
+    """
+    result = archive_logs(older_than_days=older_than_days)
+    return {'cutoff': result['cutoff'], 'archived': result['archived'], 'files': len(result['files'])}
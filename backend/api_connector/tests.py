@@ -1,3 +1,702 @@
-from django.test import TestCase
+import io
+import os
+import time
+import asyncio
+import tempfile
+import threading
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .coalesce import RequestCoalescer
+from .embeddings import EmbeddingCache
+from .models import APIProvider, APIConnection, APIUsageLog, APIUsageDaily
+from .rate_limit import TokenBucketLimiter, RateLimitExceeded
+from .registry import ResolvedConnection
+from .tokens import TokenBudget
+from .utils import APIConnector
+
+try:
+    import fakeredis
+except ImportError:  # 只用于测试Lua脚本，未安装时跳过
+    fakeredis = None
+
+
+def _connection(rate_limit, id='conn-1', name='test'):
+    return SimpleNamespace(id=id, name=name, rate_limit=rate_limit)
+
+
+class _FakeRedisCache:
+    """只实现令牌桶用到的 RedisCache 接口：make_key 和 _cache.get_client"""
+
+    def __init__(self, client):
+        self._cache = SimpleNamespace(get_client=lambda write=True: client)
+
+    def make_key(self, key):
+        return f':1:{key}'
+
+
+class TokenBucketLockedTests(SimpleTestCase):
+    """非Redis缓存后端上的令牌桶"""
+
+    def setUp(self):
+        self.cache = LocMemCache('rate-limit-tests', {})
+        self.limiter = TokenBucketLimiter(self.cache)
+
+    def test_unlimited_connection_never_waits(self):
+        connection = _connection(0)
+        for _ in range(100):
+            self.assertEqual(self.limiter.try_acquire(connection), 0.0)
+
+    def test_burst_up_to_capacity_then_wait(self):
+        connection = _connection(6)
+        with mock.patch('api_connector.rate_limit.time.time', return_value=1000.0):
+            waits = [self.limiter.try_acquire(connection) for _ in range(7)]
+        self.assertEqual(waits[:6], [0.0] * 6)
+        # 每分钟6个令牌，下一个令牌10秒后可用
+        self.assertAlmostEqual(waits[6], 10.0)
+
+    def test_refill_over_time(self):
+        connection = _connection(6)
+        with mock.patch('api_connector.rate_limit.time.time', return_value=1000.0):
+            for _ in range(6):
+                self.limiter.try_acquire(connection)
+        with mock.patch('api_connector.rate_limit.time.time', return_value=1020.0):
+            self.assertEqual(self.limiter.try_acquire(connection), 0.0)
+            self.assertEqual(self.limiter.try_acquire(connection), 0.0)
+            self.assertGreater(self.limiter.try_acquire(connection), 0.0)
+
+    def test_buckets_are_per_connection(self):
+        first, second = _connection(1, id='a'), _connection(1, id='b')
+        self.assertEqual(self.limiter.try_acquire(first), 0.0)
+        self.assertGreater(self.limiter.try_acquire(first), 0.0)
+        self.assertEqual(self.limiter.try_acquire(second), 0.0)
+
+    def test_reject_mode_raises(self):
+        connection = _connection(1)
+        self.limiter.acquire(connection, mode='reject')
+        with self.assertRaises(RateLimitExceeded) as ctx:
+            self.limiter.acquire(connection, mode='reject')
+        self.assertGreater(ctx.exception.retry_after, 0)
+
+    def test_cache_failure_fails_open(self):
+        broken = mock.Mock(spec=['add', 'get', 'set', 'delete'])
+        broken.add.side_effect = ConnectionError('cache down')
+        limiter = TokenBucketLimiter(broken)
+        self.assertEqual(limiter.try_acquire(_connection(1)), 0.0)
+
+
+@skipUnless(fakeredis is not None, "需要安装 fakeredis（含 lupa）")
+class TokenBucketRedisTests(SimpleTestCase):
+    """Redis后端上的Lua令牌桶，结果与非Redis后端一致"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.limiter = TokenBucketLimiter(_FakeRedisCache(self.redis))
+
+    def test_burst_up_to_capacity_then_wait(self):
+        connection = _connection(60)
+        waits = [self.limiter.try_acquire(connection) for _ in range(61)]
+        self.assertEqual(waits[:60], [0.0] * 60)
+        self.assertGreater(waits[60], 0.0)
+        self.assertLessEqual(waits[60], 1.0)
+
+    def test_state_is_stored_under_cache_key_with_ttl(self):
+        self.limiter.try_acquire(_connection(5, id='x'))
+        key = ':1:api_rate_limit_x'
+        self.assertAlmostEqual(float(self.redis.hget(key, 'tokens')), 4.0, places=2)
+        self.assertGreater(self.redis.ttl(key), 0)
+
+    def test_refill(self):
+        connection = _connection(120)  # 每秒2个令牌
+        for _ in range(120):
+            self.limiter.try_acquire(connection)
+        self.assertGreater(self.limiter.try_acquire(connection), 0.0)
+        time.sleep(0.6)
+        self.assertEqual(self.limiter.try_acquire(connection), 0.0)
+
+
+class StreamTimeoutTests(TestCase):
+    """流式调用使用与非流式调用相同的超时设置"""
+
+    def setUp(self):
+        provider = APIProvider.objects.create(name='p', provider_type='openai', base_url='https://example.com/v1/')
+        self.connection = APIConnection.objects.create(name='c', provider=provider, api_key='k')
+
+    def _stream_timeout(self):
+        response = mock.Mock(status_code=200)
+        response.iter_lines.return_value = [b'data: [DONE]']
+        session = mock.Mock()
+        session.post.return_value = response
+        connector = APIConnector.from_connection(self.connection)
+        with mock.patch('api_connector.utils.get_session', return_value=session):
+            list(connector.stream_api('chat/completions', data={'messages': []}, log_usage=False))
+        return session.post.call_args.kwargs['timeout']
+
+    @override_settings(API_CONNECTOR_REQUEST_TIMEOUT=7)
+    def test_stream_uses_request_timeout_setting(self):
+        self.assertEqual(self._stream_timeout(), 7)
+
+    def test_stream_uses_provider_retry_policy_timeout(self):
+        self.connection.provider.retry_policy = {'timeout': 3}
+        self.assertEqual(self._stream_timeout(), 3)
+
+
+class RequestCoalescerTests(SimpleTestCase):
+    """进行中的相同请求只发送一次"""
+
+    def setUp(self):
+        cache.clear()
+
+    def _run_concurrently(self, coalescers, key, func, count):
+        results = [None] * count
+        started = threading.Barrier(count)
+
+        def worker(index):
+            started.wait()
+            results[index] = coalescers[index % len(coalescers)].run(key, func, wait_timeout=5)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _slow_counter(self, delay=0.2):
+        calls = []
+        lock = threading.Lock()
+
+        def func():
+            with lock:
+                calls.append(1)
+                number = len(calls)
+            time.sleep(delay)
+            return {'call': number}
+        return func, calls
+
+    def test_in_process_callers_share_one_request(self):
+        coalescer = RequestCoalescer(cross_process=False)
+        func, calls = self._slow_counter()
+        results = self._run_concurrently([coalescer], 'k', func, 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'call': 1}] * 8)
+        self.assertEqual(coalescer.coalesced_count, 7)
+        # 等待方拿到的是副本
+        self.assertEqual(len({id(result) for result in results}), 8)
+
+    def test_leader_failure_falls_back_to_own_request(self):
+        coalescer = RequestCoalescer(cross_process=False)
+        calls = []
+
+        def func():
+            calls.append(1)
+            time.sleep(0.1)
+            if len(calls) == 1:
+                raise RuntimeError('upstream failed')
+            return {'ok': True}
+
+        results = []
+
+        def follower():
+            time.sleep(0.02)
+            results.append(coalescer.run('k', func, wait_timeout=5))
+
+        thread = threading.Thread(target=follower)
+        thread.start()
+        with self.assertRaises(RuntimeError):
+            coalescer.run('k', func, wait_timeout=5)
+        thread.join()
+        self.assertEqual(results, [{'ok': True}])
+
+    def test_cross_process_callers_share_one_request(self):
+        # 各自独立的合并器模拟不同进程，只通过缓存协调
+        processes = [RequestCoalescer(cross_process=True) for _ in range(4)]
+        func, calls = self._slow_counter()
+        results = self._run_concurrently(processes, 'k', func, 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'call': 1}] * 4)
+
+    def test_cross_process_waiter_never_gets_a_finished_request_result(self):
+        func, calls = self._slow_counter(delay=0.3)
+        first = RequestCoalescer(cross_process=True)
+        self.assertEqual(first.run('k', func), {'call': 1})
+
+        # 上一次的结果还在结果键的有效期内，新的一轮必须等待新的请求
+        processes = [RequestCoalescer(cross_process=True) for _ in range(2)]
+        results = self._run_concurrently(processes, 'k', func, 2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(results, [{'call': 2}] * 2)
+
+    def test_sequential_calls_are_not_cached(self):
+        coalescer = RequestCoalescer(cross_process=True)
+        func, calls = self._slow_counter(delay=0)
+        self.assertEqual(coalescer.run('k', func), {'call': 1})
+        self.assertEqual(coalescer.run('k', func), {'call': 2})
+
+
+class BatchSyncLimitTests(TestCase):
+    """同步批量调用的提示词数有上限，超过时提示使用异步模式"""
+
+    def setUp(self):
+        provider = APIProvider.objects.create(name='p', provider_type='openai', base_url='https://example.com/v1/')
+        self.connection = APIConnection.objects.create(name='c', provider=provider, api_key='k')
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('u', password='p'))
+        self.url = f'/api/api-connector/connections/{self.connection.id}/batch/'
+
+    def _post(self, count, mode=None):
+        body = '\n'.join(f'"prompt {i}"' for i in range(count))
+        url = f'{self.url}?mode={mode}' if mode else self.url
+        return self.client.generic('POST', url, body, content_type='application/x-ndjson')
+
+    @override_settings(API_CONNECTOR_BATCH_MAX_SYNC_PROMPTS=3)
+    def test_sync_mode_rejects_large_batches(self):
+        response = self._post(4)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('mode=async', response.json()['message'])
+
+    @override_settings(API_CONNECTOR_BATCH_MAX_SYNC_PROMPTS=3)
+    def test_async_mode_accepts_large_batches(self):
+        with mock.patch('api_connector.views.create_batch_job', return_value='0' * 32), \
+                mock.patch('api_connector.views.run_prompt_batch') as task:
+            response = self._post(4, mode='async')
+        self.assertEqual(response.status_code, 202)
+        task.delay.assert_called_once_with('0' * 32)
+
+    @override_settings(API_CONNECTOR_BATCH_MAX_SYNC_PROMPTS=3)
+    def test_sync_mode_closes_thread_connections(self):
+        result = {'success': True, 'content': 'ok'}
+        with mock.patch('api_connector.batch.call_chat', return_value=result), \
+                mock.patch('api_connector.batch.close_old_connections') as close:
+            response = self._post(3)
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(close.call_count, 3)
+
+
+class AsyncViewTests(TestCase):
+    """异步视图校验connection_id，事件循环关闭时关闭共享的AsyncClient"""
+
+    def setUp(self):
+        provider = APIProvider.objects.create(name='p', provider_type='openai', base_url='https://example.com/v1/')
+        self.connection = APIConnection.objects.create(name='c', provider=provider, api_key='k')
+        patcher = mock.patch('api_connector.async_views._authenticate', return_value=SimpleNamespace(is_active=True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _post(self, path, payload):
+        return self.client.post(f'/api/api-connector/async/{path}/', payload, content_type='application/json')
+
+    def test_invalid_connection_id_is_rejected(self):
+        for path, payload in (('stream', {'prompt': 'hi'}), ('gather', {'prompts': ['hi']})):
+            with self.subTest(path=path):
+                response = self._post(path, dict(payload, connection_id='not-a-uuid'))
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('connection_id', response.json()['message'])
+
+    def test_loop_clients_are_closed_at_shutdown(self):
+        from .async_utils import _get_client
+
+        async def open_client():
+            return _get_client(self.connection)
+
+        client = asyncio.run(open_client())
+        self.assertTrue(client.is_closed)
+
+
+class HedgedRequestTests(TestCase):
+    """主请求在调用方线程中发送，只有对冲请求在共享线程池中发送"""
+
+    def setUp(self):
+        provider = APIProvider.objects.create(
+            name='p', provider_type='openai', base_url='https://example.com/v1/',
+            retry_policy={'max_attempts': 2, 'hedge': True, 'hedge_delay': 50}
+        )
+        self.slow = APIConnection.objects.create(name='slow', provider=provider, api_key='k1')
+        self.fast = APIConnection.objects.create(name='fast', provider=provider, api_key='k2')
+
+    def _call(self, delays, failing=()):
+        calls = []
+
+        def send_request(connector, *args, **kwargs):
+            name = connector.connection.name
+            calls.append((name, kwargs['attempt'], threading.current_thread().name))
+            time.sleep(delays[name])
+            if name in failing:
+                return {'error': True, 'status_code': 503, 'served_by': name}
+            return {'choices': [], 'served_by': name}
+
+        connector = APIConnector.from_connection(self.slow)
+        with mock.patch.object(APIConnector, '_send_request', send_request), \
+                mock.patch('api_connector.utils.hedge_connection', return_value=ResolvedConnection(self.fast)):
+            result = connector.call_api('chat/completions', data={'messages': []}, log_usage=False)
+        return result, calls
+
+    def test_fast_primary_sends_no_hedge(self):
+        result, calls = self._call({'slow': 0, 'fast': 0})
+        self.assertEqual(result['served_by'], 'slow')
+        self.assertEqual([call[:2] for call in calls], [('slow', 1)])
+
+    def test_slow_primary_is_hedged(self):
+        caller = threading.current_thread().name
+        result, calls = self._call({'slow': 0.3, 'fast': 0}, failing={'slow'})
+        self.assertEqual(result['served_by'], 'fast')
+        self.assertEqual([call[:2] for call in calls], [('slow', 1), ('fast', 2)])
+        self.assertEqual(calls[0][2], caller)
+        self.assertTrue(calls[1][2].startswith('api-hedge'))
+
+    def test_slow_successful_primary_is_kept(self):
+        result, calls = self._call({'slow': 0.3, 'fast': 0})
+        self.assertEqual(result['served_by'], 'slow')
+        self.assertEqual([call[:2] for call in calls], [('slow', 1), ('fast', 2)])
+
+    def test_busy_pool_does_not_delay_primary(self):
+        from .retry import hedge_executor
+
+        release = threading.Event()
+        executor = hedge_executor()
+        blockers = [executor.submit(release.wait) for _ in range(executor._max_workers)]
+        try:
+            result, calls = self._call({'slow': 0, 'fast': 0})
+        finally:
+            release.set()
+            for blocker in blockers:
+                blocker.result()
+        self.assertEqual(result['served_by'], 'slow')
+        self.assertEqual([call[:2] for call in calls], [('slow', 1)])
+
+
+class LatencyResetTests(TestCase):
+    """清空延迟指标需要管理员权限"""
+
+    url = '/api/api-connector/connections/latency/'
+
+    def _delete(self, **user_fields):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user('u', password='p', **user_fields))
+        with mock.patch('api_connector.views.latency_metrics') as metrics:
+            response = client.delete(self.url)
+        return response, metrics
+
+    def test_regular_user_cannot_reset(self):
+        response, metrics = self._delete()
+        self.assertEqual(response.status_code, 403)
+        metrics.reset.assert_not_called()
+
+    def test_admin_can_reset(self):
+        response, metrics = self._delete(is_staff=True)
+        self.assertEqual(response.status_code, 200)
+        metrics.reset.assert_called_once()
+
+
+class UsageLogCursorPaginationTests(TestCase):
+    """使用日志的游标分页与按创建时间倒序的完整查询结果一致"""
+
+    def setUp(self):
+        provider = APIProvider.objects.create(name='p', provider_type='openai', base_url='https://example.com/v1/')
+        self.first = APIConnection.objects.create(name='a', provider=provider, api_key='k1')
+        self.second = APIConnection.objects.create(name='b', provider=provider, api_key='k2')
+        now = timezone.now()
+        for i in range(25):
+            APIUsageLog.objects.create(
+                connection=self.first if i % 3 else self.second, endpoint='chat/completions',
+                request_data={'i': i}, status='success' if i % 4 else 'failed', response_time=1.0,
+                # 每两条日志的创建时间相同，翻页时不能重复或遗漏
+                created_at=now - timedelta(seconds=i // 2)
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('u', password='p'))
+
+    def _walk(self, query):
+        ids = []
+        url = f'/api/api-connector/logs/?pagination=cursor&page_size=4&{query}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertNotIn('count', body)
+            ids.extend(item['id'] for item in body['results'])
+            url = body['next']
+        return ids
+
+    def _expected(self, **filters):
+        return [str(pk) for pk in APIUsageLog.objects.filter(**filters).order_by('-created_at').values_list('id', flat=True)]
+
+    def test_pages_cover_all_logs_once_in_order(self):
+        ids = self._walk('')
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+        self.assertEqual(
+            [APIUsageLog.objects.get(id=pk).created_at for pk in ids],
+            sorted(APIUsageLog.objects.values_list('created_at', flat=True), reverse=True)
+        )
+
+    def test_filters_apply_to_cursor_pages(self):
+        self.assertEqual(sorted(self._walk(f'connection={self.first.id}')), sorted(self._expected(connection=self.first)))
+        self.assertEqual(sorted(self._walk('status=failed')), sorted(self._expected(status='failed')))
+
+    def test_list_omits_payload_unless_requested(self):
+        item = self.client.get('/api/api-connector/logs/?pagination=cursor').json()['results'][0]
+        self.assertNotIn('request_data', item)
+        item = self.client.get('/api/api-connector/logs/?pagination=cursor&include_payload=true').json()['results'][0]
+        self.assertIn('request_data', item)
+
+    def test_page_number_pagination_is_default(self):
+        body = self.client.get('/api/api-connector/logs/').json()
+        self.assertEqual(body['count'], 25)
+
+
+class UsageLogWriterTests(TestCase):
+    """批量写入失败时逐条写入，坏数据不影响同批的其他日志"""
+
+    def setUp(self):
+        provider = APIProvider.objects.create(name='p', provider_type='openai', base_url='https://example.com/v1/')
+        self.connection = APIConnection.objects.create(name='c', provider=provider, api_key='k')
+
+    def _log(self, **kwargs):
+        return APIUsageLog(connection=self.connection, endpoint='chat/completions', status='success',
+                           response_time=1.0, **kwargs)
+
+    def test_failed_bulk_insert_falls_back_to_single_rows(self):
+        from .usage_logger import UsageLogWriter
+
+        existing = self._log()
+        existing.save()
+        batch = [self._log(), self._log(id=existing.id), self._log()]
+        UsageLogWriter(batch_size=10).save_batch(batch)
+        self.assertEqual(
+            set(APIUsageLog.objects.values_list('id', flat=True)),
+            {existing.id, batch[0].id, batch[2].id}
+        )
+        # 重复的日志没有计入汇总表
+        self.assertEqual(APIUsageDaily.objects.get().request_count, 2)
+
+    def test_logs_are_not_kept_without_rollups(self):
+        from .usage_logger import UsageLogWriter
+
+        with mock.patch('api_connector.rollups._aggregate', side_effect=RuntimeError('boom')):
+            UsageLogWriter(batch_size=10).save_batch([self._log(), self._log()])
+        self.assertFalse(APIUsageLog.objects.exists())
+        self.assertFalse(APIUsageDaily.objects.exists())
+
+
+class ClosedDayCacheTests(TestCase):
+    """封闭日的每日统计按配置的过期时间缓存，而不是永久缓存"""
+
+    @override_settings(API_USAGE_STATISTICS_CLOSED_DAY_TIMEOUT=123)
+    def test_closed_days_use_bounded_timeout(self):
+        from .statistics import get_daily_stats, last_closed_day
+
+        day = last_closed_day()
+        with mock.patch('api_connector.statistics.cache') as stats_cache:
+            stats_cache.get_many.return_value = {}
+            rows = get_daily_stats(day - timedelta(days=1), day)
+        self.assertEqual([row['requests'] for row in rows], [0, 0])
+        self.assertEqual(stats_cache.set_many.call_args.kwargs['timeout'], 123)
+
+
+class UsageLogArchiveTests(TestCase):
+    """归档早于保留期的完整自然日，归档文件可以按连接和状态过滤读回"""
+
+    def setUp(self):
+        from .archive import _day_range
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(API_USAGE_ARCHIVE_DIR=self.tmp.name, API_USAGE_ROLLUP_REBUILD_DAYS=2)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        provider = APIProvider.objects.create(name='p', provider_type='openai', base_url='https://example.com/v1/')
+        self.first = APIConnection.objects.create(name='a', provider=provider, api_key='k1')
+        self.second = APIConnection.objects.create(name='b', provider=provider, api_key='k2')
+        # 保留3天：截止日零点之前的日志归档，截止日当天的日志保留
+        self.cutoff = timezone.localdate() - timedelta(days=3)
+        self.old_day = self.cutoff - timedelta(days=1)
+        cutoff_at, _ = _day_range(self.cutoff)
+        self.old = [
+            self._log(self.first, 'success', cutoff_at - timedelta(hours=20)),
+            self._log(self.first, 'failed', cutoff_at - timedelta(hours=10)),
+            self._log(self.second, 'success', cutoff_at - timedelta(seconds=1)),
+        ]
+        self.kept = [self._log(self.first, 'success', cutoff_at), self._log(self.second, 'success', timezone.now())]
+
+    def _log(self, connection, status, created_at):
+        return APIUsageLog.objects.create(
+            connection=connection, endpoint='chat/completions', request_data={'q': '中文'},
+            status=status, response_time=1.0, created_at=created_at
+        ).id
+
+    def _archived_ids(self, **filters):
+        import json
+        from .archive import iter_archived_logs
+
+        return [json.loads(line)['id'] for line in iter_archived_logs(self.old_day, self.cutoff, **filters)]
+
+    def test_archives_only_complete_days_before_cutoff(self):
+        from .archive import archive_usage_logs
+
+        result = archive_usage_logs(older_than_days=3, batch_size=2)
+        self.assertEqual(result['cutoff'], self.cutoff.isoformat())
+        self.assertEqual(result['archived'], 3)
+        self.assertEqual(len(result['files']), 1)
+        self.assertEqual(set(APIUsageLog.objects.values_list('id', flat=True)), set(self.kept))
+        self.assertFalse(any(name.endswith('.tmp') for _, _, names in os.walk(self.tmp.name) for name in names))
+
+    def test_round_trip_with_filters(self):
+        from .archive import archive_usage_logs
+
+        archive_usage_logs(older_than_days=3, batch_size=2)
+        self.assertEqual(self._archived_ids(), [str(pk) for pk in self.old])
+        self.assertEqual(self._archived_ids(connection_id=self.first.id), [str(pk) for pk in self.old[:2]])
+        self.assertEqual(self._archived_ids(status='success'), [str(self.old[0]), str(self.old[2])])
+        self.assertEqual(self._archived_ids(connection_id=self.second.id, status='failed'), [])
+
+    def test_rows_survive_failed_write(self):
+        from .archive import archive_usage_logs
+
+        class FailingWriter(io.StringIO):
+            """写完第一行（已随即删除）后磁盘写满"""
+
+            def write(self, text):
+                if self.getvalue().endswith('\n'):
+                    raise OSError('disk full')
+                return super().write(text)
+
+        with mock.patch('api_connector.archive._open_writer', side_effect=lambda path: FailingWriter()):
+            with self.assertRaises(OSError):
+                archive_usage_logs(older_than_days=3, batch_size=1)
+        self.assertEqual(APIUsageLog.objects.count(), 5)
+        self.assertEqual(self._archived_ids(), [])
+
+    def test_retention_below_minimum_is_rejected(self):
+        from .archive import archive_usage_logs
+
+        with self.assertRaises(ValueError):
+            archive_usage_logs(older_than_days=2)
+        self.assertEqual(APIUsageLog.objects.count(), 5)
+
+
+class TokenBudgetTests(SimpleTestCase):
+    """每日令牌预算的预留和修正"""
+
+    def setUp(self):
+        self.budget = TokenBudget(LocMemCache('token-budget-tests', {}))
+        self.connection = SimpleNamespace(id='conn-1', name='test', daily_token_budget=100)
+
+    def test_reserve_until_budget_then_reject(self):
+        self.assertEqual(self.budget.reserve(self.connection, 60)[:2], (True, 60))
+        allowed, used, reservation = self.budget.reserve(self.connection, 50)
+        self.assertFalse(allowed)
+        self.assertEqual(used, 60)
+        self.assertIsNone(reservation)
+        self.assertEqual(self.budget.used(self.connection), 60)
+
+    def test_settle_corrects_reservation_day(self):
+        with mock.patch('api_connector.tokens.timezone.localdate', return_value=date(2024, 1, 1)):
+            _, _, reservation = self.budget.reserve(self.connection, 50)
+        # 调用跨过零点后修正，仍写回预留当天的计数器
+        with mock.patch('api_connector.tokens.timezone.localdate', return_value=date(2024, 1, 2)):
+            self.budget.settle(self.connection, reservation, 20)
+            self.assertEqual(self.budget.used(self.connection), 0)
+        self.assertEqual(self.budget.used(self.connection, date(2024, 1, 1)), 20)
+
+    def test_cache_failure_allows_call(self):
+        broken = mock.Mock(spec=['add', 'get', 'incr', 'decr'])
+        broken.add.side_effect = ConnectionError('cache down')
+        budget = TokenBudget(broken)
+        self.assertEqual(budget.reserve(self.connection, 50), (True, None, None))
+        budget.settle(self.connection, None, 10)
+        broken.incr.assert_not_called()
+
+    def test_no_budget_makes_no_reservation(self):
+        self.connection.daily_token_budget = 0
+        self.assertEqual(self.budget.reserve(self.connection, 10**9), (True, None, None))
+
+
+class UsageNormalizationTests(TestCase):
+    """记录令牌使用量时按提供商的格式读取usage"""
+
+    def _connector(self, provider_type):
+        provider = APIProvider.objects.create(name=provider_type, provider_type=provider_type, base_url='https://example.com/v1/')
+        connection = APIConnection.objects.create(name=provider_type, provider=provider, api_key='k')
+        return APIConnector.from_connection(connection)
+
+    def test_openai_total_tokens(self):
+        connector = self._connector('openai')
+        self.assertEqual(connector._parse_result({'usage': {'total_tokens': 42}}), ('success', None, 42))
+
+    def test_anthropic_input_and_output_tokens(self):
+        connector = self._connector('anthropic')
+        response = {'content': [], 'usage': {'input_tokens': 30, 'output_tokens': 12}}
+        self.assertEqual(connector._parse_result(response), ('success', None, 42))
+
+    def test_missing_usage_and_errors(self):
+        connector = self._connector('anthropic')
+        self.assertEqual(connector._parse_result({'content': []}), ('success', None, 0))
+        self.assertEqual(connector._parse_result({'error': True, 'message': 'x'}), ('error', 'x', 0))
+
+
+class EmbedTextsTests(TestCase):
+    """批量嵌入在线程池中发送，每批用完后关闭线程的数据库连接"""
+
+    def setUp(self):
+        provider = APIProvider.objects.create(name='p', provider_type='openai', base_url='https://example.com/v1/')
+        self.connector = APIConnector.from_connection(
+            APIConnection.objects.create(name='c', provider=provider, api_key='k')
+        )
+
+    def test_batches_close_thread_connections(self):
+        from .embeddings import embed_texts
+
+        def embed_batch(connector, texts, model, user_ip):
+            return [[float(len(text))] for text in texts]
+
+        with mock.patch.object(type(self.connector.adapter), 'max_embedding_batch', 2), \
+                mock.patch('api_connector.embeddings._embed_batch', side_effect=embed_batch), \
+                mock.patch('api_connector.embeddings.close_old_connections') as close:
+            matrix = embed_texts(self.connector, ['a', 'bb', 'ccc'], use_cache=False)
+        self.assertEqual(matrix[:, 0].tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(close.call_count, 2)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    """嵌入缓存的目录结构和并发写入"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = EmbeddingCache(self.tmp.name)
+        self.digest = 'ab' + '0' * 62
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_layout_is_provider_then_model(self):
+        self.cache.set('openai/org/model v1', self.digest, [1.0, 2.0])
+        expected = os.path.join(self.tmp.name, 'openai', 'org', 'model_v1', 'ab', f'{self.digest}.f32')
+        self.assertTrue(os.path.exists(expected))
+        self.assertEqual(self.cache.get('openai/org/model v1', self.digest).tolist(), [1.0, 2.0])
+
+    def test_namespace_cannot_escape_directory(self):
+        self.cache.set('../../etc', self.digest, [1.0])
+        path = self.cache._path('../../etc', self.digest)
+        self.assertTrue(os.path.realpath(path).startswith(os.path.realpath(self.tmp.name) + os.sep))
+
+    def test_concurrent_writes_of_same_vector(self):
+        vector = [float(i) for i in range(256)]
+        threads = [threading.Thread(target=self.cache.set, args=('openai/m', self.digest, vector)) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('openai/m', self.digest).tolist(), vector)
+        directory = os.path.dirname(self.cache._path('openai/m', self.digest))
+        self.assertEqual(os.listdir(directory), [f'{self.digest}.f32'])
@@ -0,0 +1,231 @@
+"""
+发送请求前的令牌估算和每日令牌预算
+
+- 估算：安装了 tiktoken 时按模型标识符使用对应的BPE编码（每个模型的编码器只加载一次），
+  否则使用近似规则：每个中日韩字符计为1个令牌，其他字符每4个计为1个令牌
+- 上下文限制：提示词令牌数加上请求的 max_tokens 超过 APIModel.max_tokens 时，
+  按 API_CONNECTOR_TOKEN_LIMIT_MODE 在本地拒绝（reject）或截断提示词（truncate），
+  不再浪费一次上游往返
+- 每日预算：APIConnection.daily_token_budget 大于0时，发送前用缓存计数器原子地预留
+  估算的令牌数，超出预算时拒绝；响应返回后按实际用量（上游未返回usage时保留估算值）修正
+"""
+
+import re
+import logging
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，未安装时使用近似估算
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = 'cl100k_base'
+MESSAGE_OVERHEAD = 4  # 每条消息的角色和分隔符占用的令牌数
+REPLY_OVERHEAD = 3  # 回复的起始标记占用的令牌数
+
+# 一次预留：预留的令牌数和预留时的自然日，修正用量时写回同一天的计数器
+Reservation = namedtuple('Reservation', ['tokens', 'day'])
+CHARS_PER_TOKEN = 4  # 近似估算时非中日韩字符每个令牌的字符数
+
+CJK_RANGES = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_CJK_OR_CHUNK = re.compile(f'[{CJK_RANGES}]|[^{CJK_RANGES}]{{1,{CHARS_PER_TOKEN}}}')
+
+
+class HeuristicEncoder:
+    """没有可用分词器时的近似编码器，编码结果为文本片段"""
+
+    name = 'heuristic'
+
+    def encode(self, text):
+        return _CJK_OR_CHUNK.findall(text)
+
+    def decode(self, tokens):
+        return ''.join(tokens)
+
+
+@lru_cache(maxsize=64)
+def get_encoder(model_identifier=None):
+    """获取模型的编码器（按模型标识符缓存）"""
+    if tiktoken is not None:
+        try:
+            if model_identifier:
+                try:
+                    return tiktoken.encoding_for_model(model_identifier)
+                except KeyError:
+                    pass
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            # 编码文件无法下载等情况
+            logger.warning(f"加载模型 {model_identifier} 的分词器失败，使用近似估算: {str(e)}")
+    return HeuristicEncoder()
+
+
+def count_tokens(text, model_identifier=None):
+    """估算文本的令牌数"""
+    if not text:
+        return 0
+    return len(get_encoder(model_identifier).encode(str(text)))
+
+
+def _message_text(message):
+    """取出消息的文本内容（多模态消息只计算其中的文本部分）"""
+    content = message.get('content') if isinstance(message, dict) else message
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+def estimate_request_tokens(data, model_identifier=None):
+    """
+    估算请求体中提示词的令牌数
+
+    支持对话接口的 messages（以及百度的 system）、补全接口的 prompt 和嵌入接口的 input。
+    """
+    if not isinstance(data, dict):
+        return 0
+    total = 0
+    messages = data.get('messages')
+    if isinstance(messages, list):
+        total += sum(MESSAGE_OVERHEAD + count_tokens(_message_text(m), model_identifier) for m in messages)
+        total += REPLY_OVERHEAD
+    for key in ('system', 'prompt', 'input'):
+        value = data.get(key)
+        if isinstance(value, list):
+            total += sum(count_tokens(item, model_identifier) for item in value if isinstance(item, str))
+        elif isinstance(value, str):
+            total += count_tokens(value, model_identifier)
+    return total
+
+
+def requested_completion_tokens(data):
+    """请求中声明的最大生成令牌数，未声明时为0"""
+    if not isinstance(data, dict):
+        return 0
+    value = data.get('max_tokens') or data.get('max_output_tokens') or 0
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def truncate_request(data, limit, model_identifier=None):
+    """
+    把请求的提示词截断到 limit 个令牌以内
+
+    对话请求先丢弃最早的非system消息（至少保留最后一条），仍然超出时截断最后一条消息
+    的尾部；prompt 为字符串时截断其尾部。
+
+    Returns:
+        截断后的请求体副本，无法截断到限制以内时返回None
+    """
+    data = dict(data)
+    encoder = get_encoder(model_identifier)
+
+    messages = data.get('messages')
+    if isinstance(messages, list) and messages:
+        messages = list(messages)
+        data['messages'] = messages
+        while estimate_request_tokens(data, model_identifier) > limit:
+            droppable = [i for i, m in enumerate(messages[:-1])
+                         if not (isinstance(m, dict) and m.get('role') == 'system')]
+            if not droppable:
+                break
+            messages.pop(droppable[0])
+
+        excess = estimate_request_tokens(data, model_identifier) - limit
+        if excess > 0:
+            last = messages[-1]
+            if not isinstance(last, dict) or not isinstance(last.get('content'), str):
+                return None
+            tokens = encoder.encode(last['content'])
+            if excess >= len(tokens):
+                return None
+            messages[-1] = dict(last, content=encoder.decode(tokens[:len(tokens) - excess]))
+    elif isinstance(data.get('prompt'), str):
+        excess = estimate_request_tokens(data, model_identifier) - limit
+        if excess > 0:
+            tokens = encoder.encode(data['prompt'])
+            if excess >= len(tokens):
+                return None
+            data['prompt'] = encoder.decode(tokens[:len(tokens) - excess])
+
+    return data if estimate_request_tokens(data, model_identifier) <= limit else None
+
+
+class TokenBudget:
+    """按连接和自然日累计令牌用量的缓存计数器"""
+
+    def __init__(self, cache_backend=None):
+        self.cache = cache_backend or cache
+
+    @staticmethod
+    def _key(connection, day=None):
+        day = day or timezone.localdate()
+        return f'api_token_budget_{connection.id}_{day:%Y%m%d}'
+
+    def _incr(self, key, delta):
+        """原子地累加计数器，计数器不存在时先创建（保留到第二天结束）"""
+        if not delta:
+            return self.cache.get(key, 0)
+        self.cache.add(key, 0, int(timedelta(days=2).total_seconds()))
+        try:
+            if delta > 0:
+                return self.cache.incr(key, delta)
+            return self.cache.decr(key, -delta)
+        except ValueError:
+            # 在add和incr之间过期，重新创建
+            self.cache.add(key, 0, int(timedelta(days=2).total_seconds()))
+            return self.cache.incr(key, delta) if delta > 0 else 0
+
+    def reserve(self, connection, tokens):
+        """
+        预留令牌
+
+        Returns:
+            (是否成功, 预留后当日已用量, Reservation)；连接未设置预算，或缓存不可用时总是成功，
+            不产生预留（Reservation为None）
+        """
+        budget = getattr(connection, 'daily_token_budget', 0) or 0
+        if budget <= 0:
+            return True, None, None
+        day = timezone.localdate()
+        key = self._key(connection, day)
+        try:
+            used = self._incr(key, tokens)
+            if used > budget:
+                self._incr(key, -tokens)
+                return False, used - tokens, None
+        except Exception as e:
+            # 缓存故障时不阻止调用
+            logger.warning(f"预留API连接 {connection.name} 的令牌预算时出错，本次调用不检查预算: {str(e)}")
+            return True, None, None
+        return True, used, Reservation(tokens, day)
+
+    def settle(self, connection, reservation, actual):
+        """按实际用量修正预留的令牌数，跨过零点的调用仍修正预留当天的用量"""
+        if reservation is None:
+            return
+        try:
+            self._incr(self._key(connection, reservation.day), actual - reservation.tokens)
+        except Exception as e:
+            logger.warning(f"修正API连接 {connection.name} 的令牌用量时出错: {str(e)}")
+
+    def used(self, connection, day=None):
+        """当日已用（含已预留）的令牌数"""
+        return self.cache.get(self._key(connection, day), 0)
+
+
+# 进程级的全局令牌预算
+token_budget = TokenBudget()
+
+
+def limit_mode(mode=None):
+    """超出模型上下文限制时的处理方式：reject 或 truncate"""
+    return mode or getattr(settings, 'API_CONNECTOR_TOKEN_LIMIT_MODE', 'reject')
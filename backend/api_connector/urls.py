@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import APIProviderViewSet, APIConnectionViewSet, APIUsageLogViewSet, APIModelViewSet
+from .async_views import gather_view, stream_view
 
 # 创建路由器
 router = DefaultRouter()
@@ -11,5 +12,8 @@ router.register(r'models', APIModelViewSet)
 
 # URL配置
 urlpatterns = [
+    # 异步接口（需通过ASGI部署）
+    path('async/gather/', gather_view, name='api-connector-gather'),
+    path('async/stream/', stream_view, name='api-connector-stream'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -0,0 +1,179 @@
+"""
+API使用日志的异步批量写入
+
+APIConnector 在每次调用后只把日志对象放入进程内队列，由后台线程按数量或时间阈值
+使用 bulk_create 批量写入数据库，避免在每次API调用的关键路径上执行一次数据库写入；
+同一批日志在同一事务中累加到统计汇总表（见 rollups）。
+队列写满时调用方会短暂等待，仍然写不进去则退化为同步写入（背压）；
+进程退出时会把队列中剩余的日志全部写入。
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class UsageLogWriter:
+    """进程内的API使用日志批量写入器"""
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue_size=None, put_timeout=None):
+        """
+        初始化写入器
+
+        Args:
+            batch_size: 单次 bulk_create 的最大条数，默认读取 API_USAGE_LOG_BATCH_SIZE
+            flush_interval: 最长多少秒写入一次，默认读取 API_USAGE_LOG_FLUSH_INTERVAL
+            max_queue_size: 队列容量，默认读取 API_USAGE_LOG_QUEUE_SIZE
+            put_timeout: 队列已满时最多等待多少秒，默认读取 API_USAGE_LOG_PUT_TIMEOUT
+        """
+        self.batch_size = batch_size or getattr(settings, 'API_USAGE_LOG_BATCH_SIZE', 200)
+        self.flush_interval = flush_interval or getattr(settings, 'API_USAGE_LOG_FLUSH_INTERVAL', 1.0)
+        self.max_queue_size = max_queue_size or getattr(settings, 'API_USAGE_LOG_QUEUE_SIZE', 10000)
+        if put_timeout is None:
+            put_timeout = getattr(settings, 'API_USAGE_LOG_PUT_TIMEOUT', 0.05)
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.overflow_count = 0
+
+    def _ensure_started(self):
+        """按需启动后台线程；fork出的子进程需要重新创建队列和线程"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != pid:
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+                self._stop = threading.Event()
+                self._pid = pid
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='api-usage-log-writer', daemon=True
+                )
+                self._thread.start()
+
+    def write(self, log):
+        """
+        提交一条未保存的 APIUsageLog
+
+        队列已满且等待 put_timeout 后仍无空间时，直接同步写入数据库。
+        """
+        if self._stop.is_set() and self._pid == os.getpid():
+            # 已经关闭（进程退出阶段），直接同步写入
+            self.save_batch([log])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put(log, timeout=self.put_timeout)
+        except queue.Full:
+            self.overflow_count += 1
+            logger.warning(f"API使用日志队列已满({self.max_queue_size})，改为同步写入")
+            self.save_batch([log])
+
+    def _drain(self, limit):
+        """从队列中取出最多 limit 条日志，不阻塞"""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """后台线程：积累到 batch_size 条或等待超过 flush_interval 后写入"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+                batch.extend(self._drain(self.batch_size - len(batch)))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    # 后台线程长期持有数据库连接，写入前后按CONN_MAX_AGE回收
+                    close_old_connections()
+                    self.save_batch(batch)
+                    close_old_connections()
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+        if batch:
+            self.save_batch(batch)
+
+    def save_batch(self, batch):
+        """批量写入一批日志，并在同一事务中累加到统计汇总表"""
+        from .models import APIUsageLog
+        from .rollups import apply_logs
+
+        with self._flush_lock:
+            try:
+                with transaction.atomic():
+                    APIUsageLog.objects.bulk_create(batch, batch_size=self.batch_size)
+                    apply_logs(batch)
+            except Exception as e:
+                # 一条坏数据会让整批失败，逐条写入以保住其余日志
+                logger.exception(f"批量写入{len(batch)}条API使用日志时出错，改为逐条写入: {str(e)}")
+                self._save_each(batch)
+
+    def _save_each(self, batch):
+        """逐条写入日志，每条日志与它的汇总更新在同一事务中"""
+        from .rollups import apply_logs
+
+        for log in batch:
+            try:
+                with transaction.atomic():
+                    log.save(force_insert=True)
+                    apply_logs([log])
+            except Exception as e:
+                logger.error(f"写入API使用日志{log.id}失败，已丢弃: {str(e)}")
+
+    def flush(self):
+        """立即把队列中的日志全部写入数据库"""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self.save_batch(batch)
+
+    def shutdown(self, timeout=5):
+        """停止后台线程并写入剩余日志"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self.flush()
+
+
+# 进程级的全局写入器
+usage_log_writer = UsageLogWriter()
+
+# gunicorn/uWSGI等正常退出时写入剩余日志
+atexit.register(usage_log_writer.shutdown)
+
+
+# Celery的prefork子进程通过os._exit退出，不会执行atexit
+@worker_process_shutdown.connect
+def _flush_on_worker_process_shutdown(**kwargs):
+    usage_log_writer.shutdown()
+
+
+@worker_shutdown.connect
+def _flush_on_worker_shutdown(**kwargs):
+    usage_log_writer.shutdown()
@@ -3,11 +3,136 @@ import json
 import logging
 import requests
 from django.conf import settings
-from django.core.cache import cache
-from .models import APIConnection, APIUsageLog
+from django.db import close_old_connections
+from .models import APIUsageLog
+from .session_pool import get_session
+from .registry import connection_registry
+from .rate_limit import rate_limiter, RateLimitExceeded
+from .usage_logger import usage_log_writer
+from .response_cache import response_cache, request_cache_key
+from .coalesce import request_coalescer
+from .retry import RetryPolicy, latency_tracker, hedge_connection, race_hedged
+from .metrics import latency_metrics
+from .embeddings import embed_texts
+from .tokens import (
+    estimate_request_tokens, requested_completion_tokens, truncate_request, token_budget, limit_mode
+)
+from .adapters import (
+    build_adapter,
+    OPENAI_CHAT_ENDPOINT, BAIDU_CHAT_ENDPOINT,
+    build_openai_chat_request, build_baidu_chat_request,
+    parse_openai_chat_response, parse_baidu_chat_response,
+    parse_openai_stream_chunk, parse_baidu_stream_chunk,
+)
 
 logger = logging.getLogger(__name__)
 
+SSE_DONE = "[DONE]"  # OpenAI流式响应的结束标记
+
+
+def parse_sse_line(line):
+    """
+    解析一行SSE数据
+
+    Returns:
+        data字段解析出的字典；遇到结束标记时返回 SSE_DONE；空行、注释和其他字段返回None
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    line = line.strip()
+    if not line or line.startswith(':'):
+        return None
+    if line.startswith('data:'):
+        payload = line[5:].strip()
+        if payload == SSE_DONE:
+            return SSE_DONE
+        return json.loads(payload)
+    if line.startswith('{'):
+        # 部分提供商（如百度）在出错时直接返回JSON而不是SSE事件
+        return json.loads(line)
+    return None
+
+
+def format_sse_event(payload):
+    """把数据编码为一条SSE事件"""
+    if payload == SSE_DONE:
+        return f"data: {SSE_DONE}\n\n"
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class StreamStats:
+    """流式调用过程中的统计：首个数据块延迟、数据块数量和最后一次上报的令牌使用量"""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.first_chunk_time = None
+        self.chunks = 0
+        self.usage = None
+        self.status = 'failed'
+        self.error_message = None
+
+    def add_chunk(self, chunk):
+        """
+        记录一个数据块
+
+        Returns:
+            数据块为上游在流中返回的错误时，返回统一格式的错误字典，否则返回None
+        """
+        if self.first_chunk_time is None:
+            self.first_chunk_time = time.time()
+        self.chunks += 1
+        if chunk.get('error_code') or isinstance(chunk.get('error'), dict):
+            error = chunk.get('error') or {}
+            self.status = 'error'
+            self.error_message = chunk.get('error_msg') or error.get('message') or '未知错误'
+            return {'error': True, 'message': self.error_message, 'details': chunk}
+        # OpenAI在最后一个数据块中返回usage，百度每个数据块都携带截至当前的usage
+        if chunk.get('usage'):
+            self.usage = chunk['usage']
+        return None
+
+    def fail(self, error_message, status='failed'):
+        """记录调用失败，返回统一格式的错误字典"""
+        self.status = status
+        self.error_message = error_message
+        return {'error': True, 'message': error_message}
+
+    @property
+    def tokens_used(self):
+        return (self.usage or {}).get('total_tokens', 0) or 0
+
+    def settled_tokens(self, reserved):
+        """修正每日令牌预算时的实际用量：有usage时取usage，收到过数据块时保留预留值，否则为0"""
+        if self.tokens_used:
+            return self.tokens_used
+        return reserved if self.chunks else 0
+
+    @property
+    def response_time(self):
+        """整个流式响应的耗时(ms)"""
+        return (time.time() - self.start_time) * 1000
+
+    @property
+    def time_to_first_chunk(self):
+        """首个数据块的延迟(ms)，用户实际感受到的等待时间"""
+        if self.first_chunk_time is None:
+            return None
+        return (self.first_chunk_time - self.start_time) * 1000
+
+    def response_data(self):
+        """记录到使用日志中的响应摘要（不保存完整内容）"""
+        data = {
+            'stream': True,
+            'chunks': self.chunks,
+            'time_to_first_chunk': self.time_to_first_chunk,
+            'usage': self.usage,
+        }
+        if self.error_message:
+            data['error'] = True
+            data['message'] = self.error_message
+        return data
+
+
 class APIConnector:
     """API连接器工具类，用于处理与外部API的交互"""
     
@@ -21,65 +146,46 @@ class APIConnector:
         """
         self.connection = None
         
+        # 连接从进程内缓存中解析，稳定状态下不访问数据库
         if connection_id:
             # 获取指定的连接
-            try:
-                self.connection = APIConnection.objects.get(id=connection_id, is_active=True)
-            except APIConnection.DoesNotExist:
+            resolved = connection_registry.get_by_id(connection_id)
+            if resolved is None:
                 raise ValueError(f"无法找到ID为{connection_id}的API连接")
         elif provider_type:
-            # 获取指定提供商类型的默认连接
+            # 获取指定提供商类型的默认连接，没有默认连接时使用第一个活跃连接
             try:
-                self.connection = APIConnection.objects.filter(
-                    provider__provider_type=provider_type,
-                    is_active=True,
-                    is_default=True
-                ).first()
-                
-                if not self.connection:
-                    # 如果没有默认连接，使用第一个活跃连接
-                    self.connection = APIConnection.objects.filter(
-                        provider__provider_type=provider_type,
-                        is_active=True
-                    ).first()
-                    
-                if not self.connection:
+                resolved = connection_registry.get_default(provider_type)
+                if resolved is None:
                     raise ValueError(f"无法找到类型为{provider_type}的活跃API连接")
             except Exception as e:
                 raise ValueError(f"获取API连接失败: {str(e)}")
         else:
             raise ValueError("必须提供connection_id或provider_type参数")
+        
+        self.connection = resolved.connection
+        self.adapter = resolved.adapter
+    
+    @classmethod
+    def from_connection(cls, connection):
+        """使用已加载的API连接对象创建连接器，不再查询数据库"""
+        connector = cls.__new__(cls)
+        connector.connection = connection
+        connector.adapter = build_adapter(connection)
+        return connector
+    
+    @classmethod
+    def from_resolved(cls, resolved):
+        """使用连接缓存中已解析的连接创建连接器，复用它的适配器"""
+        connector = cls.__new__(cls)
+        connector.connection = resolved.connection
+        connector.adapter = resolved.adapter
+        return connector
     
     def _prepare_headers(self, additional_headers=None):
         """准备请求头"""
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        
-        # 添加认证信息
-        if self.connection.provider.provider_type == 'openai':
-            headers['Authorization'] = f"Bearer {self.connection.api_key}"
-            if self.connection.org_id:
-                headers['OpenAI-Organization'] = self.connection.org_id
-        elif self.connection.provider.provider_type == 'google':
-            headers['Authorization'] = f"Bearer {self.connection.api_key}"
-        elif self.connection.provider.provider_type == 'baidu':
-            # 百度API使用不同的认证方式，在请求参数中处理
-            pass
-        elif self.connection.provider.provider_type == 'azure':
-            headers['api-key'] = self.connection.api_key
-        elif self.connection.provider.provider_type == 'anthropic':
-            headers['x-api-key'] = self.connection.api_key
-        elif self.connection.provider.provider_type == 'huggingface':
-            headers['Authorization'] = f"Bearer {self.connection.api_key}"
-        else:
-            # 自定义API，使用存储的自定义头
-            if self.connection.custom_headers:
-                try:
-                    for key, value in self.connection.custom_headers.items():
-                        headers[key] = value
-                except Exception as e:
-                    logger.error(f"解析自定义请求头时出错: {str(e)}")
+        # 认证信息在解析连接时已由适配器计算好
+        headers = dict(self.adapter.headers)
         
         # 添加额外请求头
         if additional_headers:
@@ -114,10 +220,11 @@ class APIConnector:
             }
     
     def _log_usage(self, endpoint, request_data, response_data, status, 
-                   error_message=None, tokens_used=0, response_time=0, user_ip=None):
-        """记录API使用日志"""
+                   error_message=None, tokens_used=0, response_time=0, user_ip=None,
+                   cache_hit=False, attempt=1, estimated_tokens=None):
+        """记录API使用日志（默认交给后台线程批量写入）"""
         try:
-            APIUsageLog.objects.create(
+            log = APIUsageLog(
                 connection=self.connection,
                 endpoint=endpoint,
                 request_data=request_data,
@@ -126,13 +233,181 @@ class APIConnector:
                 error_message=error_message,
                 tokens_used=tokens_used,
                 response_time=response_time,
-                user_ip=user_ip
+                user_ip=user_ip,
+                cache_hit=cache_hit,
+                attempt=attempt,
+                estimated_tokens=estimated_tokens
             )
+            if getattr(settings, 'API_USAGE_LOG_ASYNC', True):
+                usage_log_writer.write(log)
+            else:
+                usage_log_writer.save_batch([log])
         except Exception as e:
             logger.exception(f"记录API使用日志时出错: {str(e)}")
     
+    def _record_latency(self, endpoint, status, response_time):
+        """记录一次上游请求的延迟：写入延迟直方图，成功请求同时用于计算对冲等待时间"""
+        latency_metrics.observe(self.connection.id, endpoint, status, response_time)
+        if status == 'success':
+            latency_tracker.record(self.connection.id, response_time)
+    
+    def _prepare_request(self, endpoint, params=None, additional_headers=None):
+        """构建请求URL、请求头和URL参数（不含动态认证参数，如百度access_token）"""
+        # 构建完整URL
+        url = self.adapter.url(endpoint)
+        
+        # 准备请求头
+        headers = self._prepare_headers(additional_headers)
+        
+        # 准备请求参数
+        request_params = {}
+        if params:
+            request_params.update(params)
+        
+        # 添加连接的固定参数（自定义参数等）
+        request_params.update(self.adapter.params)
+        
+        return url, headers, request_params
+    
+    def _parse_result(self, response_data):
+        """根据响应数据判断调用状态，返回 (状态, 错误信息, 令牌使用量)"""
+        # 计算令牌使用量（仅用于OpenAI等提供这些信息的API）
+        if isinstance(response_data, dict):
+            if 'error' in response_data and response_data['error']:
+                return 'error', response_data.get('message', '未知错误'), 0
+            # 由适配器把各提供商的usage（如Anthropic的input_tokens/output_tokens）转换为统一格式
+            usage = self.adapter._usage(response_data.get('usage')) or {}
+            return 'success', None, usage.get('total_tokens', 0) or 0
+        return 'failed', None, 0
+    
+    def _rate_limited_response(self, exc, endpoint, request_data, user_ip=None, log_usage=True):
+        """构建被本地限流拒绝时的响应，并记录为rate_limited"""
+        response_data = {
+            'error': True,
+            'status_code': 429,
+            'rate_limited': True,
+            'retry_after': round(exc.retry_after, 3),
+            'message': str(exc)
+        }
+        if log_usage:
+            self._log_usage(
+                endpoint=endpoint,
+                request_data=request_data,
+                response_data=response_data,
+                status='rate_limited',
+                error_message=str(exc),
+                response_time=0,
+                user_ip=user_ip
+            )
+        return response_data
+    
+    def _cached_response(self, cache_key, endpoint, data, user_ip=None, log_usage=True):
+        """
+        查找缓存的响应，命中时记录一条零延迟、零令牌的使用日志
+        
+        Returns:
+            缓存的响应数据，未命中时返回None
+        """
+        response_data = response_cache.get(self.connection.id, cache_key)
+        if response_data is not None and log_usage:
+            self._log_usage(
+                endpoint=endpoint,
+                request_data=data,
+                response_data=response_data,
+                status='success',
+                tokens_used=0,
+                response_time=0,
+                user_ip=user_ip,
+                cache_hit=True
+            )
+        return response_data
+    
+    def _check_tokens(self, endpoint, data, user_ip=None, log_usage=True, token_limit_mode=None):
+        """
+        发送前估算提示词令牌数，检查模型上下文限制并预留连接的每日令牌预算
+        
+        Returns:
+            (请求体（可能已截断）, 估算的提示词令牌数, 预留（tokens.Reservation或None）, 被拒绝时的响应或None)
+        """
+        if not isinstance(data, dict):
+            return data, None, None, None
+        
+        model_identifier = data.get('model')
+        api_model = connection_registry.get_model(self.connection.provider_id, model_identifier)
+        encoder_model = model_identifier or (api_model.model_identifier if api_model else None)
+        estimated_tokens = estimate_request_tokens(data, encoder_model)
+        completion_tokens = requested_completion_tokens(data)
+        
+        if api_model and api_model.max_tokens and estimated_tokens + completion_tokens > api_model.max_tokens:
+            limit = api_model.max_tokens - completion_tokens
+            truncated = None
+            if limit_mode(token_limit_mode) == 'truncate' and limit > 0:
+                truncated = truncate_request(data, limit, encoder_model)
+            if truncated is None:
+                message = (
+                    f"请求的令牌数(提示词约{estimated_tokens} + 生成{completion_tokens})"
+                    f"超出模型 {api_model.model_identifier} 的上限{api_model.max_tokens}"
+                )
+                return data, estimated_tokens, None, self._token_rejected_response(
+                    message, endpoint, data, estimated_tokens, user_ip, log_usage, status_code=400
+                )
+            data = truncated
+            new_estimate = estimate_request_tokens(data, encoder_model)
+            logger.info(f"提示词约{estimated_tokens}个令牌，超出模型上限，已截断为约{new_estimate}个令牌")
+            estimated_tokens = new_estimate
+        
+        tokens = estimated_tokens + completion_tokens
+        allowed, used, reserved = token_budget.reserve(self.connection, tokens)
+        if not allowed:
+            message = (
+                f"API连接 {self.connection.name} 今日令牌用量({used})加上本次请求(约{tokens})"
+                f"超出每日预算{self.connection.daily_token_budget}"
+            )
+            return data, estimated_tokens, None, self._token_rejected_response(
+                message, endpoint, data, estimated_tokens, user_ip, log_usage,
+                status_code=429, budget_exceeded=True
+            )
+        return data, estimated_tokens, reserved, None
+    
+    def _token_rejected_response(self, message, endpoint, request_data, estimated_tokens,
+                                 user_ip=None, log_usage=True, status_code=400, budget_exceeded=False):
+        """构建因令牌限制在本地拒绝的响应；超出每日预算视为本地限流"""
+        response_data = {
+            'error': True,
+            'status_code': status_code,
+            'message': message,
+            'estimated_tokens': estimated_tokens,
+        }
+        if budget_exceeded:
+            response_data.update(rate_limited=True, budget_exceeded=True)
+        if log_usage:
+            self._log_usage(
+                endpoint=endpoint,
+                request_data=request_data,
+                response_data=response_data,
+                status='rate_limited' if budget_exceeded else 'error',
+                error_message=message,
+                response_time=0,
+                user_ip=user_ip,
+                estimated_tokens=estimated_tokens
+            )
+        return response_data
+    
+    def _settle_tokens(self, reserved, response_data):
+        """按实际用量修正预留的每日令牌预算：失败的调用不计用量，上游没有返回usage时保留估算值"""
+        if not reserved:
+            return
+        status, _, tokens_used = self._parse_result(response_data)
+        if status != 'success':
+            actual = 0
+        else:
+            actual = tokens_used or reserved.tokens
+        token_budget.settle(self.connection, reserved, actual)
+    
     def call_api(self, endpoint, method='POST', data=None, params=None, 
-                additional_headers=None, user_ip=None, log_usage=True):
+                additional_headers=None, user_ip=None, log_usage=True,
+                rate_limit_mode=None, use_cache=False, cache_timeout=None,
+                coalesce=False, coalesce_timeout=None, token_limit_mode=None):
         """
         调用API接口
         
@@ -144,36 +419,144 @@ class APIConnector:
             additional_headers: 额外的请求头
             user_ip: 用户IP，用于日志记录
             log_usage: 是否记录使用日志
+            rate_limit_mode: 超出连接速率限制时的行为，'reject' 立即拒绝，'wait' 等待令牌，
+                             默认读取 API_CONNECTOR_RATE_LIMIT_MODE
+            use_cache: 是否使用响应缓存，只应用于结果确定的请求（如temperature=0）
+            cache_timeout: 响应缓存的过期时间(秒)，默认读取 API_RESPONSE_CACHE_TIMEOUT
+            coalesce: 是否合并进行中的相同请求，相同请求正在进行时等待它的结果而不再请求上游
+            coalesce_timeout: 等待相同请求结果的超时(秒)，默认读取 API_CONNECTOR_COALESCE_TIMEOUT
+            token_limit_mode: 提示词超出模型上下文限制时的行为，'reject' 拒绝，'truncate' 截断，
+                              默认读取 API_CONNECTOR_TOKEN_LIMIT_MODE
+            
+        发送前估算令牌数并检查模型上下文限制和连接的每日令牌预算，见 tokens 模块。
+        失败时的重试、退避、超时和对冲按提供商的 retry_policy 执行，见 retry 模块。
             
         Returns:
             API响应数据
         """
-        # 构建完整URL
-        url = f"{self.connection.provider.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
+        url, headers, request_params = self._prepare_request(endpoint, params, additional_headers)
         
-        # 准备请求头
-        headers = self._prepare_headers(additional_headers)
+        # 相同请求命中缓存时直接返回，不占用速率限制也不产生费用
+        cache_key = None
+        if use_cache:
+            cache_key = request_cache_key(self.connection.id, method, endpoint, data, request_params)
+            cached = self._cached_response(cache_key, endpoint, data, user_ip, log_usage)
+            if cached is not None:
+                return cached
         
-        # 准备请求参数
-        request_params = {}
-        if params:
-            request_params.update(params)
-        
-        # 添加自定义参数
-        if self.connection.custom_params:
+        def send():
+            request_data, estimated_tokens, reserved, rejected = self._check_tokens(
+                endpoint, data, user_ip, log_usage, token_limit_mode
+            )
+            if rejected is not None:
+                return rejected
+            response_data = None
             try:
-                request_params.update(self.connection.custom_params)
-            except Exception as e:
-                logger.error(f"解析自定义参数时出错: {str(e)}")
-        
-        # 百度API特殊处理：需要获取access_token
-        if self.connection.provider.provider_type == 'baidu':
-            token = cache.get(f'baidu_access_token_{self.connection.id}')
-            if not token:
-                token = self._get_baidu_access_token()
-                cache.set(f'baidu_access_token_{self.connection.id}', token, 60 * 60 * 23)  # 23小时过期
+                response_data = self._send_with_retry(
+                    endpoint, method, request_data, params, additional_headers, url, headers,
+                    request_params, user_ip, log_usage, rate_limit_mode, cache_key, cache_timeout,
+                    estimated_tokens=estimated_tokens
+                )
+                return response_data
+            finally:
+                self._settle_tokens(reserved, response_data)
+        
+        if coalesce:
+            key = cache_key or request_cache_key(self.connection.id, method, endpoint, data, request_params)
+            return request_coalescer.run(key, send, wait_timeout=coalesce_timeout)
+        return send()
+    
+    def _send_with_retry(self, endpoint, method, data, params, additional_headers, url, headers,
+                         request_params, user_ip=None, log_usage=True, rate_limit_mode=None,
+                         cache_key=None, cache_timeout=None, estimated_tokens=None):
+        """按提供商的重试策略发送请求，每个请求都记录一条带序号的使用日志"""
+        policy = RetryPolicy.for_provider(self.connection.provider)
+        deadline = time.monotonic() + policy.deadline
+        attempt = 1
+        
+        while True:
+            timeout = min(policy.timeout, max(deadline - time.monotonic(), 0.001))
+            hedge_delay = policy.hedge_delay_for(self.connection) if attempt < policy.max_attempts else None
+            if hedge_delay is not None and hedge_delay < timeout:
+                response_data, sent = self._send_hedged(
+                    endpoint, method, data, params, additional_headers, user_ip, log_usage,
+                    rate_limit_mode, attempt, timeout, hedge_delay, policy, estimated_tokens
+                )
+                if cache_key and not (isinstance(response_data, dict) and response_data.get('error')):
+                    response_cache.set(cache_key, response_data, cache_timeout)
+            else:
+                response_data = self._send_request(
+                    endpoint, method, data, url, headers, dict(request_params),
+                    user_ip, log_usage, rate_limit_mode, cache_key, cache_timeout,
+                    attempt=attempt, timeout=timeout, estimated_tokens=estimated_tokens
+                )
+                sent = 1
             
-            request_params['access_token'] = token
+            attempt += sent
+            if attempt > policy.max_attempts or not policy.should_retry(response_data):
+                return response_data
+            
+            wait = policy.backoff(attempt - 1)
+            if time.monotonic() + wait >= deadline:
+                logger.warning(f"API连接 {self.connection.name} 调用失败且已接近总时限，不再重试")
+                return response_data
+            logger.warning(
+                f"API连接 {self.connection.name} 调用失败({response_data.get('message', '未知错误')})，"
+                f"{wait:.2f}秒后进行第{attempt}次请求"
+            )
+            time.sleep(wait)
+    
+    def _send_hedged(self, endpoint, method, data, params, additional_headers, user_ip, log_usage,
+                     rate_limit_mode, attempt, timeout, hedge_delay, policy, estimated_tokens=None):
+        """
+        发送一个可对冲的请求：超过 hedge_delay 秒仍未返回时向另一个连接再发一个请求。
+        主请求在当前线程中发送，对冲请求在共享线程池中发送；两个请求都由 _send_request
+        通过各自连接的会话池发送，分别记录使用日志和延迟。
+        
+        Returns:
+            (响应数据, 实际发出的请求数)
+        """
+        primary = self
+        resolved = hedge_connection(self.connection)
+        secondary = type(self).from_resolved(resolved) if resolved is not None else self
+        
+        def call(connector, number, mode):
+            url, headers, request_params = connector._prepare_request(endpoint, params, additional_headers)
+            return connector._send_request(
+                endpoint, method, data, url, headers, request_params,
+                user_ip, log_usage, mode, attempt=number, timeout=timeout,
+                estimated_tokens=estimated_tokens
+            )
+        
+        def hedge():
+            try:
+                # 对冲请求不等待限流令牌，被限流时只等待主请求
+                return call(secondary, attempt + 1, 'reject')
+            finally:
+                # 在线程池线程中执行，用完后关闭本线程的数据库连接
+                close_old_connections()
+        
+        return race_hedged(
+            lambda: call(primary, attempt, rate_limit_mode),
+            hedge,
+            hedge_delay,
+            lambda result: policy.should_retry(result) or bool(result.get('rate_limited'))
+        )
+    
+    def _send_request(self, endpoint, method, data, url, headers, request_params,
+                      user_ip=None, log_usage=True, rate_limit_mode=None,
+                      cache_key=None, cache_timeout=None, attempt=1, timeout=None,
+                      estimated_tokens=None):
+        """检查速率限制后发送请求、处理响应并记录使用日志"""
+        # 检查速率限制，超限时在本地拒绝，避免浪费一次上游往返
+        try:
+            rate_limiter.acquire(self.connection, mode=rate_limit_mode)
+        except RateLimitExceeded as e:
+            return self._rate_limited_response(e, endpoint, data, user_ip, log_usage)
+        
+        # 需要动态认证参数的提供商（如百度access_token）
+        if self.adapter.dynamic_auth:
+            request_params.update(self.adapter.auth_params())
         
         # 记录开始时间
         start_time = time.time()
@@ -181,32 +564,27 @@ class APIConnector:
         error_message = None
         tokens_used = 0
         response_data = None
+        timeout = timeout or getattr(settings, 'API_CONNECTOR_REQUEST_TIMEOUT', 60)
         
         try:
-            # 发送请求
+            # 发送请求（复用该连接的会话，避免每次重新建立TCP/TLS连接）
+            session = get_session(self.connection)
             if method.upper() == 'GET':
-                response = requests.get(url, headers=headers, params=request_params, timeout=60)
+                response = session.get(url, headers=headers, params=request_params, timeout=timeout)
             elif method.upper() == 'POST':
                 json_data = json.dumps(data) if data else None
-                response = requests.post(url, headers=headers, params=request_params, 
-                                        data=json_data, timeout=60)
+                response = session.post(url, headers=headers, params=request_params, 
+                                        data=json_data, timeout=timeout)
             else:
-                response = requests.request(method, url, headers=headers, params=request_params, 
-                                          json=data, timeout=60)
+                response = session.request(method, url, headers=headers, params=request_params, 
+                                           json=data, timeout=timeout)
             
             # 处理响应
             response_data = self._handle_response(response, endpoint)
-            
-            # 计算令牌使用量（仅用于OpenAI等提供这些信息的API）
-            if isinstance(response_data, dict):
-                if 'error' in response_data and response_data['error']:
-                    status = 'error'
-                    error_message = response_data.get('message', '未知错误')
-                else:
-                    status = 'success'
-                    # 尝试获取令牌使用量
-                    usage = response_data.get('usage', {})
-                    tokens_used = usage.get('total_tokens', 0) or 0
+            status, error_message, tokens_used = self._parse_result(response_data)
+            self._check_auth_error(response_data)
+            if cache_key and status == 'success':
+                response_cache.set(cache_key, response_data, cache_timeout)
         except requests.exceptions.Timeout:
             status = 'failed'
             error_message = "API请求超时"
@@ -222,6 +600,7 @@ class APIConnector:
         finally:
             # 计算响应时间
             response_time = (time.time() - start_time) * 1000  # 转换为毫秒
+            self._record_latency(endpoint, status, response_time)
             
             # 记录使用日志
             if log_usage:
@@ -233,63 +612,203 @@ class APIConnector:
                     error_message=error_message,
                     tokens_used=tokens_used,
                     response_time=response_time,
-                    user_ip=user_ip
+                    user_ip=user_ip,
+                    attempt=attempt,
+                    estimated_tokens=estimated_tokens
                 )
             
             return response_data
     
-    def _get_baidu_access_token(self):
-        """获取百度API的access_token"""
-        api_key = self.connection.api_key
-        secret_key = self.connection.api_secret
-        
-        url = "https://aip.baidubce.com/oauth/2.0/token"
-        params = {
-            'grant_type': 'client_credentials',
-            'client_id': api_key,
-            'client_secret': secret_key
-        }
+    def embed(self, texts, model=None, concurrency=None, use_cache=True, user_ip=None):
+        """
+        把文本批量转换为嵌入向量
+        
+        输入按提供商单次请求的条数上限和嵌入模型的令牌上限装箱，各批次并发发送；
+        未变化的文本直接从磁盘上的嵌入缓存读取。详见 embeddings.embed_texts。
+        
+        Args:
+            texts: 文本列表
+            model: 嵌入模型标识符，未指定时使用提供商默认的嵌入模型
+            concurrency: 同时发送的批次数（可选）
+            use_cache: 是否使用嵌入缓存
+            user_ip: 用户IP，用于日志记录
+            
+        Returns:
+            形状为 (len(texts), 维度) 的float32 NumPy矩阵，行顺序与输入一致
+        """
+        return embed_texts(self, texts, model=model, concurrency=concurrency,
+                           use_cache=use_cache, user_ip=user_ip)
+    
+    def stream_api(self, endpoint, data=None, params=None, additional_headers=None,
+                   user_ip=None, log_usage=True, rate_limit_mode=None, token_limit_mode=None):
+        """
+        以流式(SSE)方式调用API接口，逐个产出上游推送的数据块
         
+        参数与 call_api 相同（只支持POST）。请求体中未指定 stream 时自动设为True。
+        生成器结束（包括调用方提前关闭）时记录一次使用日志，令牌使用量取自
+        上游最后上报的usage，响应数据中记录首个数据块的延迟。
+        
+        Yields:
+            每个SSE事件解析后的字典；调用失败时产出一个带 error 的字典后结束
+        """
+        # 检查令牌限制和每日预算
+        data, estimated_tokens, reserved, rejected = self._check_tokens(
+            endpoint, dict(data or {}), user_ip, log_usage, token_limit_mode
+        )
+        if rejected is not None:
+            yield rejected
+            return
+        
+        # 检查速率限制
         try:
-            response = requests.post(url, params=params)
-            result = response.json()
-            return result.get('access_token')
+            rate_limiter.acquire(self.connection, mode=rate_limit_mode)
+        except RateLimitExceeded as e:
+            self._settle_tokens(reserved, None)
+            yield self._rate_limited_response(e, endpoint, data, user_ip, log_usage)
+            return
+        
+        url, headers, request_params = self._prepare_request(endpoint, params, additional_headers)
+        headers['Accept'] = 'text/event-stream'
+        if self.adapter.dynamic_auth:
+            request_params.update(self.adapter.auth_params())
+        
+        request_data = dict(data or {})
+        request_data.setdefault('stream', True)
+        
+        # 与非流式调用使用相同的超时设置（流式时限制的是两个数据块之间的间隔）
+        timeout = RetryPolicy.for_provider(self.connection.provider).timeout
+        stats = StreamStats()
+        response = None
+        try:
+            response = get_session(self.connection).post(
+                url, headers=headers, params=request_params,
+                data=json.dumps(request_data), timeout=timeout, stream=True
+            )
+            if not 200 <= response.status_code < 300:
+                error = self._handle_response(response, endpoint)
+                yield stats.fail(error.get('message', '未知错误'), 'error')
+                return
+            
+            for line in response.iter_lines():
+                chunk = parse_sse_line(line)
+                if chunk is None:
+                    continue
+                if chunk == SSE_DONE:
+                    break
+                error = stats.add_chunk(chunk)
+                if error:
+                    yield error
+                    return
+                yield chunk
+            stats.status = 'success'
+        except GeneratorExit:
+            # 调用方（通常是断开的客户端）提前关闭了生成器
+            stats.fail('客户端在流式响应结束前断开连接')
+            raise
+        except requests.exceptions.Timeout:
+            yield stats.fail("API请求超时")
+        except requests.exceptions.RequestException as e:
+            yield stats.fail(f"API请求异常: {str(e)}")
         except Exception as e:
-            logger.exception(f"获取百度API access_token时出错: {str(e)}")
-            return None
+            yield stats.fail(f"API调用过程中发生错误: {str(e)}", 'error')
+        finally:
+            if response is not None:
+                response.close()
+            latency_metrics.observe(self.connection.id, endpoint, stats.status, stats.response_time)
+            if reserved:
+                token_budget.settle(self.connection, reserved, stats.settled_tokens(reserved.tokens))
+            if log_usage:
+                self._log_usage(
+                    endpoint=endpoint,
+                    request_data=request_data,
+                    response_data=stats.response_data(),
+                    status=stats.status,
+                    error_message=stats.error_message,
+                    tokens_used=stats.tokens_used,
+                    response_time=stats.response_time,
+                    user_ip=user_ip,
+                    estimated_tokens=estimated_tokens
+                )
+    
+    def _check_auth_error(self, response_data):
+        """上游报告动态认证信息无效（如百度access_token失效）时丢弃缓存，下一次调用重新获取"""
+        if self.adapter.dynamic_auth and self.adapter.is_auth_error(response_data):
+            self.adapter.invalidate_auth()
 
 
 # 使用示例函数
-def call_openai_api(prompt, model="gpt-3.5-turbo", connection_id=None, user_ip=None):
-    """调用OpenAI API的示例函数"""
+def call_chat(connector, prompt, model=None, user_ip=None, **kwargs):
+    """
+    使用已创建的连接器发送一次对话请求，请求格式由连接的提供商适配器决定
+    
+    model为None时使用适配器的默认模型；其他关键字参数传给 call_api，返回格式与 call_openai_api 一致
+    """
+    adapter = connector.adapter
+    response = connector.call_api(
+        endpoint=adapter.chat_endpoint_for(model),
+        data=adapter.build_chat_request(prompt, model),
+        user_ip=user_ip,
+        **kwargs
+    )
+    return adapter.parse_chat_response(response)
+
+def stream_chat(connector, prompt, model=None, user_ip=None):
+    """使用已创建的连接器发送一次流式对话请求，逐个产出统一格式的数据块"""
+    adapter = connector.adapter
+    for chunk in connector.stream_api(
+        endpoint=adapter.chat_endpoint_for(model),
+        data=adapter.build_chat_request(prompt, model, stream=True),
+        user_ip=user_ip
+    ):
+        yield adapter.parse_stream_chunk(chunk)
+
+def _get_chat_connector(provider_type, connection_id=None, balanced=False):
+    """获取对话使用的连接器；balanced为True且未指定连接时在该类型的全部活跃连接间负载均衡"""
+    if balanced and not connection_id:
+        from .balancer import BalancedAPIConnector
+        return BalancedAPIConnector(provider_type)
+    return APIConnector(connection_id=connection_id, provider_type=provider_type if not connection_id else None)
+
+def _stream_chat(provider_type, endpoint, data, parse_chunk, connection_id=None, user_ip=None):
+    """流式对话的公共实现，逐个产出统一格式的数据块"""
     try:
-        connector = APIConnector(connection_id=connection_id, provider_type='openai' if not connection_id else None)
+        connector = APIConnector(connection_id=connection_id, provider_type=provider_type if not connection_id else None)
         
-        data = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7
+        for chunk in connector.stream_api(endpoint=endpoint, data=data, user_ip=user_ip):
+            yield parse_chunk(chunk)
+            
+    except Exception as e:
+        logger.exception(f"流式调用{provider_type} API时出错: {str(e)}")
+        yield {
+            'success': False,
+            'error': str(e)
         }
+
+def call_openai_api(prompt, model="gpt-3.5-turbo", connection_id=None, user_ip=None, stream=False,
+                    use_cache=False, balanced=False):
+    """
+    调用OpenAI API的示例函数
+    
+    stream为True时返回生成器，逐个产出 parse_openai_stream_chunk 格式的数据块；
+    use_cache为True时相同的请求直接返回缓存的响应（流式调用不使用缓存）；
+    balanced为True且未指定connection_id时，在全部活跃连接间负载均衡并故障转移
+    """
+    if stream:
+        return _stream_chat('openai', OPENAI_CHAT_ENDPOINT,
+                            build_openai_chat_request(prompt, model, stream=True),
+                            parse_openai_stream_chunk, connection_id, user_ip)
+    
+    try:
+        connector = _get_chat_connector('openai', connection_id, balanced)
         
         response = connector.call_api(
-            endpoint="chat/completions",
-            data=data,
-            user_ip=user_ip
+            endpoint=OPENAI_CHAT_ENDPOINT,
+            data=build_openai_chat_request(prompt, model),
+            user_ip=user_ip,
+            use_cache=use_cache
         )
         
-        if response and not response.get('error', False):
-            if 'choices' in response and len(response['choices']) > 0:
-                return {
-                    'success': True,
-                    'content': response['choices'][0]['message']['content'],
-                    'usage': response.get('usage', {})
-                }
-        
-        return {
-            'success': False,
-            'error': response.get('message', '未知错误'),
-            'details': response
-        }
+        return parse_openai_chat_response(response)
         
     except Exception as e:
         logger.exception(f"调用OpenAI API时出错: {str(e)}")
@@ -298,33 +817,31 @@ def call_openai_api(prompt, model="gpt-3.5-turbo", connection_id=None, user_ip=N
             'error': str(e)
         }
 
-def call_baidu_api(prompt, connection_id=None, user_ip=None):
-    """调用百度文心API的示例函数"""
+def call_baidu_api(prompt, connection_id=None, user_ip=None, stream=False, use_cache=False,
+                   balanced=False):
+    """
+    调用百度文心API的示例函数
+    
+    stream为True时返回生成器，逐个产出 parse_baidu_stream_chunk 格式的数据块；
+    use_cache为True时相同的请求直接返回缓存的响应（流式调用不使用缓存）；
+    balanced为True且未指定connection_id时，在全部活跃连接间负载均衡并故障转移
+    """
+    if stream:
+        return _stream_chat('baidu', BAIDU_CHAT_ENDPOINT,
+                            build_baidu_chat_request(prompt, stream=True),
+                            parse_baidu_stream_chunk, connection_id, user_ip)
+    
     try:
-        connector = APIConnector(connection_id=connection_id, provider_type='baidu' if not connection_id else None)
-        
-        data = {
-            "messages": [{"role": "user", "content": prompt}]
-        }
+        connector = _get_chat_connector('baidu', connection_id, balanced)
         
         response = connector.call_api(
-            endpoint="rpc/2.0/ai_custom/v1/wenxinworkshop/chat/completions",
-            data=data,
-            user_ip=user_ip
+            endpoint=BAIDU_CHAT_ENDPOINT,
+            data=build_baidu_chat_request(prompt),
+            user_ip=user_ip,
+            use_cache=use_cache
         )
         
-        if response and not response.get('error', False):
-            return {
-                'success': True,
-                'content': response.get('result', ''),
-                'usage': response.get('usage', {})
-            }
-        
-        return {
-            'success': False,
-            'error': response.get('message', '未知错误'),
-            'details': response
-        }
+        return parse_baidu_chat_response(response)
         
     except Exception as e:
         logger.exception(f"调用百度API时出错: {str(e)}")
@@ -1,21 +1,33 @@
 from django.shortcuts import render
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, pagination
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.core.cache import cache
+import os
+import json
+from django.conf import settings
+from django.http import StreamingHttpResponse, FileResponse, HttpResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 from django.db import models
+from django.utils import timezone
 from datetime import datetime, timedelta
 
 from .models import APIProvider, APIConnection, APIUsageLog, APIModel
 from .serializers import (
     APIProviderSerializer, APIConnectionSerializer,
     APIConnectionDetailSerializer, APIUsageLogSerializer,
-    APIModelSerializer
+    APIUsageLogListSerializer, APIModelSerializer
 )
-from .utils import call_openai_api, call_baidu_api
+from .utils import APIConnector, call_chat, stream_chat, format_sse_event, SSE_DONE
+from .statistics import get_usage_statistics
+from .response_cache import response_cache
+from .balancer import load_balancer
+from .metrics import latency_metrics, latency_summary, prometheus_text
+from .batch import parse_jsonl, parse_prompts, run_batch, create_batch_job, read_job_status, batch_job_dir
+from .tasks import run_prompt_batch
+from .archive import iter_archived_logs
 
 class APIProviderViewSet(viewsets.ModelViewSet):
     """API提供商视图集"""
@@ -135,6 +147,46 @@ class APIConnectionViewSet(viewsets.ModelViewSet):
                 
         return Response(default_connections)
     
+    @action(detail=False, methods=['get'])
+    def pool_status(self, request):
+        """获取某个提供商类型全部活跃连接在当前进程中的负载和熔断状态"""
+        provider_type = request.query_params.get('provider_type')
+        if not provider_type:
+            return Response(
+                {'status': 'error', 'message': 'provider_type不能为空'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        connections = list(APIConnection.objects.filter(
+            provider__provider_type=provider_type, is_active=True
+        ).values_list('id', 'name'))
+        health = load_balancer.snapshot([connection_id for connection_id, _ in connections])
+        return Response([
+            dict(health[str(connection_id)], id=str(connection_id), name=name)
+            for connection_id, name in connections
+        ])
+    
+    @action(detail=False, methods=['get', 'delete'])
+    def latency(self, request):
+        """
+        获取各连接上游请求延迟的p50/p95/p99（汇总所有进程，单位ms），DELETE时清空延迟指标
+        
+        ?connection= 只返回指定连接；清空延迟指标需要管理员权限
+        """
+        if request.method == 'DELETE':
+            if not IsAdminUser().has_permission(request, self):
+                self.permission_denied(request, message='只有管理员可以清空延迟指标')
+            latency_metrics.reset()
+            return Response({'status': 'success', 'message': '已清空延迟指标'})
+        
+        summary = latency_summary(latency_metrics.snapshot(), request.query_params.get('connection'))
+        names = dict(APIConnection.objects.filter(id__in=list(summary)).values_list('id', 'name'))
+        names = {str(connection_id): name for connection_id, name in names.items()}
+        return Response([
+            dict(stats, id=connection_id, name=names.get(connection_id, ''))
+            for connection_id, stats in summary.items()
+        ])
+    
     @action(detail=True, methods=['post'])
     def set_default(self, request, pk=None):
         """设置为默认连接"""
@@ -151,26 +203,18 @@ class APIConnectionViewSet(viewsets.ModelViewSet):
     def test(self, request, pk=None):
         """测试API连接"""
         connection = self.get_object()
-        provider_type = connection.provider.provider_type
         
         try:
-            if provider_type == 'openai':
-                result = call_openai_api(
-                    prompt="Hello, I'm testing the API connection. Please respond with 'Connection successful'.",
-                    connection_id=connection.id,
-                    user_ip=self.get_client_ip(request)
-                )
-            elif provider_type == 'baidu':
-                result = call_baidu_api(
-                    prompt="你好，我正在测试API连接。请回复'连接成功'。",
-                    connection_id=connection.id,
-                    user_ip=self.get_client_ip(request)
-                )
-            else:
-                return Response(
-                    {'status': 'error', 'message': f'暂不支持测试 {provider_type} 类型的连接'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            # 测试提示词和请求格式由提供商适配器决定，所有类型的连接都可以测试
+            connector = APIConnector(connection_id=connection.id)
+        except ValueError as e:
+            return Response(
+                {'status': 'error', 'message': f'连接测试失败: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            result = call_chat(connector, connector.adapter.test_prompt, user_ip=self.get_client_ip(request))
                 
             if result.get('success', False):
                 return Response({
@@ -191,6 +235,142 @@ class APIConnectionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=True, methods=['get', 'delete'])
+    def cache_stats(self, request, pk=None):
+        """获取（GET）或清零（DELETE）该连接的响应缓存命中率"""
+        connection = self.get_object()
+        if request.method == 'DELETE':
+            response_cache.reset_stats(connection.id)
+        return Response(response_cache.stats(connection.id))
+    
+    @action(detail=True, methods=['post'])
+    def chat_stream(self, request, pk=None):
+        """
+        使用该连接进行流式对话，以SSE格式逐块返回生成的内容
+        
+        请求体:
+            prompt: 提示词
+            model: 模型标识符（可选，未提供时使用提供商的默认模型）
+        """
+        connection = self.get_object()
+        prompt = request.data.get('prompt')
+        if not prompt:
+            return Response(
+                {'status': 'error', 'message': 'prompt不能为空'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            connector = APIConnector(connection_id=connection.id)
+        except ValueError as e:
+            return Response({'status': 'error', 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        model = request.data.get('model') or None
+        user_ip = self.get_client_ip(request)
+        
+        def events():
+            try:
+                for chunk in stream_chat(connector, prompt, model=model, user_ip=user_ip):
+                    yield format_sse_event(chunk)
+            except Exception as e:
+                yield format_sse_event({'success': False, 'error': str(e)})
+            yield format_sse_event(SSE_DONE)
+        
+        response = StreamingHttpResponse(events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # 禁止Nginx缓冲，数据块到达后立即转发给客户端
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @action(detail=True, methods=['post'])
+    def batch(self, request, pk=None):
+        """
+        批量调用提示词
+        
+        请求体为JSONL（Content-Type: application/x-ndjson），每行一个提示词字符串或
+        {"id": ..., "prompt": ..., "model": ...}；也可以是JSON对象 {"prompts": [...]}。
+        
+        查询参数:
+            concurrency: 最大并发数（可选）
+            model: 默认模型（可选，未提供时使用提供商的默认模型）
+            mode: sync（默认）按完成顺序以NDJSON流式返回结果，最多 API_CONNECTOR_BATCH_MAX_SYNC_PROMPTS 条；
+                  async 创建后台任务，返回任务ID，结果写入文件
+        """
+        connection = self.get_object()
+        
+        try:
+            if request.content_type in ('application/x-ndjson', 'application/jsonl', 'text/plain'):
+                items = parse_jsonl(request.body.decode('utf-8').splitlines())
+            else:
+                prompts = request.data.get('prompts')
+                if not isinstance(prompts, list):
+                    raise ValueError('prompts必须是列表')
+                items = parse_prompts(prompts)
+        except (ValueError, UnicodeDecodeError) as e:
+            return Response({'status': 'error', 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not items:
+            return Response({'status': 'error', 'message': '提示词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+        max_prompts = getattr(settings, 'API_CONNECTOR_BATCH_MAX_PROMPTS', 10000)
+        if len(items) > max_prompts:
+            return Response(
+                {'status': 'error', 'message': f'单次最多提交{max_prompts}条提示词'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_concurrency = getattr(settings, 'API_CONNECTOR_BATCH_MAX_CONCURRENCY', 20)
+        try:
+            concurrency = max(1, min(int(request.query_params.get('concurrency', 5)), max_concurrency))
+        except ValueError:
+            return Response({'status': 'error', 'message': 'concurrency必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        model = request.query_params.get('model') or None
+        user_ip = self.get_client_ip(request)
+        
+        is_async = request.query_params.get('mode') == 'async'
+        max_sync_prompts = getattr(settings, 'API_CONNECTOR_BATCH_MAX_SYNC_PROMPTS', 100)
+        if not is_async and len(items) > max_sync_prompts:
+            # 同步模式在请求中执行，受工作进程超时限制
+            return Response(
+                {'status': 'error', 'message': f'同步模式最多提交{max_sync_prompts}条提示词，更多的提示词请使用 mode=async'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if is_async:
+            job_id = create_batch_job(connection, items, concurrency, model, user_ip)
+            run_prompt_batch.delay(job_id)
+            return Response({
+                'status': 'success',
+                'job_id': job_id,
+                'total': len(items)
+            }, status=status.HTTP_202_ACCEPTED)
+        
+        def results():
+            for result in run_batch(connection, items, concurrency, model, user_ip):
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+        
+        response = StreamingHttpResponse(results(), content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @action(detail=True, methods=['get'], url_path=r'batch_jobs/(?P<job_id>[0-9a-f]{32})')
+    def batch_job(self, request, pk=None, job_id=None):
+        """获取异步批量任务的状态；download=true时下载结果文件（JSONL）"""
+        connection = self.get_object()
+        job = read_job_status(job_id)
+        if job is None or job.get('connection_id') != str(connection.id):
+            return Response({'status': 'error', 'message': '批量任务不存在'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if request.query_params.get('download', '').lower() == 'true':
+            path = os.path.join(batch_job_dir(job_id), 'results.jsonl')
+            if not os.path.exists(path):
+                return Response({'status': 'error', 'message': '结果文件尚未生成'}, status=status.HTTP_404_NOT_FOUND)
+            return FileResponse(
+                open(path, 'rb'), as_attachment=True,
+                filename=f'batch_{job_id}.jsonl', content_type='application/x-ndjson'
+            )
+        
+        job.pop('user_ip', None)
+        return Response(job)
+    
     def get_client_ip(self, request):
         """获取客户端IP"""
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -201,14 +381,41 @@ class APIConnectionViewSet(viewsets.ModelViewSet):
         return ip
 
 
+class UsageLogCursorPagination(pagination.CursorPagination):
+    """API使用日志的游标分页器，按创建时间倒序，翻页深度不影响查询代价"""
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-created_at'
+
+
 class APIUsageLogViewSet(viewsets.ReadOnlyModelViewSet):
     """API使用日志视图集，只读"""
-    queryset = APIUsageLog.objects.all()
+    queryset = APIUsageLog.objects.select_related('connection__provider')
     serializer_class = APIUsageLogSerializer
     permission_classes = [IsAuthenticated]
     
+    @property
+    def paginator(self):
+        """?pagination=cursor 时使用游标分页，否则使用默认的页码分页"""
+        if (not hasattr(self, '_paginator') and self.request is not None
+                and self.request.query_params.get('pagination') == 'cursor'):
+            self._paginator = UsageLogCursorPagination()
+        return super().paginator
+    
+    def get_serializer_class(self):
+        """列表默认不返回请求和响应数据，?include_payload=true 时返回完整数据"""
+        if self.action == 'list' and self.request.query_params.get('include_payload', '').lower() != 'true':
+            return APIUsageLogListSerializer
+        return super().get_serializer_class()
+    
     def list(self, request, *args, **kwargs):
-        """获取API使用日志列表"""
+        """
+        获取API使用日志列表
+        
+        支持按 connection、status、start_date、end_date 过滤；
+        ?pagination=cursor 使用游标分页（响应中没有count，用next/previous链接翻页）。
+        """
         queryset = self.filter_queryset(self.get_queryset())
         
         # 按连接过滤
@@ -238,115 +445,92 @@ class APIUsageLogViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def archive(self, request):
+        """
+        流式返回已归档的使用日志（NDJSON），不写回数据库
+        
+        查询参数:
+            start_date: 开始日期（YYYY-MM-DD，包含）
+            end_date: 结束日期（YYYY-MM-DD，包含），默认与开始日期相同
+            connection: 只返回该连接的日志（可选）
+            status: 只返回该状态的日志（可选）
+        """
+        try:
+            start_date = datetime.strptime(request.query_params.get('start_date', ''), '%Y-%m-%d').date()
+            end_date = datetime.strptime(
+                request.query_params.get('end_date') or start_date.isoformat(), '%Y-%m-%d'
+            ).date()
+        except ValueError:
+            return Response(
+                {'status': 'error', 'message': 'start_date和end_date必须是YYYY-MM-DD格式的日期'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if end_date < start_date:
+            return Response({'status': 'error', 'message': 'end_date不能早于start_date'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        lines = iter_archived_logs(
+            start_date, end_date,
+            connection_id=request.query_params.get('connection'),
+            status=request.query_params.get('status')
+        )
+        response = StreamingHttpResponse((line + '\n' for line in lines), content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """获取使用统计信息"""
-        # 使用缓存减轻数据库压力
-        stats = cache.get('api_usage_statistics')
-        if not stats:
-            # 按状态统计
-            status_stats = {}
-            for status_choice, _ in APIUsageLog.STATUS_CHOICES:
-                status_stats[status_choice] = APIUsageLog.objects.filter(status=status_choice).count()
-            
-            # 获取日期范围
-            period = request.query_params.get('period', 'week')
-            
-            if period == 'today':
-                start_date = datetime.now().date()
-            elif period == 'week':
-                start_date = (datetime.now() - timedelta(days=7)).date()
-            elif period == 'month':
-                start_date = (datetime.now() - timedelta(days=30)).date()
-            elif period == 'custom':
-                start_date_str = request.query_params.get('start_date')
-                end_date_str = request.query_params.get('end_date')
-                try:
-                    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-                    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-                except (ValueError, TypeError):
-                    return Response(
-                        {'error': '无效的日期格式，请使用YYYY-MM-DD格式'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            else:
-                start_date = (datetime.now() - timedelta(days=7)).date()
-            
-            end_date = request.query_params.get('end_date')
-            if not end_date and period != 'custom':
-                end_date = datetime.now().date()
-            elif period == 'custom':
-                # 已在上面处理
-                pass
-            else:
-                try:
-                    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-                except (ValueError, TypeError):
-                    end_date = datetime.now().date()
-                    
-            # 按日期统计每日请求数和Token消耗
-            daily_stats = []
-            current_date = start_date
-            while current_date <= end_date:
-                next_date = current_date + timedelta(days=1)
-                daily_requests = APIUsageLog.objects.filter(
-                    created_at__date=current_date
-                ).count()
-                
-                daily_tokens = APIUsageLog.objects.filter(
-                    created_at__date=current_date
-                ).aggregate(total=models.Sum('tokens_used'))['total'] or 0
-                
-                daily_stats.append({
-                    'date': current_date.strftime('%Y-%m-%d'),
-                    'requests': daily_requests,
-                    'tokens': daily_tokens
-                })
-                
-                current_date = next_date
-            
-            # 按提供商统计
-            provider_stats = []
-            for provider in APIProvider.objects.all():
-                connections = APIConnection.objects.filter(provider=provider)
-                connection_ids = [conn.id for conn in connections]
-                
-                if connection_ids:
-                    provider_logs = APIUsageLog.objects.filter(connection__id__in=connection_ids)
-                    total_requests = provider_logs.count()
-                    
-                    if total_requests > 0:
-                        success_requests = provider_logs.filter(status='success').count()
-                        success_rate = success_requests / total_requests if total_requests > 0 else 0
-                        
-                        tokens = provider_logs.aggregate(total=models.Sum('tokens_used'))['total'] or 0
-                        avg_response_time = provider_logs.aggregate(avg=models.Avg('response_time'))['avg'] or 0
-                        
-                        provider_stats.append({
-                            'provider': provider.name,
-                            'requests': total_requests,
-                            'success_rate': success_rate,
-                            'tokens': tokens,
-                            'avg_response_time': avg_response_time
-                        })
-            
-            # 计算总计数据
-            total_requests = APIUsageLog.objects.count()
-            success_requests = APIUsageLog.objects.filter(status='success').count()
-            failed_requests = total_requests - success_requests
-            total_tokens = APIUsageLog.objects.aggregate(total=models.Sum('tokens_used'))['total'] or 0
-            
-            stats = {
-                'total_requests': total_requests,
-                'success_requests': success_requests,
-                'failed_requests': failed_requests,
-                'total_tokens': total_tokens,
-                'status_stats': status_stats,
-                'daily_stats': daily_stats,
-                'provider_stats': provider_stats
-            }
-            
-            # 将结果缓存15分钟
-            cache.set('api_usage_statistics', stats, 60 * 15)
+        """获取使用统计信息（只读取小时/每日汇总表）"""
+        # 获取日期范围
+        period = request.query_params.get('period', 'week')
+        
+        if period == 'today':
+            start_date = timezone.localdate()
+        elif period == 'week':
+            start_date = timezone.localdate() - timedelta(days=7)
+        elif period == 'month':
+            start_date = timezone.localdate() - timedelta(days=30)
+        elif period == 'custom':
+            start_date_str = request.query_params.get('start_date')
+            end_date_str = request.query_params.get('end_date')
+            try:
+                start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+                end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            except (ValueError, TypeError):
+                return Response(
+                    {'error': '无效的日期格式，请使用YYYY-MM-DD格式'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            period = 'week'
+            start_date = timezone.localdate() - timedelta(days=7)
         
+        if period != 'custom':
+            try:
+                end_date = datetime.strptime(request.query_params.get('end_date'), '%Y-%m-%d').date()
+            except (ValueError, TypeError):
+                end_date = timezone.localdate()
+        
+        # 缓存键由规范化后的窗口决定，封闭日的数据在 get_usage_statistics 中长期复用
+        stats = get_usage_statistics(period, start_date, end_date)
         return Response(stats)
+
+
+def metrics_view(request):
+    """
+    以Prometheus文本格式导出上游请求延迟直方图
+
+    需要在请求头中携带 Authorization: Bearer <API_METRICS_TOKEN>；未配置令牌时拒绝访问。
+    """
+    token = getattr(settings, 'API_METRICS_TOKEN', None)
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    
+    histograms = latency_metrics.snapshot()
+    connection_ids = {connection_id for connection_id, _, _ in histograms}
+    names = {
+        str(connection_id): name
+        for connection_id, name in APIConnection.objects.filter(id__in=connection_ids).values_list('id', 'name')
+    }
+    return HttpResponse(prometheus_text(histograms, names), content_type='text/plain; version=0.0.4; charset=utf-8')
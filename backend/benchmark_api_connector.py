@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+API连接器性能基准测试
+
+在本地启动一个模拟上游的HTTP服务，对比每次新建连接的 requests.post
+与使用会话池的 APIConnector.call_api 的延迟差异。
+
+用法:
+    python benchmark_api_connector.py --requests 500 --connect-delay-ms 20
+
+--connect-delay-ms 用于在每个新TCP连接上模拟TLS握手等建连开销。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import statistics
+import threading
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+# 首先设置Django环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'big_model_app.settings')
+django.setup()
+
+import requests
+from api_connector.models import APIProvider, APIConnection
+from api_connector.registry import connection_registry
+from api_connector.utils import APIConnector
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """模拟OpenAI风格的chat/completions接口"""
+
+    protocol_version = 'HTTP/1.1'
+    connect_delay = 0.0
+
+    def setup(self):
+        super().setup()
+        # 与常见的生产服务器一致，关闭Nagle算法
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # 每个新连接只执行一次，用于模拟建连开销
+        if self.connect_delay:
+            time.sleep(self.connect_delay)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        body = json.dumps({
+            'choices': [{'message': {'role': 'assistant', 'content': 'ok'}}],
+            'usage': {'total_tokens': 3}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(connect_delay_ms):
+    """在随机端口启动模拟服务"""
+    StubHandler.connect_delay = connect_delay_ms / 1000.0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def summarize(name, samples):
+    """打印延迟统计"""
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<28} 平均: {statistics.mean(samples):8.2f} ms  "
+          f"中位数: {statistics.median(samples):8.2f} ms  p95: {p95:8.2f} ms")
+
+
+def run(total, connect_delay_ms):
+    server = start_stub_server(connect_delay_ms)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+
+    # 构造未保存的连接对象，基准测试不访问数据库
+    provider = APIProvider(id=uuid.uuid4(), name='stub', provider_type='openai', base_url=base_url)
+    connection = APIConnection(id=uuid.uuid4(), name='stub', provider=provider, api_key='sk-bench')
+    connector = APIConnector.from_connection(connection)
+
+    payload = {'model': 'stub', 'messages': [{'role': 'user', 'content': 'hi'}]}
+    headers = connector._prepare_headers()
+    url = f"{base_url}chat/completions"
+
+    fresh = []
+    for _ in range(total):
+        start = time.perf_counter()
+        requests.post(url, headers=headers, data=json.dumps(payload), timeout=60).json()
+        fresh.append((time.perf_counter() - start) * 1000)
+
+    # call_api 发送前会按模型查询上下文限制，模拟的提供商没有登记模型，
+    # 跳过这次查询，使基准测试在未迁移的数据库上也能运行
+    pooled = []
+    with mock.patch.object(connection_registry, 'get_model', return_value=None):
+        for _ in range(total):
+            start = time.perf_counter()
+            connector.call_api('chat/completions', data=payload, log_usage=False)
+            pooled.append((time.perf_counter() - start) * 1000)
+
+    server.shutdown()
+
+    print(f"请求数: {total}，模拟建连开销: {connect_delay_ms} ms")
+    summarize('requests.post (每次新建连接)', fresh)
+    summarize('APIConnector (会话池)', pooled)
+    print(f"平均节省: {statistics.mean(fresh) - statistics.mean(pooled):.2f} ms/请求")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='API连接器会话池基准测试')
+    parser.add_argument('--requests', type=int, default=200, help='每种方式发送的请求数')
+    parser.add_argument('--connect-delay-ms', type=float, default=0, help='模拟每个新连接的建连开销(毫秒)')
+    args = parser.parse_args()
+    run(args.requests, args.connect_delay_ms)
+    sys.exit(0)
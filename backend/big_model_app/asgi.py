@@ -1,5 +1,8 @@
 """
 ASGI配置文件
+
+API连接服务的异步视图（如 /api/api-connector/async/gather/）需要通过ASGI部署：
+    gunicorn -k uvicorn.workers.UvicornWorker big_model_app.asgi:application
 """
 
 import os
@@ -6,6 +6,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 import re
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 
 # 加载环境变量
 load_dotenv()
@@ -50,17 +51,32 @@ CSRF_EXEMPT_URLS = [
 
 # 自定义中间件，用于在特定 URL 上禁用 CSRF 保护
 class DisableCSRFMiddleware:
+    # 同时支持WSGI和ASGI，避免ASGI下异步视图被降级为同步执行
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-    def __call__(self, request):
+    def _mark_exempt(self, request):
         # 检查请求路径是否在豁免列表中
         path = request.path_info.lstrip('/')
         if any(url.search(path) for url in CSRF_EXEMPT_URLS):
             setattr(request, '_dont_enforce_csrf_checks', True)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self._mark_exempt(request)
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        self._mark_exempt(request)
+        return await self.get_response(request)
+
 # 将自定义中间件添加到中间件列表中
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -112,6 +128,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'big_model_app.wsgi.application'
+ASGI_APPLICATION = 'big_model_app.asgi.application'
 
 # 数据库
 # 根据环境变量配置数据库
@@ -174,6 +191,46 @@ MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 os.makedirs(STATIC_ROOT, exist_ok=True)
 os.makedirs(MEDIA_ROOT, exist_ok=True)
 
+# 缓存配置
+# 配置REDIS_CACHE_URL后使用Redis作为共享缓存（速率限制等需要跨进程共享的状态依赖它），
+# 否则使用进程内缓存
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL')
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# 上游API响应缓存（APIConnector.call_api(use_cache=True)）
+# 配置API_RESPONSE_CACHE_URL时使用Redis（由maxmemory-policy按LRU淘汰），
+# 否则保存在本机磁盘上，多个进程共享，条目数超过上限时淘汰
+API_RESPONSE_CACHE_ALIAS = 'api_responses'
+API_RESPONSE_CACHE_TIMEOUT = int(os.getenv('API_RESPONSE_CACHE_TIMEOUT', '3600'))
+API_RESPONSE_CACHE_URL = os.getenv('API_RESPONSE_CACHE_URL')
+if API_RESPONSE_CACHE_URL:
+    CACHES[API_RESPONSE_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': API_RESPONSE_CACHE_URL,
+        'TIMEOUT': API_RESPONSE_CACHE_TIMEOUT,
+    }
+else:
+    CACHES[API_RESPONSE_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('API_RESPONSE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'api_responses')),
+        'TIMEOUT': API_RESPONSE_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('API_RESPONSE_CACHE_MAX_ENTRIES', '10000')),
+        },
+    }
+
 # 默认主键字段类型
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -215,6 +272,125 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# API使用统计汇总每天从原始日志校正的天数（包含今天）
+API_USAGE_ROLLUP_REBUILD_DAYS = int(os.getenv('API_USAGE_ROLLUP_REBUILD_DAYS', '2'))
+# API使用日志在数据库中保留的天数，更早的日志归档到压缩文件后删除；必须大于校正天数
+API_USAGE_LOG_RETENTION_DAYS = int(os.getenv('API_USAGE_LOG_RETENTION_DAYS', '30'))
+# 归档文件的目录，以及归档时每批读取和删除的行数
+API_USAGE_ARCHIVE_DIR = os.getenv('API_USAGE_ARCHIVE_DIR', os.path.join(MEDIA_ROOT, 'api_usage_archive'))
+API_USAGE_ARCHIVE_BATCH_SIZE = int(os.getenv('API_USAGE_ARCHIVE_BATCH_SIZE', '5000'))
+
+# Celery定时任务
+from celery.schedules import crontab
+CELERY_BEAT_SCHEDULE = {
+    # 每天凌晨根据原始日志校正最近几天的API使用统计汇总
+    'rebuild-api-usage-rollups': {
+        'task': 'api_connector.tasks.rebuild_usage_rollups',
+        'schedule': crontab(minute=30, hour=0),
+        'kwargs': {'days': API_USAGE_ROLLUP_REBUILD_DAYS},
+    },
+    # 校正完成后归档并删除超出保留期的API使用日志
+    'archive-api-usage-logs': {
+        'task': 'api_connector.tasks.archive_usage_logs',
+        'schedule': crontab(minute=30, hour=1),
+    },
+    # 每小时清理过期未完成的数据集分片上传
+    'cleanup-dataset-uploads': {
+        'task': 'data_center.tasks.cleanup_dataset_uploads',
+        'schedule': crontab(minute=15),
+    },
+}
+
+# API连接器设置
+# 每个会话缓存的主机连接池数量
+API_CONNECTOR_POOL_CONNECTIONS = int(os.getenv('API_CONNECTOR_POOL_CONNECTIONS', '10'))
+# 每个主机连接池保持的最大keep-alive连接数
+API_CONNECTOR_POOL_MAXSIZE = int(os.getenv('API_CONNECTOR_POOL_MAXSIZE', '20'))
+# HTTP会话空闲多少秒后被回收
+API_CONNECTOR_SESSION_IDLE_TIMEOUT = int(os.getenv('API_CONNECTOR_SESSION_IDLE_TIMEOUT', '300'))
+# 进程内API连接缓存检查共享版本号的最小间隔(秒)，其他进程修改连接后最多延迟这么久生效
+API_CONNECTOR_REGISTRY_CHECK_INTERVAL = float(os.getenv('API_CONNECTOR_REGISTRY_CHECK_INTERVAL', '1.0'))
+# 同一提供商多个连接间的负载均衡策略：least_outstanding 或 ewma
+API_CONNECTOR_BALANCE_STRATEGY = os.getenv('API_CONNECTOR_BALANCE_STRATEGY', 'least_outstanding')
+# 连接连续失败多少次后熔断，以及熔断后多少秒再探测
+API_CONNECTOR_BREAKER_FAILURES = int(os.getenv('API_CONNECTOR_BREAKER_FAILURES', '5'))
+API_CONNECTOR_BREAKER_COOLDOWN = float(os.getenv('API_CONNECTOR_BREAKER_COOLDOWN', '30'))
+# 遇到可重试错误时单次调用最多尝试的连接数
+API_CONNECTOR_FAILOVER_ATTEMPTS = int(os.getenv('API_CONNECTOR_FAILOVER_ATTEMPTS', '3'))
+# 百度access_token距离过期多少秒时在后台提前刷新，以及请求OAuth接口的超时时间(秒)
+API_CONNECTOR_BAIDU_TOKEN_REFRESH_MARGIN = int(os.getenv('API_CONNECTOR_BAIDU_TOKEN_REFRESH_MARGIN', '3600'))
+API_CONNECTOR_BAIDU_TOKEN_TIMEOUT = float(os.getenv('API_CONNECTOR_BAIDU_TOKEN_TIMEOUT', '10'))
+# 合并相同请求(call_api(coalesce=True))时等待结果的超时(秒)，是否跨进程合并，以及跨进程结果的保留时间(秒)
+API_CONNECTOR_COALESCE_TIMEOUT = float(os.getenv('API_CONNECTOR_COALESCE_TIMEOUT', '65'))
+API_CONNECTOR_COALESCE_CROSS_PROCESS = os.getenv('API_CONNECTOR_COALESCE_CROSS_PROCESS', 'False') == 'True'
+API_CONNECTOR_COALESCE_RESULT_TTL = int(os.getenv('API_CONNECTOR_COALESCE_RESULT_TTL', '5'))
+# 单个上游请求的默认超时(秒)
+API_CONNECTOR_REQUEST_TIMEOUT = float(os.getenv('API_CONNECTOR_REQUEST_TIMEOUT', '60'))
+# 默认重试策略（可在APIProvider.retry_policy中按提供商覆盖）：单次调用最多请求次数、
+# 指数退避的基数和上限(秒)、需要重试的状态码、超时和网络错误是否重试、总时限(秒)
+API_CONNECTOR_RETRY_MAX_ATTEMPTS = int(os.getenv('API_CONNECTOR_RETRY_MAX_ATTEMPTS', '1'))
+API_CONNECTOR_RETRY_BACKOFF_BASE = float(os.getenv('API_CONNECTOR_RETRY_BACKOFF_BASE', '0.5'))
+API_CONNECTOR_RETRY_BACKOFF_MAX = float(os.getenv('API_CONNECTOR_RETRY_BACKOFF_MAX', '8'))
+API_CONNECTOR_RETRY_STATUS_CODES = [
+    int(code) for code in os.getenv('API_CONNECTOR_RETRY_STATUS_CODES', '408,429,500,502,503,504').split(',') if code
+]
+API_CONNECTOR_RETRY_ON_TIMEOUT = os.getenv('API_CONNECTOR_RETRY_ON_TIMEOUT', 'True') == 'True'
+API_CONNECTOR_RETRY_DEADLINE = float(os.getenv('API_CONNECTOR_RETRY_DEADLINE', '120'))
+# 是否默认启用对冲请求，以及未指定hedge_delay时按最近延迟的哪个分位数发出对冲请求
+API_CONNECTOR_HEDGE = os.getenv('API_CONNECTOR_HEDGE', 'False') == 'True'
+API_CONNECTOR_HEDGE_QUANTILE = float(os.getenv('API_CONNECTOR_HEDGE_QUANTILE', '0.95'))
+# 执行对冲请求的线程数（每个进程共享一个线程池）
+API_CONNECTOR_HEDGE_WORKERS = int(os.getenv('API_CONNECTOR_HEDGE_WORKERS', '16'))
+# 提示词加上请求的max_tokens超出APIModel.max_tokens时的默认行为：reject 本地拒绝，truncate 截断提示词
+API_CONNECTOR_TOKEN_LIMIT_MODE = os.getenv('API_CONNECTOR_TOKEN_LIMIT_MODE', 'reject')
+# 超出连接速率限制时的默认行为：reject 立即拒绝，wait 等待令牌
+API_CONNECTOR_RATE_LIMIT_MODE = os.getenv('API_CONNECTOR_RATE_LIMIT_MODE', 'reject')
+# 等待模式下最长等待秒数
+API_CONNECTOR_RATE_LIMIT_MAX_WAIT = float(os.getenv('API_CONNECTOR_RATE_LIMIT_MAX_WAIT', '10'))
+# API使用日志是否由后台线程批量写入
+API_USAGE_LOG_ASYNC = os.getenv('API_USAGE_LOG_ASYNC', 'True') == 'True'
+# 批量写入的条数阈值、时间阈值(秒)、队列容量，以及队列已满时的最长等待时间(秒)
+API_USAGE_LOG_BATCH_SIZE = int(os.getenv('API_USAGE_LOG_BATCH_SIZE', '200'))
+API_USAGE_LOG_FLUSH_INTERVAL = float(os.getenv('API_USAGE_LOG_FLUSH_INTERVAL', '1.0'))
+API_USAGE_LOG_QUEUE_SIZE = int(os.getenv('API_USAGE_LOG_QUEUE_SIZE', '10000'))
+API_USAGE_LOG_PUT_TIMEOUT = float(os.getenv('API_USAGE_LOG_PUT_TIMEOUT', '0.05'))
+# 使用统计接口按查询窗口缓存整体结果的时间(秒)；已结束日期的每日数据单独长期缓存
+API_USAGE_STATISTICS_CACHE_TIMEOUT = int(os.getenv('API_USAGE_STATISTICS_CACHE_TIMEOUT', '60'))
+# 已结束日期的每日统计的缓存时间(秒)，默认7天
+API_USAGE_STATISTICS_CLOSED_DAY_TIMEOUT = int(os.getenv('API_USAGE_STATISTICS_CLOSED_DAY_TIMEOUT', '604800'))
+# 各进程把上游请求延迟直方图的增量写入共享缓存的间隔(秒)
+API_METRICS_FLUSH_INTERVAL = float(os.getenv('API_METRICS_FLUSH_INTERVAL', '5'))
+# 访问 /metrics 所需的Bearer令牌，未配置时 /metrics 拒绝所有请求
+API_METRICS_TOKEN = os.getenv('API_METRICS_TOKEN')
+# 异步并发调用接口单次允许的最大提示词数和最大并发数
+API_CONNECTOR_GATHER_MAX_PROMPTS = int(os.getenv('API_CONNECTOR_GATHER_MAX_PROMPTS', '1000'))
+API_CONNECTOR_GATHER_MAX_CONCURRENCY = int(os.getenv('API_CONNECTOR_GATHER_MAX_CONCURRENCY', '50'))
+# 批量提示词接口单次允许的最大提示词数和最大并发数
+API_CONNECTOR_BATCH_MAX_PROMPTS = int(os.getenv('API_CONNECTOR_BATCH_MAX_PROMPTS', '10000'))
+API_CONNECTOR_BATCH_MAX_CONCURRENCY = int(os.getenv('API_CONNECTOR_BATCH_MAX_CONCURRENCY', '20'))
+# 同步模式（在请求中流式返回结果）允许的最大提示词数，超过时需要使用 mode=async
+API_CONNECTOR_BATCH_MAX_SYNC_PROMPTS = int(os.getenv('API_CONNECTOR_BATCH_MAX_SYNC_PROMPTS', '100'))
+# 嵌入调用同时发送的批次数，以及嵌入缓存的目录（按模型和文本摘要保存向量）
+API_EMBEDDING_CONCURRENCY = int(os.getenv('API_EMBEDDING_CONCURRENCY', '4'))
+API_EMBEDDING_CACHE_DIR = os.getenv('API_EMBEDDING_CACHE_DIR', os.path.join(MEDIA_ROOT, 'embedding_cache'))
+
+# 数据中心设置
+# 后台解析数据集时每块读取的行数
+DATASET_INGEST_CHUNK_ROWS = int(os.getenv('DATASET_INGEST_CHUNK_ROWS', '50000'))
+# 数据集行偏移索引每隔多少行记录一个偏移，越小预览定位越快、索引越大
+DATASET_INDEX_STRIDE = int(os.getenv('DATASET_INDEX_STRIDE', '1000'))
+# 数据集列式副本(Parquet)的压缩算法：snappy、zstd、gzip 或 none
+DATASET_PARQUET_COMPRESSION = os.getenv('DATASET_PARQUET_COMPRESSION', 'snappy')
+# 数据集统计中每列返回出现最多的值的个数和直方图的箱数
+DATASET_PROFILE_TOP_K = int(os.getenv('DATASET_PROFILE_TOP_K', '10'))
+DATASET_PROFILE_HISTOGRAM_BINS = int(os.getenv('DATASET_PROFILE_HISTOGRAM_BINS', '20'))
+# 分片上传的默认分片大小和允许的最大分片大小(字节)，以及未完成的上传保留多少小时
+DATASET_UPLOAD_PART_SIZE = int(os.getenv('DATASET_UPLOAD_PART_SIZE', str(64 * 1024 * 1024)))
+DATASET_UPLOAD_MAX_PART_SIZE = int(os.getenv('DATASET_UPLOAD_MAX_PART_SIZE', str(96 * 1024 * 1024)))
+# 反向代理允许的最大请求体(字节)，与nginx的client_max_body_size一致，分片大小不会超过它
+DATASET_UPLOAD_PROXY_MAX_BODY_SIZE = int(os.getenv('DATASET_UPLOAD_PROXY_MAX_BODY_SIZE', str(100 * 1024 * 1024)))
+DATASET_UPLOAD_EXPIRE_HOURS = int(os.getenv('DATASET_UPLOAD_EXPIRE_HOURS', '24'))
+
 # 日志配置
 LOGGING = {
     'version': 1,
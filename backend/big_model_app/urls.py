@@ -8,6 +8,7 @@ from django.conf.urls.static import static
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from api_connector.views import metrics_view
 
 # API文档配置
 schema_view = get_schema_view(
@@ -31,6 +32,9 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     
+    # Prometheus指标
+    path('metrics', metrics_view, name='metrics'),
+    
     # 主要API路由 - 无版本号（推荐使用）
     path('api/auth/', include('api.urls')),
     path('api/data-center/', include('data_center.urls')),
@@ -0,0 +1,248 @@
+"""
+数据集的列式（Parquet）副本
+
+解析数据集时 ColumnarStage 把每个数据块转换为一个带类型的Arrow表，写入数据文件旁的
+<文件名>.parquet，每块对应一个行组（行数为 DATASET_INGEST_CHUNK_ROWS）。之后的统计、
+训练、评估等读取方不必再解析原始的CSV/Excel/JSON：
+
+- read_columnar 读取为 pyarrow.Table，只读取需要的列（列投影），并按过滤条件
+  利用行组的最小/最大值统计跳过不相关的行组（谓词下推）；文件通过内存映射读取
+- iter_columnar 以同样的方式按批流式读取
+- read_columnar_rows 按行组的行数直接定位到第n行
+
+列类型与 schema 中的类型一致（见 ingestion.column_dtype）。后面的数据块中类型变宽
+（例如整数列出现空值变为浮点数，或出现新的列）时，已写入的行组按新类型重写一次。
+
+pyarrow 是可选依赖（需要10.0及以上版本，过滤条件使用 pyarrow.parquet.filters_to_expression），
+未安装时不生成列式副本，Dataset.parquet_path 为空。
+"""
+
+import os
+import logging
+from django.conf import settings
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+    pyarrow.parquet.filters_to_expression
+except (ImportError, AttributeError):  # 可选依赖，未安装或版本低于10.0时不生成列式副本
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET_SUFFIX = '.parquet'
+
+
+def available():
+    """是否可以生成和读取列式副本"""
+    return pyarrow is not None
+
+
+def _require():
+    if pyarrow is None:
+        raise RuntimeError("读取数据集的列式副本需要安装 pyarrow")
+
+
+def parquet_name(file_name):
+    """数据文件（相对 MEDIA_ROOT 的路径）对应的列式副本路径"""
+    return f'{file_name}{PARQUET_SUFFIX}'
+
+
+def compression():
+    """Parquet文件使用的压缩算法"""
+    return getattr(settings, 'DATASET_PARQUET_COMPRESSION', 'snappy')
+
+
+def arrow_type(dtype):
+    """schema中的类型名对应的Arrow类型"""
+    return {
+        'bool': pyarrow.bool_(),
+        'int64': pyarrow.int64(),
+        'float64': pyarrow.float64(),
+        'datetime': pyarrow.timestamp('us'),
+        'string': pyarrow.string(),
+        'null': pyarrow.null(),
+    }[dtype]
+
+
+def arrow_schema(dtypes):
+    """{列名: 类型名} 对应的Arrow schema"""
+    return pyarrow.schema([(name, arrow_type(dtype)) for name, dtype in dtypes.items()])
+
+
+def _to_array(series, dtype):
+    """把一列数据转换为指定类型的Arrow数组"""
+    if series is None:
+        return None
+    if dtype == 'null':
+        return pyarrow.nulls(len(series))
+    if dtype == 'string':
+        mask = series.isna().to_numpy()
+        values = series.astype(object).where(~mask, '').astype(str)
+        return pyarrow.array(values.to_numpy(), type=pyarrow.string(), mask=mask)
+    if dtype == 'float64':
+        return pyarrow.array(series.astype('float64').to_numpy(), type=pyarrow.float64(), from_pandas=True)
+    if dtype == 'datetime':
+        return pyarrow.array(series, type=pyarrow.timestamp('us'), from_pandas=True)
+    # int64/bool列在某一块中可能全部为空（pandas读为全NaN的float列），NaN需要转换为null
+    return pyarrow.array(series.to_numpy(), type=arrow_type(dtype), from_pandas=True)
+
+
+def chunk_to_table(chunk, dtypes):
+    """把数据块转换为符合 dtypes 的Arrow表，数据块中没有的列为空"""
+    arrays = []
+    for name, dtype in dtypes.items():
+        series = chunk[name] if name in chunk.columns else None
+        array = _to_array(series, dtype)
+        arrays.append(array if array is not None else pyarrow.nulls(len(chunk), type=arrow_type(dtype)))
+    return pyarrow.Table.from_arrays(arrays, schema=arrow_schema(dtypes))
+
+
+def _conform(table, schema):
+    """把已写入的行组转换为新的schema：补充新列，类型变宽的列做转换"""
+    arrays = []
+    for field in schema:
+        if field.name in table.column_names:
+            arrays.append(table.column(field.name).cast(field.type))
+        else:
+            arrays.append(pyarrow.nulls(table.num_rows, type=field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+class ColumnarWriter:
+    """逐块写入Parquet文件，类型变宽时重写已写入的行组"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f'{path}.tmp'
+        self.writer = None
+        self.dtypes = {}
+
+    def _open(self, path):
+        return pyarrow.parquet.ParquetWriter(path, arrow_schema(self.dtypes), compression=compression())
+
+    def _widen(self, dtypes):
+        """已写入的数据按新类型重写到新的临时文件"""
+        self.writer.close()
+        old_path = f'{self.tmp_path}.old'
+        os.replace(self.tmp_path, old_path)
+        self.dtypes = dtypes
+        self.writer = self._open(self.tmp_path)
+        schema = arrow_schema(dtypes)
+        source = pyarrow.parquet.ParquetFile(old_path)
+        try:
+            for group in range(source.num_row_groups):
+                self.writer.write_table(_conform(source.read_row_group(group), schema))
+        finally:
+            source.close()
+            os.remove(old_path)
+
+    def write(self, chunk, dtypes):
+        if self.writer is None:
+            self.dtypes = dtypes
+            self.writer = self._open(self.tmp_path)
+        elif dtypes != self.dtypes:
+            logger.info(f"列式副本 {self.path} 的列类型变化，重写已写入的数据")
+            self._widen(dtypes)
+        self.writer.write_table(chunk_to_table(chunk, self.dtypes), row_group_size=max(len(chunk), 1))
+
+    def close(self):
+        """完成写入，原子地替换为正式文件"""
+        if self.writer is None:
+            self.writer = self._open(self.tmp_path)
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        for path in (self.tmp_path, f'{self.tmp_path}.old', self.path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _parquet_path(dataset):
+    _require()
+    if not dataset.parquet_path:
+        raise ValueError(f"数据集 {dataset.id} 没有列式副本")
+    return os.path.join(settings.MEDIA_ROOT, dataset.parquet_path)
+
+
+def _filter_expression(filters):
+    """
+    过滤条件转换为Arrow表达式
+
+    filters 可以是 pyarrow.compute.Expression，也可以是 [(列名, 运算符, 值), ...]
+    （各条件为"且"的关系），运算符为 = == != < <= > >= in "not in"。
+    """
+    if filters is None or isinstance(filters, pyarrow.compute.Expression):
+        return filters
+    return pyarrow.parquet.filters_to_expression(filters)
+
+
+def read_columnar(dataset, columns=None, filters=None):
+    """
+    读取数据集的列式副本
+
+    Args:
+        dataset: 数据集
+        columns: 要读取的列，默认为全部列
+        filters: 过滤条件，见 _filter_expression
+
+    Returns:
+        pyarrow.Table
+
+    Raises:
+        RuntimeError: 未安装 pyarrow
+        ValueError: 数据集没有列式副本
+    """
+    return pyarrow.parquet.read_table(
+        _parquet_path(dataset), columns=columns, filters=_filter_expression(filters), memory_map=True
+    )
+
+
+def iter_columnar(dataset, columns=None, filters=None, batch_size=None):
+    """
+    按批流式读取数据集的列式副本，参数同 read_columnar
+
+    Yields:
+        pyarrow.RecordBatch
+    """
+    source = pyarrow.dataset.dataset(_parquet_path(dataset), format='parquet')
+    batches = source.to_batches(
+        columns=columns, filter=_filter_expression(filters),
+        batch_size=batch_size or getattr(settings, 'DATASET_INGEST_CHUNK_ROWS', 50000)
+    )
+    yield from batches
+
+
+def read_columnar_rows(dataset, start, count, columns=None):
+    """
+    读取第 start 行起的 count 行，只读取覆盖这些行的行组
+
+    Returns:
+        pyarrow.Table
+    """
+    parquet_file = pyarrow.parquet.ParquetFile(_parquet_path(dataset), memory_map=True)
+    try:
+        metadata = parquet_file.metadata
+        groups = []
+        offset = 0  # 第一个选中行组的起始行号
+        position = 0
+        for group in range(metadata.num_row_groups):
+            rows = metadata.row_group(group).num_rows
+            if position + rows > start and position < start + count:
+                if not groups:
+                    offset = position
+                groups.append(group)
+            position += rows
+        if not groups:
+            return parquet_file.schema_arrow.empty_table().select(columns or parquet_file.schema_arrow.names)
+        table = parquet_file.read_row_groups(groups, columns=columns)
+        return table.slice(start - offset, count)
+    finally:
+        parquet_file.close()
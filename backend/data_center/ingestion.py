@@ -0,0 +1,410 @@
+"""
+数据集的后台分块解析
+
+上传请求只保存文件并把数据集标记为待处理，解析由Celery任务 ingest_dataset 在后台完成：
+- CSV/TSV/TXT/JSONL 用 pandas 的 chunksize 逐块读取
+- JSON 数组用 ijson 逐条读取（未安装 ijson 时退化为整体加载）
+- Excel 用 openpyxl 的只读模式逐行读取（未安装 openpyxl 时退化为 pandas.read_excel）
+
+每块数据交给各解析阶段（见 IngestionStage），内存占用只与块大小有关；解析过程中
+status_message 中会报告进度，完成后写入行数、列数和各列的类型（schema）；
+按行存储的格式还会在数据文件旁生成行偏移索引（见 row_index）；安装了 pyarrow 时还会
+生成带类型的列式副本（见 columnar）。文件内容的SHA-256记录在 content_hash 中，
+作为逐列统计（见 profiling）的缓存键。
+"""
+
+import os
+import json
+import hashlib
+import logging
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Dataset
+from . import columnar
+from .row_index import build_row_index, index_path, supports_index, read_indexed_rows, load_row_index
+
+try:
+    import ijson
+except ImportError:  # 可选依赖，未安装时整体加载JSON文件
+    ijson = None
+
+try:
+    import openpyxl
+except ImportError:  # 可选依赖，未安装时使用 pandas.read_excel 整体加载
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+DELIMITED_FORMATS = {'csv': ',', 'tsv': '\t', 'txt': '\t'}
+JSON_LINES_FORMATS = ('jsonl', 'ndjson')
+EXCEL_FORMATS = ('xlsx', 'xls')
+SUPPORTED_FORMATS = tuple(DELIMITED_FORMATS) + JSON_LINES_FORMATS + ('json',) + EXCEL_FORMATS
+
+PROGRESS_INTERVAL = 2.0  # 两次进度更新之间的最短间隔(秒)
+
+
+def chunk_rows():
+    """每块的行数"""
+    return getattr(settings, 'DATASET_INGEST_CHUNK_ROWS', 50000)
+
+
+def dataset_path(dataset):
+    """数据集文件在磁盘上的路径"""
+    return os.path.join(settings.MEDIA_ROOT, dataset.file.name)
+
+
+def file_content_hash(path):
+    """文件内容的SHA-256摘要"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_json_array(f, rows):
+    """把JSON文件（数组或单个对象）逐块转换为DataFrame"""
+    head = f.read(1024).lstrip()
+    f.seek(0)
+    if not head.startswith(b'['):
+        # 单个对象，整体作为一行
+        yield pd.DataFrame([json.load(f)])
+        return
+
+    if ijson is None:
+        logger.warning("未安装 ijson，JSON数据集将整体加载到内存中")
+        data = json.load(f)
+        for start in range(0, len(data), rows):
+            yield pd.DataFrame(data[start:start + rows])
+        return
+
+    batch = []
+    # use_float=True 时数字解析为float而不是Decimal
+    for item in ijson.items(f, 'item', use_float=True):
+        batch.append(item if isinstance(item, dict) else {'value': item})
+        if len(batch) >= rows:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+
+def _iter_excel(path, rows):
+    """把Excel文件的第一个工作表逐块转换为DataFrame"""
+    if openpyxl is None or path.lower().endswith('.xls'):
+        df = pd.read_excel(path)
+        for start in range(0, len(df), rows):
+            yield df.iloc[start:start + rows]
+        return
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet_rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(sheet_rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f'column_{i}' for i, name in enumerate(header)]
+        batch = []
+        for row in sheet_rows:
+            batch.append(row[:len(columns)])
+            if len(batch) >= rows:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def open_chunks(dataset, rows=None):
+    """
+    打开数据集文件，返回 (数据块迭代器, 进度函数, 需要关闭的文件)
+
+    进度函数返回已读取的字节数，无法得知进度时为None。
+
+    Raises:
+        ValueError: 不支持的文件格式
+    """
+    rows = rows or chunk_rows()
+    path = dataset_path(dataset)
+    file_format = (dataset.file_format or '').lower()
+
+    if file_format in DELIMITED_FORMATS:
+        f = open(path, 'rb')
+        chunks = pd.read_csv(f, sep=DELIMITED_FORMATS[file_format], chunksize=rows)
+        return chunks, f.tell, f
+    if file_format in JSON_LINES_FORMATS:
+        f = open(path, 'rb')
+        chunks = pd.read_json(f, lines=True, chunksize=rows)
+        return chunks, f.tell, f
+    if file_format == 'json':
+        f = open(path, 'rb')
+        return _iter_json_array(f, rows), f.tell, f
+    if file_format in EXCEL_FORMATS:
+        return _iter_excel(path, rows), None, None
+    raise ValueError(f"不支持的文件格式: {file_format}")
+
+
+def column_dtype(series):
+    """把pandas的列类型归并为schema中使用的类型名"""
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'int64'
+    if pd.api.types.is_float_dtype(dtype):
+        # 整块都为空的列无法判断类型
+        return 'float64' if series.notna().any() else 'null'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    return 'string'
+
+
+def merge_dtype(a, b):
+    """合并两个数据块中同一列的类型"""
+    if a == b or b == 'null':
+        return a
+    if a == 'null':
+        return b
+    if {a, b} == {'int64', 'float64'}:
+        return 'float64'
+    return 'string'
+
+
+class IngestionStage:
+    """解析阶段：逐块处理数据，全部数据处理完后产出结果"""
+
+    # finish 中写入的数据集字段
+    fields = ()
+
+    def add(self, chunk):
+        raise NotImplementedError
+
+    def finish(self, dataset):
+        """数据全部处理完成，把结果写入 dataset 的字段"""
+
+    def abort(self):
+        """解析失败时清理已产生的中间结果"""
+
+
+class SchemaStage(IngestionStage):
+    """统计行数并推断各列的类型"""
+
+    fields = ('rows_count', 'columns_count', 'schema')
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}  # 列名 -> {'dtype', 'nullable'}，保持首次出现的顺序
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        for name in chunk.columns:
+            series = chunk[name]
+            dtype = column_dtype(series)
+            nullable = bool(series.isna().any())
+            column = self.columns.get(str(name))
+            if column is None:
+                # 之前的数据块中没有这一列，这些行中该列为空
+                self.columns[str(name)] = {
+                    'dtype': dtype, 'nullable': nullable or self.rows > len(chunk)
+                }
+            else:
+                column['dtype'] = merge_dtype(column['dtype'], dtype)
+                column['nullable'] = column['nullable'] or nullable
+        for name, column in self.columns.items():
+            if name not in chunk.columns:
+                column['nullable'] = True
+
+    def finish(self, dataset):
+        dataset.rows_count = self.rows
+        dataset.columns_count = len(self.columns)
+        dataset.schema = [
+            {'name': name, 'dtype': column['dtype'] if column['dtype'] != 'null' else 'string',
+             'nullable': column['nullable']}
+            for name, column in self.columns.items()
+        ]
+
+
+class RowIndexStage(IngestionStage):
+    """在数据文件旁生成行偏移索引（见 row_index），供预览按页随机读取"""
+
+    def __init__(self, dataset):
+        self.path = dataset_path(dataset)
+        self.file_format = dataset.file_format
+        self.rows = 0
+
+    def add(self, chunk):
+        # 索引直接扫描文件的字节，这里只统计pandas解析出的行数用于校验
+        self.rows += len(chunk)
+
+    def finish(self, dataset):
+        rows = build_row_index(self.path, self.file_format)
+        if rows != self.rows:
+            # 扫描出的行边界与pandas不一致时索引不可信，删除后预览退回到其他读取方式
+            logger.warning(f"数据集 {dataset.id} 的行偏移索引有 {rows} 行，与解析出的 {self.rows} 行不一致，已删除")
+            self.abort()
+
+    def abort(self):
+        try:
+            os.remove(index_path(self.path))
+        except OSError:
+            pass
+
+
+class ColumnarStage(IngestionStage):
+    """把数据块写入列式副本（见 columnar），每块一个行组"""
+
+    fields = ('parquet_path',)
+
+    def __init__(self, dataset):
+        self.dataset_id = dataset.id
+        self.name = columnar.parquet_name(dataset.file.name)
+        self.writer = columnar.ColumnarWriter(os.path.join(settings.MEDIA_ROOT, self.name))
+
+    def add(self, chunk):
+        chunk = chunk.rename(columns=str)
+        dtypes = dict(self.writer.dtypes)
+        for name in chunk.columns:
+            dtype = column_dtype(chunk[name])
+            dtypes[name] = merge_dtype(dtypes[name], dtype) if name in dtypes else dtype
+        self.writer.write(chunk, dtypes)
+
+    def finish(self, dataset):
+        self.writer.close()
+        dataset.parquet_path = self.name
+
+    def abort(self):
+        self.writer.abort()
+        Dataset.objects.filter(pk=self.dataset_id).update(parquet_path=None)
+
+
+class ContentHashStage(IngestionStage):
+    """计算文件内容的摘要"""
+
+    fields = ('content_hash',)
+
+    def __init__(self, dataset):
+        self.path = dataset_path(dataset)
+
+    def add(self, chunk):
+        pass
+
+    def finish(self, dataset):
+        dataset.content_hash = file_content_hash(self.path)
+
+
+def _report_progress(dataset_id, message):
+    """只更新状态消息，不覆盖其他字段"""
+    Dataset.objects.filter(pk=dataset_id).update(status_message=message, updated_at=timezone.now())
+
+
+def build_stages(dataset):
+    """数据集解析时依次经过的阶段"""
+    stages = [SchemaStage(), ContentHashStage(dataset)]
+    if supports_index(dataset.file_format):
+        stages.append(RowIndexStage(dataset))
+    if columnar.available():
+        stages.append(ColumnarStage(dataset))
+    # profiling 依赖本模块，在这里导入；统计结果中记录内容摘要，排在 ContentHashStage 之后
+    from .profiling import ProfileStage
+    stages.append(ProfileStage())
+    return stages
+
+
+def ingest_dataset(dataset_id):
+    """
+    分块解析数据集文件，更新行数、列数、schema和状态
+
+    Returns:
+        解析完成后的数据集
+    """
+    dataset = Dataset.objects.get(pk=dataset_id)
+    Dataset.objects.filter(pk=dataset_id).update(status='processing', status_message='开始解析')
+
+    stages = build_stages(dataset)
+    handle = None
+    try:
+        chunks, progress, handle = open_chunks(dataset)
+        total_size = os.path.getsize(dataset_path(dataset)) or 1
+        rows = 0
+        reported_at = timezone.now()
+        for chunk in chunks:
+            for stage in stages:
+                stage.add(chunk)
+            rows += len(chunk)
+
+            now = timezone.now()
+            if (now - reported_at).total_seconds() >= PROGRESS_INTERVAL:
+                reported_at = now
+                if progress is not None:
+                    percent = min(99, int(progress() * 100 / total_size))
+                    _report_progress(dataset_id, f'解析中: {percent}%，已读取 {rows} 行')
+                else:
+                    _report_progress(dataset_id, f'解析中: 已读取 {rows} 行')
+
+        for stage in stages:
+            stage.finish(dataset)
+        dataset.status = 'ready'
+        dataset.status_message = None
+        # 只写入解析结果，不覆盖解析期间用户对名称等字段的修改
+        fields = {'status', 'status_message', 'updated_at'}
+        for stage in stages:
+            fields.update(stage.fields)
+        dataset.save(update_fields=sorted(fields))
+        logger.info(f"数据集 {dataset.id} 处理完成，行数: {dataset.rows_count}, 列数: {dataset.columns_count}")
+    except Exception as e:
+        logger.exception(f"处理数据集 {dataset.id} 失败: {str(e)}")
+        for stage in stages:
+            stage.abort()
+        Dataset.objects.filter(pk=dataset_id).update(status='error', status_message=f"处理失败: {str(e)}")
+        dataset.refresh_from_db()
+    finally:
+        if handle is not None:
+            handle.close()
+    return dataset
+
+
+def _records(df):
+    """DataFrame转换为可以JSON序列化的行字典（空值为None）"""
+    return df.astype(object).where(pd.notna(df), None).to_dict('records')
+
+
+def read_rows(dataset, start, count):
+    """
+    读取数据集第 start 行起的 count 行
+
+    有行偏移索引时直接定位到对应位置读取；其次从列式副本中读取覆盖这些行的行组；
+    都没有时分块读取到目标位置。
+
+    Returns:
+        (列名列表, 行字典列表, 数据行数)
+    """
+    path = dataset_path(dataset)
+    if supports_index(dataset.file_format):
+        result = read_indexed_rows(path, dataset.file_format, start, count)
+        if result is not None:
+            return result[0], result[1], load_row_index(path)[1]
+    if dataset.parquet_path and columnar.available() and os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, dataset.parquet_path)):
+        table = columnar.read_columnar_rows(dataset, start, count)
+        return table.column_names, _records(table.to_pandas()), dataset.rows_count
+
+    columns = [column['name'] for column in dataset.schema or []]
+    rows = []
+    position = 0
+    chunks, _, handle = open_chunks(dataset)
+    try:
+        for chunk in chunks:
+            if not columns:
+                columns = [str(column) for column in chunk.columns]
+            if position + len(chunk) > start:
+                rows.extend(_records(chunk.iloc[max(0, start - position):start - position + count]))
+                if len(rows) >= count:
+                    break
+            position += len(chunk)
+    finally:
+        if handle is not None:
+            handle.close()
+    return columns, rows[:count], dataset.rows_count
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_center', '0003_dataset_columns_count_dataset_is_public_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='schema',
+            field=models.JSONField(blank=True, default=list, verbose_name='数据结构'),
+        ),
+        migrations.AlterField(
+            model_name='dataset',
+            name='file_size',
+            field=models.PositiveBigIntegerField(verbose_name='文件大小(字节)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_center', '0004_dataset_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='parquet_path',
+            field=models.CharField(blank=True, max_length=500, null=True, verbose_name='列式副本路径'),
+        ),
+    ]
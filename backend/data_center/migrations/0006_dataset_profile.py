@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_center', '0005_dataset_parquet_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='文件内容摘要'),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='profile',
+            field=models.JSONField(blank=True, null=True, verbose_name='数据统计'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('data_center', '0006_dataset_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, verbose_name='数据集名称')),
+                ('description', models.TextField(blank=True, null=True, verbose_name='数据集描述')),
+                ('is_public', models.BooleanField(default=False, verbose_name='是否公开')),
+                ('tags', models.CharField(blank=True, max_length=255, null=True, verbose_name='标签')),
+                ('file_name', models.CharField(max_length=255, verbose_name='文件名')),
+                ('file_size', models.PositiveBigIntegerField(verbose_name='文件大小(字节)')),
+                ('part_size', models.PositiveBigIntegerField(verbose_name='分片大小(字节)')),
+                ('parts_count', models.PositiveIntegerField(verbose_name='分片数')),
+                ('status', models.CharField(choices=[('uploading', '上传中'), ('completed', '已完成')], default='uploading', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dataset_uploads', to=settings.AUTH_USER_MODEL, verbose_name='创建者')),
+                ('dataset', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload', to='data_center.dataset', verbose_name='数据集')),
+            ],
+            options={
+                'verbose_name': '数据集分片上传',
+                'verbose_name_plural': '数据集分片上传',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DatasetUploadPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.PositiveIntegerField(verbose_name='分片序号')),
+                ('size', models.PositiveBigIntegerField(verbose_name='分片大小(字节)')),
+                ('checksum', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='data_center.datasetupload', verbose_name='上传会话')),
+            ],
+            options={
+                'verbose_name': '数据集上传分片',
+                'verbose_name_plural': '数据集上传分片',
+                'ordering': ['part_number'],
+                'unique_together': {('upload', 'part_number')},
+            },
+        ),
+    ]
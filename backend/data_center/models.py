@@ -6,6 +6,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 import os
+import uuid
 from django.utils.text import slugify
 
 User = get_user_model()
@@ -25,9 +26,17 @@ class Dataset(models.Model):
     description = models.TextField(blank=True, null=True, verbose_name="数据集描述")
     file = models.FileField(upload_to='datasets/', verbose_name="数据集文件")
     file_format = models.CharField(max_length=20, verbose_name="文件格式")
-    file_size = models.PositiveIntegerField(verbose_name="文件大小(字节)")
+    file_size = models.PositiveBigIntegerField(verbose_name="文件大小(字节)")
     rows_count = models.PositiveIntegerField(default=0, verbose_name="数据行数")
     columns_count = models.PositiveIntegerField(default=0, verbose_name="数据列数")
+    # 后台解析得到的各列信息：[{"name": 列名, "dtype": 类型, "nullable": 是否有空值}]
+    schema = models.JSONField(default=list, blank=True, verbose_name="数据结构")
+    # 解析时生成的Parquet列式副本，相对 MEDIA_ROOT 的路径；未安装 pyarrow 时为空
+    parquet_path = models.CharField(max_length=500, blank=True, null=True, verbose_name="列式副本路径")
+    # 文件内容的SHA-256，解析时计算，作为 profile 的缓存键
+    content_hash = models.CharField(max_length=64, blank=True, null=True, verbose_name="文件内容摘要")
+    # 逐列统计结果（见 profiling），其中记录了计算时的 content_hash
+    profile = models.JSONField(blank=True, null=True, verbose_name="数据统计")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="状态")
     status_message = models.TextField(blank=True, null=True, verbose_name="状态消息")
     is_public = models.BooleanField(default=False, verbose_name="是否公开")
@@ -133,4 +142,60 @@ class KnowledgeBase(models.Model):
         """获取内容预览"""
         if self.content:
             return self.content[:200] + '...' if len(self.content) > 200 else self.content
-        return "" 
\ No newline at end of file
+        return "" 
+
+
+class DatasetUpload(models.Model):
+    """
+    分片上传会话
+
+    初始化时在 MEDIA_ROOT 中预先创建一个与文件同样大小的稀疏文件，各分片直接写入其中对应的位置，
+    全部分片上传完成后原子地重命名为正式的数据集文件（见 uploads）。
+    """
+    
+    STATUS_CHOICES = (
+        ('uploading', '上传中'),
+        ('completed', '已完成'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=100, verbose_name="数据集名称")
+    description = models.TextField(blank=True, null=True, verbose_name="数据集描述")
+    is_public = models.BooleanField(default=False, verbose_name="是否公开")
+    tags = models.CharField(max_length=255, blank=True, null=True, verbose_name="标签")
+    file_name = models.CharField(max_length=255, verbose_name="文件名")
+    file_size = models.PositiveBigIntegerField(verbose_name="文件大小(字节)")
+    part_size = models.PositiveBigIntegerField(verbose_name="分片大小(字节)")
+    parts_count = models.PositiveIntegerField(verbose_name="分片数")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading', verbose_name="状态")
+    dataset = models.OneToOneField(Dataset, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload', verbose_name="数据集")
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='dataset_uploads', verbose_name="创建者")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    
+    class Meta:
+        verbose_name = "数据集分片上传"
+        verbose_name_plural = "数据集分片上传"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.file_name} ({self.id})"
+
+
+class DatasetUploadPart(models.Model):
+    """已写入并校验通过的分片"""
+    
+    upload = models.ForeignKey(DatasetUpload, on_delete=models.CASCADE, related_name='parts', verbose_name="上传会话")
+    part_number = models.PositiveIntegerField(verbose_name="分片序号")
+    size = models.PositiveBigIntegerField(verbose_name="分片大小(字节)")
+    checksum = models.CharField(max_length=64, verbose_name="SHA-256")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    
+    class Meta:
+        verbose_name = "数据集上传分片"
+        verbose_name_plural = "数据集上传分片"
+        unique_together = [('upload', 'part_number')]
+        ordering = ['part_number']
+    
+    def __str__(self):
+        return f"{self.upload_id} #{self.part_number}"
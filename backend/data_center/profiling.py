@@ -0,0 +1,392 @@
+"""
+数据集的逐列统计（profile）
+
+profile_dataset 对数据集做一次流式遍历（有列式副本时读取 Parquet，否则分块读取原始文件），
+每个数据块用NumPy/pandas向量化地计算各列的部分统计，再与之前的结果合并：
+
+- 类型、空值比例
+- 数值列的最小值/最大值/均值/标准差（按 Chan 等人的并行算法合并均值和二阶中心矩）
+- 直方图：等宽分箱，后面的数据超出范围时把箱宽加倍、相邻的箱合并，不需要事先知道值域
+- 不同值个数：HyperLogLog 估计（2^14 个寄存器，相对误差约0.8%）
+- 出现最多的值：Misra-Gries 摘要，不同值不超过 HEAVY_HITTERS_CAPACITY 个时计数精确，
+  否则计数为下界
+
+统计在解析数据集时由 ProfileStage 随其他阶段在同一次遍历中计算，结果保存在 Dataset.profile 中，
+并记录文件内容的SHA-256（Dataset.content_hash）。在此之前解析的数据集由Celery任务
+profile_dataset（见 compute_profile）补算，计算状态保存在缓存中；接口只返回保存的结果。
+"""
+
+import os
+import math
+import logging
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import columnar
+from .models import Dataset
+from .ingestion import (
+    IngestionStage, open_chunks, column_dtype, merge_dtype, dataset_path, file_content_hash
+)
+
+logger = logging.getLogger(__name__)
+
+HLL_PRECISION = 14
+HEAVY_HITTERS_CAPACITY = 10000
+NUMERIC_DTYPES = ('int64', 'float64')
+PROFILE_STATE_TIMEOUT = 3600  # 后台计算状态的保留时间(秒)，过期后可以重新提交
+
+
+def _python_value(value):
+    """NumPy标量转换为可以JSON序列化的Python值，inf 转换为字符串（JSON和jsonb都不支持）"""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估计，输入为64位哈希值"""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes):
+        remaining = 64 - self.precision
+        index = (hashes >> np.uint64(remaining)).astype(np.intp)
+        rest = hashes & np.uint64((1 << remaining) - 1)
+        # rest 不超过 2^50，转换为float64是精确的；frexp 的指数即二进制位数，rest为0时为0
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = (remaining - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self):
+        """Ertl 的改进估计（arXiv:1702.01284），在整个基数范围内都没有明显偏差"""
+        m = len(self.registers)
+        q = 64 - self.precision
+        counts = np.bincount(self.registers, minlength=q + 2).astype(np.float64)
+        z = m * _tau(1 - counts[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + counts[k])
+        z += m * _sigma(counts[0] / m)
+        return m * m / (2 * math.log(2) * z)
+
+
+def _sigma(x):
+    if x == 1:
+        return math.inf
+    y = 1.0
+    z = x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y = 1.0
+    z = 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class Histogram:
+    """值域可扩展的等宽直方图"""
+
+    def __init__(self, bins):
+        self.bins = bins
+        self.low = None
+        self.width = None
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def _extend(self, low, high):
+        """箱宽加倍直到覆盖 [low, high]，原来的箱整体落入新的箱中"""
+        if low >= self.low and high <= self.low + self.bins * self.width:
+            return
+        shift = max(0, math.ceil((self.low - low) / self.width))  # 向左扩展的原箱数
+        factor = 1
+        while shift > self.bins * (factor - 1) or self.low + (self.bins * factor - shift) * self.width < high:
+            factor *= 2
+        target = (np.arange(self.bins) + shift) // factor
+        self.counts = np.bincount(target, weights=self.counts, minlength=self.bins).astype(np.int64)
+        self.low -= shift * self.width
+        self.width *= factor
+
+    def add(self, values):
+        low, high = float(values.min()), float(values.max())
+        if self.low is None:
+            self.low = low
+            self.width = (high - low) / self.bins or 1.0
+        else:
+            self._extend(low, high)
+        index = np.floor((values - self.low) / self.width).astype(np.int64)
+        np.clip(index, 0, self.bins - 1, out=index)
+        self.counts += np.bincount(index, minlength=self.bins)
+
+    def result(self):
+        """去掉两端的空箱"""
+        filled = np.flatnonzero(self.counts)
+        if self.low is None or not len(filled):
+            return None
+        first, last = int(filled[0]), int(filled[-1]) + 1
+        return {
+            'edges': [self.low + i * self.width for i in range(first, last + 1)],
+            'counts': self.counts[first:last].tolist(),
+        }
+
+
+class HeavyHitters:
+    """Misra-Gries 摘要"""
+
+    def __init__(self, capacity=HEAVY_HITTERS_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.int64)
+
+    def add(self, values):
+        counts = values.value_counts(sort=False)
+        self.counts = counts if self.counts.empty else self.counts.add(counts, fill_value=0)
+        if len(self.counts) > self.capacity:
+            # 所有计数减去第 capacity+1 大的计数，只保留仍为正的值
+            threshold = self.counts.nlargest(self.capacity + 1).iloc[-1]
+            self.counts = self.counts[self.counts > threshold] - threshold
+
+    def top(self, k):
+        return [
+            {'value': _python_value(value), 'count': int(count)}
+            for value, count in self.counts.nlargest(k).items()
+        ]
+
+
+class ColumnProfile:
+    """单列的统计，逐块累加"""
+
+    def __init__(self, bins):
+        self.dtype = 'null'
+        self.non_null = 0
+        self.numeric = True  # 目前为止的数据块都是数值类型
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.histogram = Histogram(bins)
+        self.distinct = HyperLogLog()
+        self.heavy_hitters = HeavyHitters()
+
+    def _add_moments(self, values):
+        """合并一块有限数值的均值和二阶中心矩"""
+        count = len(values)
+        mean = float(values.mean())
+        m2 = float(np.square(values - mean).sum())
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def _add_range(self, low, high):
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+    def add(self, series):
+        values = series.dropna()
+        if not len(values):
+            return
+        dtype = column_dtype(values)
+        self.dtype = merge_dtype(self.dtype, dtype)
+        self.non_null += len(values)
+        if dtype not in NUMERIC_DTYPES:
+            self.numeric = False
+
+        if dtype in NUMERIC_DTYPES:
+            numbers = values.to_numpy(dtype=np.float64)
+            # 整数和浮点数使用相同的哈希，整数列在后面的块中变为浮点数时不会重复计数
+            self.distinct.add(pd.util.hash_array(numbers))
+            self.heavy_hitters.add(values)
+            finite = np.isfinite(numbers)
+            if self.numeric and finite.any():
+                self._add_moments(numbers[finite])
+                kept = values[finite]
+                self._add_range(kept.min(), kept.max())
+                self.histogram.add(numbers[finite])
+            return
+
+        if dtype == 'datetime':
+            self._add_range(values.min(), values.max())
+        keys = values if dtype == 'bool' else values.astype(str)
+        self.distinct.add(pd.util.hash_array(keys.to_numpy()))
+        self.heavy_hitters.add(keys)
+
+    def result(self, name, rows, top_k):
+        dtype = self.dtype if self.dtype != 'null' else 'string'
+        profile = {
+            'name': name,
+            'dtype': dtype,
+            'null_count': rows - self.non_null,
+            'null_ratio': (rows - self.non_null) / rows if rows else 0.0,
+            'distinct_count': int(round(self.distinct.estimate())) if self.non_null else 0,
+            'top_values': self.heavy_hitters.top(top_k),
+        }
+        if dtype in NUMERIC_DTYPES and self.numeric and self.count:
+            profile.update({
+                'min': _python_value(self.minimum),
+                'max': _python_value(self.maximum),
+                'mean': self.mean,
+                'std': math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None,
+                'histogram': self.histogram.result(),
+            })
+        elif dtype == 'datetime' and self.minimum is not None:
+            profile.update({'min': _python_value(self.minimum), 'max': _python_value(self.maximum)})
+        return profile
+
+
+def _iter_frames(dataset):
+    """逐块读取数据集，优先使用列式副本"""
+    if dataset.parquet_path and columnar.available() and os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, dataset.parquet_path)):
+        for batch in columnar.iter_columnar(dataset):
+            yield batch.to_pandas()
+        return
+
+    chunks, _, handle = open_chunks(dataset)
+    try:
+        yield from chunks
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+class DatasetProfiler:
+    """逐块累加数据集各列的统计"""
+
+    def __init__(self):
+        self.top_k = getattr(settings, 'DATASET_PROFILE_TOP_K', 10)
+        self.bins = getattr(settings, 'DATASET_PROFILE_HISTOGRAM_BINS', 20)
+        self.columns = {}
+        self.rows = 0
+
+    def add(self, chunk):
+        chunk = chunk.rename(columns=str)
+        for name in chunk.columns:
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = ColumnProfile(self.bins)
+            column.add(chunk[name])
+        self.rows += len(chunk)
+
+    def result(self, content_hash):
+        """
+        Returns:
+            {'content_hash', 'rows', 'columns': [各列统计], 'computed_at'}
+        """
+        return {
+            'content_hash': content_hash,
+            'rows': self.rows,
+            'columns': [column.result(name, self.rows, self.top_k) for name, column in self.columns.items()],
+            'computed_at': timezone.now().isoformat(),
+        }
+
+
+class ProfileStage(IngestionStage):
+    """解析时计算逐列统计，需要排在 ContentHashStage 之后"""
+
+    fields = ('profile',)
+
+    def __init__(self):
+        self.profiler = DatasetProfiler()
+
+    def add(self, chunk):
+        self.profiler.add(chunk)
+
+    def finish(self, dataset):
+        dataset.profile = self.profiler.result(dataset.content_hash)
+
+
+def profile_dataset(dataset):
+    """一次遍历计算数据集各列的统计，返回值见 DatasetProfiler.result"""
+    profiler = DatasetProfiler()
+    for chunk in _iter_frames(dataset):
+        profiler.add(chunk)
+    return profiler.result(dataset.content_hash)
+
+
+def get_profile(dataset):
+    """保存的统计结果，尚未计算或文件内容已变化时返回None"""
+    profile = dataset.profile
+    if profile and dataset.content_hash and profile.get('content_hash') == dataset.content_hash:
+        return profile
+    return None
+
+
+def _state_key(dataset_id):
+    return f'dataset_profile_state_{dataset_id}'
+
+
+def profile_state(dataset_id):
+    """后台计算的状态：{'status': pending/running/failed, ...}，没有进行中的计算时为None"""
+    return cache.get(_state_key(dataset_id))
+
+
+def _set_state(dataset_id, status, **extra):
+    cache.set(_state_key(dataset_id), dict(extra, status=status, updated_at=timezone.now().isoformat()),
+              PROFILE_STATE_TIMEOUT)
+
+
+def claim_profile(dataset_id):
+    """
+    登记一次后台计算
+
+    Returns:
+        是否登记成功；已有进行中（或最近失败）的计算时返回False，调用方不应再提交任务
+    """
+    state = {'status': 'pending', 'updated_at': timezone.now().isoformat()}
+    return cache.add(_state_key(dataset_id), state, PROFILE_STATE_TIMEOUT)
+
+
+def release_profile(dataset_id):
+    """清除计算状态（任务提交失败时）"""
+    cache.delete(_state_key(dataset_id))
+
+
+def compute_profile(dataset_id):
+    """
+    计算并保存数据集的统计（在Celery任务中执行），旧的数据集同时补算内容摘要
+
+    Returns:
+        统计结果
+    """
+    dataset = Dataset.objects.get(pk=dataset_id)
+    _set_state(dataset_id, 'running')
+    try:
+        if not dataset.content_hash:
+            # 在记录内容摘要之前解析的数据集
+            dataset.content_hash = file_content_hash(dataset_path(dataset))
+            Dataset.objects.filter(pk=dataset.pk).update(content_hash=dataset.content_hash)
+
+        profile = get_profile(dataset)
+        if profile is None:
+            profile = profile_dataset(dataset)
+            # 只写入统计结果，不覆盖其他字段
+            Dataset.objects.filter(pk=dataset.pk).update(profile=profile)
+            logger.info(f"数据集 {dataset.id} 的统计计算完成，共 {profile['rows']} 行")
+    except Exception as e:
+        logger.exception(f"计算数据集 {dataset.id} 的统计失败: {str(e)}")
+        _set_state(dataset_id, 'failed', error=str(e))
+        raise
+    release_profile(dataset_id)
+    return profile
@@ -0,0 +1,311 @@
+"""
+数据集的行偏移索引
+
+对按行存储的数据集（CSV/TSV/TXT/JSONL），解析时在数据文件旁生成 <文件名>.idx：
+一个uint64的NumPy数组，布局为
+
+    [步长K, 数据行数, 文件大小, 第0行的偏移, 第K行的偏移, 第2K行的偏移, ...]
+
+偏移是数据行（不含表头）在文件中的起始字节位置。读取第n行时先定位到
+第 n // K * K 行，再向后最多扫描 K-1 行，因此任意一页的读取代价只与页大小和K有关，
+与文件大小无关。文件通过内存映射读取，行边界用NumPy按块向量化查找：CSV中引号内的
+换行不是行边界。与pandas一致，只有字段开头（分隔符或换行之后）的引号才开始一个带引号的字段，
+字段中间的引号（如 12" pipe）是普通字符；带引号的字段中转义的 "" 不结束字段。
+空行和只有空白字符的行不计为数据行。
+"""
+
+import os
+import io
+import json
+import bisect
+import logging
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DELIMITED_FORMATS = {'csv': ',', 'tsv': '\t', 'txt': '\t'}
+JSON_LINES_FORMATS = ('jsonl', 'ndjson')
+INDEXED_FORMATS = tuple(DELIMITED_FORMATS) + JSON_LINES_FORMATS
+
+HEADER_SIZE = 3  # 索引数组开头的元数据个数
+SCAN_BLOCK = 16 * 1024 * 1024  # 建立索引时每次扫描的字节数
+
+NEWLINE = ord('\n')
+QUOTE = ord('"')
+SPACE = ord(' ')
+BLANK = b' \t\r\n\x0b\x0c'  # 空白字符，同 bytes.strip
+
+
+def index_stride():
+    """每隔多少行记录一个偏移"""
+    return getattr(settings, 'DATASET_INDEX_STRIDE', 1000)
+
+
+def index_path(data_path):
+    """数据文件对应的索引文件路径"""
+    return f'{data_path}.idx'
+
+
+def supports_index(file_format):
+    return (file_format or '').lower() in INDEXED_FORMATS
+
+
+def blank_bytes(file_format):
+    """只由这些字符组成的行是空行；分隔符（如TSV的制表符）不算空白，只有分隔符的行是一行空值"""
+    delimiter = DELIMITED_FORMATS.get(file_format.lower(), '').encode()
+    return bytes(byte for byte in BLANK if byte not in delimiter)
+
+
+class RowScanner:
+    """按块查找行的起始位置，跨块保留引号状态和未结束的行"""
+
+    def __init__(self, data, delimiter=None, blank=BLANK):
+        """
+        Args:
+            data: 整个文件的字节数组（内存映射）
+            delimiter: 分隔符，为None时不处理引号（如JSONL）
+            blank: 只由这些字符组成的行是空行
+        """
+        self.data = data
+        self.field_breaks = None if delimiter is None else np.array([NEWLINE, ord(delimiter)], dtype=np.uint8)
+        self.blank = blank
+        self.blank_array = np.frombuffer(blank, dtype=np.uint8)
+        self.in_quotes = 0
+        self.row_start = 0
+
+    def _quote_toggles(self, block, begin):
+        """
+        块中改变引号状态的引号串的起始位置
+
+        连续的引号作为一串处理：奇数个引号改变状态，偶数个（转义的 ""）不改变。
+        在带引号的字段中任何奇数串都结束字段；在字段外只有字段开头的奇数串才开始带引号的字段。
+        """
+        positions = np.flatnonzero(block == QUOTE)
+        if not len(positions):
+            return positions
+        first = np.concatenate(([0], np.flatnonzero(np.diff(positions) != 1) + 1))
+        last = np.concatenate((first[1:] - 1, [len(positions) - 1]))
+        starts = positions[first] + begin
+        lengths = positions[last] + begin - starts + 1
+        # 从上一块延续过来的引号串已经在上一块中按完整长度处理
+        if starts[0] == begin and begin > 0 and self.data[begin - 1] == QUOTE:
+            starts, lengths = starts[1:], lengths[1:]
+            if not len(starts):
+                return starts
+        # 延续到下一块的引号串按完整长度处理
+        end = begin + len(block)
+        if starts[-1] + lengths[-1] == end:
+            position = end
+            while position < len(self.data) and self.data[position] == QUOTE:
+                position += 1
+            lengths[-1] += position - end
+
+        odd = (lengths & 1) == 1
+        starts = starts[odd]
+        at_field_start = starts == 0
+        previous = self.data[np.maximum(starts - 1, 0)]
+        at_field_start |= np.isin(previous, self.field_breaks)
+
+        # 引号都出现在预期位置时（字段外的奇数串都在字段开头），状态依次交替
+        opening = (np.arange(len(starts)) + self.in_quotes) % 2 == 0
+        misplaced = np.flatnonzero(opening & ~at_field_start)
+        if not len(misplaced):
+            return starts
+        # 从第一个字段中间的引号开始逐个确定状态（纯Python列表，比逐次调用NumPy快）
+        candidates = np.flatnonzero(at_field_start).tolist()
+        toggles = []
+        index = int(misplaced[0])
+        count = len(starts)
+        while True:
+            # 此时在字段外，跳到下一个字段开头的奇数串
+            position = bisect.bisect_left(candidates, index)
+            if position == len(candidates):
+                break
+            index = candidates[position]
+            toggles.append(index)
+            # 在带引号的字段中，下一个奇数串结束字段
+            if index + 1 < count:
+                toggles.append(index + 1)
+            index += 2
+            if index >= count:
+                break
+        return np.concatenate((starts[:misplaced[0]], starts[toggles]))
+
+    def _is_row(self, starts, ends):
+        """去掉空行和只有空白字符的行（与pandas的skip_blank_lines一致）"""
+        rows = ends > starts
+        # 以非空白字符开头的行一定不是空行，其余的少数行逐个检查
+        first = np.full(len(starts), SPACE, dtype=np.uint8)
+        first[rows] = self.data[starts[rows]]
+        check = np.flatnonzero(rows & np.isin(first, self.blank_array))
+        for position in check:
+            rows[position] = bool(bytes(self.data[starts[position]:ends[position]]).strip(self.blank))
+        return rows
+
+    def scan(self, begin, end):
+        """扫描 [begin, end) 中结束的行，返回它们的起始位置"""
+        block = np.asarray(self.data[begin:end])
+        ends = np.flatnonzero(block == NEWLINE).astype(np.int64) + begin
+        if self.field_breaks is not None:
+            toggles = self._quote_toggles(block, begin)
+            if len(toggles):
+                # 换行之前的状态变化次数决定它是否在引号内
+                inside = (np.searchsorted(toggles, ends) + self.in_quotes) & 1
+                ends = ends[inside == 0]
+                self.in_quotes = (self.in_quotes + len(toggles)) & 1
+            elif self.in_quotes:
+                ends = ends[:0]
+        if not len(ends):
+            return ends
+        starts = np.empty_like(ends)
+        starts[0] = self.row_start
+        starts[1:] = ends[:-1] + 1
+        self.row_start = int(ends[-1]) + 1
+        return starts[self._is_row(starts, ends)]
+
+    def finish(self, size):
+        """文件末尾没有换行符的最后一行"""
+        if self.row_start >= size:
+            return np.empty(0, dtype=np.int64)
+        tail = np.asarray(self.data[self.row_start:size])
+        if np.isin(tail, self.blank_array).all():
+            return np.empty(0, dtype=np.int64)
+        return np.array([self.row_start], dtype=np.int64)
+
+
+def _map(path):
+    """只读内存映射文件，空文件返回空数组"""
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+def build_row_index(data_path, file_format, stride=None):
+    """
+    扫描数据文件并写入行偏移索引
+
+    Returns:
+        数据行数
+    """
+    stride = stride or index_stride()
+    file_format = file_format.lower()
+    data = _map(data_path)
+    size = len(data)
+    scanner = RowScanner(data, DELIMITED_FORMATS.get(file_format), blank_bytes(file_format))
+    # 分隔符格式的第一行是表头
+    skip = 1 if file_format in DELIMITED_FORMATS else 0
+
+    rows = 0
+    offsets = []
+    begin = 0
+    while True:
+        if begin < size:
+            end = min(begin + SCAN_BLOCK, size)
+            starts = scanner.scan(begin, end)
+        else:
+            starts = scanner.finish(size)
+        if skip:
+            taken = min(skip, len(starts))
+            starts = starts[taken:]
+            skip -= taken
+        # 只保留本块中行号为K的整数倍的行，内存占用与行数/K成正比
+        first = (-rows) % stride
+        offsets.append(starts[first::stride].copy())
+        rows += len(starts)
+        if begin >= size:
+            break
+        begin = end
+    del data
+
+    index = np.concatenate([
+        np.array([stride, rows, size], dtype=np.uint64),
+        np.concatenate(offsets).astype(np.uint64) if offsets else np.empty(0, dtype=np.uint64),
+    ])
+    tmp_path = f'{index_path(data_path)}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, index)
+    os.replace(tmp_path, index_path(data_path))
+    return rows
+
+
+def load_row_index(data_path):
+    """
+    加载行偏移索引（内存映射），索引不存在或与数据文件不匹配时返回None
+
+    Returns:
+        (步长, 数据行数, 偏移数组) 或 None
+    """
+    path = index_path(data_path)
+    try:
+        index = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if len(index) < HEADER_SIZE or int(index[2]) != os.path.getsize(data_path):
+        logger.warning(f"行偏移索引 {path} 与数据文件不一致，忽略")
+        return None
+    return int(index[0]), int(index[1]), index[HEADER_SIZE:]
+
+
+def _row_span(data, offsets, stride, start, count, file_format):
+    """定位第 start 行起的 count 行，返回 (起始字节, 结束字节)"""
+    size = len(data)
+    block = start // stride
+    scanner = RowScanner(data, DELIMITED_FORMATS.get(file_format), blank_bytes(file_format))
+    scanner.row_start = int(offsets[block])
+    position = scanner.row_start
+    wanted = start - block * stride  # 从块起点跳过的行数
+    # 需要找到 wanted + count + 1 个行起点（最后一个是结束位置）
+    found = []
+    needed = wanted + count + 1
+    chunk = 64 * 1024
+    while sum(len(s) for s in found) < needed:
+        if position >= size:
+            found.append(scanner.finish(size))
+            break
+        end = min(position + chunk, size)
+        found.append(scanner.scan(position, end))
+        position = end
+        chunk = min(chunk * 2, SCAN_BLOCK)
+    starts = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+    if wanted >= len(starts):
+        return size, size
+    begin = int(starts[wanted])
+    finish = int(starts[wanted + count]) if wanted + count < len(starts) else size
+    return begin, finish
+
+
+def read_indexed_rows(data_path, file_format, start, count):
+    """
+    通过行偏移索引读取第 start 行起的 count 行
+
+    Returns:
+        (列名列表, 行字典列表)，没有可用的索引时返回None
+    """
+    loaded = load_row_index(data_path)
+    if loaded is None:
+        return None
+    stride, total, offsets = loaded
+    file_format = file_format.lower()
+    if start >= total or count <= 0:
+        return [], []
+    count = min(count, total - start)
+
+    data = _map(data_path)
+    begin, finish = _row_span(data, offsets, stride, start, count, file_format)
+    payload = bytes(data[begin:finish])
+
+    if file_format in DELIMITED_FORMATS:
+        header = bytes(data[:int(offsets[0])]) if len(offsets) else b''
+        df = pd.read_csv(io.BytesIO(header + payload), sep=DELIMITED_FORMATS[file_format], nrows=count)
+        df = df.astype(object).where(pd.notna(df), None)
+        return [str(column) for column in df.columns], df.to_dict('records')
+
+    rows = [json.loads(line) for line in payload.splitlines() if line.strip()][:count]
+    columns = []
+    for row in rows:
+        for key in (row if isinstance(row, dict) else {}):
+            if key not in columns:
+                columns.append(key)
+    return columns, rows
@@ -3,7 +3,7 @@
 """
 
 from rest_framework import serializers
-from .models import Dataset, KnowledgeBase
+from .models import Dataset, KnowledgeBase, DatasetUpload, DatasetUploadPart
 
 class DatasetSerializer(serializers.ModelSerializer):
     """数据集序列化器"""
@@ -14,10 +14,14 @@ class DatasetSerializer(serializers.ModelSerializer):
         model = Dataset
         fields = [
             'id', 'name', 'description', 'file', 'file_format', 
-            'file_size', 'created_by', 'created_by_username', 
+            'file_size', 'rows_count', 'columns_count', 'schema',
+            'status', 'status_message', 'created_by', 'created_by_username', 
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['file_size', 'file_format', 'created_by', 'created_at', 'updated_at']
+        read_only_fields = [
+            'file_size', 'file_format', 'rows_count', 'columns_count', 'schema',
+            'status', 'status_message', 'created_by', 'created_at', 'updated_at'
+        ]
 
 class KnowledgeBaseSerializer(serializers.ModelSerializer):
     """知识库序列化器"""
@@ -27,4 +31,25 @@ class KnowledgeBaseSerializer(serializers.ModelSerializer):
         model = KnowledgeBase
         fields = ['id', 'name', 'description', 'content', 'is_public', 
                  'created_by', 'created_at', 'updated_at']
-        read_only_fields = ['created_by', 'created_at', 'updated_at'] 
\ No newline at end of file
+        read_only_fields = ['created_by', 'created_at', 'updated_at'] 
+
+class DatasetUploadPartSerializer(serializers.ModelSerializer):
+    """数据集上传分片序列化器"""
+    
+    class Meta:
+        model = DatasetUploadPart
+        fields = ['part_number', 'size', 'checksum', 'created_at']
+
+class DatasetUploadSerializer(serializers.ModelSerializer):
+    """数据集分片上传序列化器"""
+    
+    parts = DatasetUploadPartSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = DatasetUpload
+        fields = [
+            'id', 'name', 'description', 'is_public', 'tags', 'file_name', 'file_size',
+            'part_size', 'parts_count', 'status', 'dataset', 'parts', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['parts_count', 'status', 'dataset', 'created_at', 'updated_at']
+        extra_kwargs = {'part_size': {'required': False}}
@@ -28,14 +28,14 @@ class DatasetSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'slug', 'description', 'file', 'file_format', 
             'file_size', 'file_size_formatted', 'file_url', 'rows_count', 
-            'columns_count', 'status', 'status_message', 'is_public', 'tags',
+            'columns_count', 'schema', 'status', 'status_message', 'is_public', 'tags',
             'created_by', 'created_by_username', 'created_by_detail',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
             'slug', 'file_size', 'file_format', 'created_by', 
             'file_size_formatted', 'file_url', 'rows_count', 
-            'columns_count', 'status', 'status_message',
+            'columns_count', 'schema', 'status', 'status_message',
             'created_at', 'updated_at'
         ]
         
@@ -0,0 +1,45 @@
+"""
+数据中心的Celery任务
+"""
+
+from celery import shared_task
+from .ingestion import ingest_dataset as run_ingestion
+from .profiling import compute_profile
+from .uploads import cleanup_expired_uploads
+
+@shared_task
+def ingest_dataset(dataset_id):
+    """
+    在后台分块解析上传的数据集，更新行数、列数、schema和状态
+    
+    参数:
+        dataset_id: 数据集ID
+    """
+    dataset = run_ingestion(dataset_id)
+    return {
+        'dataset_id': dataset.id,
+        'status': dataset.status,
+        'rows_count': dataset.rows_count,
+        'columns_count': dataset.columns_count
+    }
+
+@shared_task
+def profile_dataset(dataset_id):
+    """
+    计算数据集的逐列统计（在记录统计之前解析的数据集），结果保存在 Dataset.profile 中
+    
+    参数:
+        dataset_id: 数据集ID
+    """
+    profile = compute_profile(dataset_id)
+    return {'dataset_id': dataset_id, 'rows': profile['rows'], 'columns': len(profile['columns'])}
+
+@shared_task
+def cleanup_dataset_uploads(hours=None):
+    """
+    删除超过有效期仍未完成的分片上传及其文件
+    
+    参数:
+        hours: 有效期(小时)，默认读取 DATASET_UPLOAD_EXPIRE_HOURS
+    """
+    return {'deleted': cleanup_expired_uploads(hours)}
@@ -0,0 +1,532 @@
+import os
+import json
+import hashlib
+import math
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import columnar, ingestion
+from .ingestion import ingest_dataset
+from .models import Dataset, DatasetUpload
+from .profiling import HyperLogLog, Histogram, ColumnProfile, DatasetProfiler, compute_profile
+from .row_index import build_row_index, load_row_index, read_indexed_rows
+
+
+def _records(df):
+    """与 read_indexed_rows 相同的转换：缺失值为None"""
+    return df.astype(object).where(pd.notna(df), None).to_dict('records')
+
+
+class RowIndexTests(SimpleTestCase):
+    """按行偏移索引读取的任意一页与完整读取文件后切片的结果一致"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        return path
+
+    def _csv(self, rows=23, trailing_newline=True, line_ending='\n'):
+        lines = ['id,text,value']
+        for i in range(rows):
+            if i % 5 == 1:
+                text = f'"line one\nline two {i}"'  # 引号内的换行
+            elif i % 5 == 2:
+                text = f'"say ""hi""\n{i}"'  # 转义的引号和换行
+            else:
+                text = f'plain {i}'
+            lines.append(f'{i},{text},{i * 1.5}')
+            if i % 7 == 3:
+                lines.append('')  # 空行
+        content = line_ending.join(lines)
+        return content + line_ending if trailing_newline else content
+
+    def _assert_pages_match(self, path, file_format, expected, counts=(1, 2, 3, 4, 10, 100)):
+        for start in range(len(expected) + 2):
+            for count in counts:
+                with self.subTest(start=start, count=count):
+                    _, rows = read_indexed_rows(path, file_format, start, count)
+                    self.assertEqual(rows, expected[start:start + count])
+
+    def test_csv_pages_match_full_read(self):
+        for stride in (1, 2, 3, 7, 1000):
+            for trailing_newline in (True, False):
+                with self.subTest(stride=stride, trailing_newline=trailing_newline):
+                    path = self._write('data.csv', self._csv(trailing_newline=trailing_newline))
+                    expected = _records(pd.read_csv(path))
+                    self.assertEqual(build_row_index(path, 'csv', stride=stride), len(expected))
+                    self._assert_pages_match(path, 'csv', expected)
+
+    def test_crlf_line_endings(self):
+        path = self._write('data.csv', self._csv(line_ending='\r\n'))
+        expected = _records(pd.read_csv(path))
+        self.assertEqual(build_row_index(path, 'csv', stride=3), len(expected))
+        self._assert_pages_match(path, 'csv', expected, counts=(1, 5))
+
+    def test_quotes_spanning_scan_blocks(self):
+        # 扫描块很小时，引号状态和未结束的行要跨块保留
+        path = self._write('data.csv', self._csv())
+        expected = _records(pd.read_csv(path))
+        with mock.patch('data_center.row_index.SCAN_BLOCK', 5):
+            self.assertEqual(build_row_index(path, 'csv', stride=4), len(expected))
+        self._assert_pages_match(path, 'csv', expected, counts=(1, 3))
+
+    def test_stride_boundaries(self):
+        path = self._write('data.csv', self._csv(rows=40))
+        expected = _records(pd.read_csv(path))
+        build_row_index(path, 'csv', stride=8)
+        stride, total, offsets = load_row_index(path)
+        self.assertEqual((stride, total, len(offsets)), (8, 40, 5))
+        for start in (7, 8, 15, 16, 31, 32, 39):
+            _, rows = read_indexed_rows(path, 'csv', start, 2)
+            self.assertEqual(rows, expected[start:start + 2])
+
+    def test_jsonl_blank_lines_and_no_trailing_newline(self):
+        records = [{'id': i, 'text': f'line\n{i}'} for i in range(17)]
+        lines = [json.dumps(record) for record in records]
+        lines.insert(4, '')
+        lines.insert(9, '   ')
+        path = self._write('data.jsonl', '\n'.join(lines))
+        self.assertEqual(build_row_index(path, 'jsonl', stride=4), len(records))
+        self._assert_pages_match(path, 'jsonl', records, counts=(1, 4, 50))
+
+    def test_whitespace_only_lines(self):
+        # CSV中只有空白字符的行是空行；TSV中只有制表符的行是一行空值
+        path = self._write('data.csv', 'a,b\n1,x\n   \n2,y\n \t\r\n3,z\n  ')
+        expected = _records(pd.read_csv(path))
+        self.assertEqual(build_row_index(path, 'csv', stride=2), len(expected))
+        self._assert_pages_match(path, 'csv', expected, counts=(1, 2))
+
+        path = self._write('data.tsv', 'a\tb\n1\tx\n\t\n  \n2\ty\n')
+        expected = _records(pd.read_csv(path, sep='\t'))
+        self.assertEqual(build_row_index(path, 'tsv', stride=2), len(expected))
+        self._assert_pages_match(path, 'tsv', expected, counts=(1, 2))
+
+    def test_header_only_and_empty_files(self):
+        path = self._write('header.csv', 'id,text\n')
+        self.assertEqual(build_row_index(path, 'csv', stride=2), 0)
+        self.assertEqual(read_indexed_rows(path, 'csv', 0, 10), ([], []))
+        path = self._write('empty.jsonl', '')
+        self.assertEqual(build_row_index(path, 'jsonl', stride=2), 0)
+
+    def test_quotes_inside_unquoted_fields(self):
+        # 只有字段开头的引号才开始带引号的字段，12" pipe 中的引号是普通字符
+        lines = ['id,item,note']
+        for i in range(10):
+            note = '"a, ""b""\nc"' if i % 3 == 0 else 'plain'
+            lines.append(f'{i},12" pipe,{note}' if i % 2 else f'{i},{i}"x"y,{note}')
+        path = self._write('data.csv', '\n'.join(lines) + '\n')
+        expected = _records(pd.read_csv(path))
+        self.assertEqual(len(expected), 10)
+        for block in (3, 5, 1024):
+            with self.subTest(block=block), mock.patch('data_center.row_index.SCAN_BLOCK', block):
+                self.assertEqual(build_row_index(path, 'csv', stride=2), 10)
+        self.assertEqual(read_indexed_rows(path, 'csv', 5, 2)[1], expected[5:7])
+        self._assert_pages_match(path, 'csv', expected, counts=(1, 3))
+
+    def test_stale_index_is_ignored(self):
+        path = self._write('data.csv', self._csv())
+        build_row_index(path, 'csv', stride=3)
+        with open(path, 'ab') as f:
+            f.write(b'99,appended,1.0\n')
+        self.assertIsNone(load_row_index(path))
+        self.assertIsNone(read_indexed_rows(path, 'csv', 0, 1))
+
+
+@skipUnless(columnar.available(), "需要安装 pyarrow")
+class ColumnarTests(SimpleTestCase):
+    """列式副本的读取结果与直接用pandas处理原始数据一致"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataset = SimpleNamespace(id=1, parquet_path='data.csv.parquet')
+        chunks = [
+            pd.DataFrame({'id': range(0, 50), 'group': ['a', 'b'] * 25}),
+            # 后面的数据块中整数列变为浮点数，出现新的列
+            pd.DataFrame({'id': [50.5, None, 52.0], 'group': ['c', 'a', None], 'extra': [1, 2, 3]}),
+        ]
+        self.expected = pd.concat(chunks, ignore_index=True)
+        writer = columnar.ColumnarWriter(os.path.join(self.directory, self.dataset.parquet_path))
+        for chunk in chunks:
+            dtypes = {'id': 'float64' if chunk['id'].dtype.kind == 'f' else 'int64', 'group': 'string'}
+            if 'extra' in chunk:
+                dtypes['extra'] = 'int64'
+            writer.write(chunk, dict(writer.dtypes, **dtypes))
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_filters_and_projection(self):
+        with override_settings(MEDIA_ROOT=self.directory):
+            table = columnar.read_columnar(self.dataset, columns=['id'], filters=[('group', 'in', ['a', 'c'])])
+        expected = self.expected[self.expected['group'].isin(['a', 'c'])]['id']
+        self.assertEqual(table.column_names, ['id'])
+        self.assertEqual(table.column('id').to_pylist(), [None if pd.isna(value) else value for value in expected])
+
+    def test_rows_across_row_groups(self):
+        with override_settings(MEDIA_ROOT=self.directory):
+            table = columnar.read_columnar_rows(self.dataset, 48, 4)
+        self.assertEqual(table.column('id').to_pylist()[:3], [48.0, 49.0, 50.5])
+        self.assertEqual(table.column('extra').to_pylist(), [None, None, 1, 2])
+
+    def test_all_null_chunk_in_int_and_bool_columns(self):
+        # 后面的数据块中整数列和布尔列全部为空，pandas读为全NaN的float列，类型仍为int64/bool
+        self.dataset.parquet_path = 'nulls.parquet'
+        writer = columnar.ColumnarWriter(os.path.join(self.directory, self.dataset.parquet_path))
+        dtypes = {'n': 'int64', 'flag': 'bool'}
+        writer.write(pd.DataFrame({'n': [1, 2], 'flag': [True, False]}), dtypes)
+        writer.write(pd.DataFrame({'n': [float('nan')] * 2, 'flag': [float('nan')] * 2}), dtypes)
+        writer.close()
+        with override_settings(MEDIA_ROOT=self.directory):
+            table = columnar.read_columnar(self.dataset)
+        self.assertEqual(table.column('n').to_pylist(), [1, 2, None, None])
+        self.assertEqual(table.column('flag').to_pylist(), [True, False, None, None])
+
+
+class ProfileSketchTests(SimpleTestCase):
+    """逐块合并的统计与一次性计算的精确结果一致"""
+
+    def test_hyperloglog_estimate(self):
+        for n in (10, 1000, 200000):
+            with self.subTest(n=n):
+                sketch = HyperLogLog()
+                values = np.arange(n, dtype=np.float64)
+                # 分块加入并包含重复值，不影响估计
+                for chunk in np.array_split(np.concatenate([values, values[: n // 2]]), 7):
+                    sketch.add(pd.util.hash_array(chunk))
+                self.assertLess(abs(sketch.estimate() - n) / n, 0.03)
+
+    def test_histogram_matches_single_pass_binning(self):
+        rng = np.random.default_rng(0)
+        chunks = [rng.uniform(0, 1, 1000), rng.uniform(-5, 3, 1000), rng.uniform(10, 20, 1000), rng.uniform(2, 4, 10)]
+        histogram = Histogram(20)
+        for chunk in chunks:
+            histogram.add(chunk)
+        values = np.concatenate(chunks)
+        self.assertLessEqual(histogram.low, values.min())
+        self.assertGreaterEqual(histogram.low + histogram.bins * histogram.width, values.max())
+        # 扩展时原来的箱整体并入新的箱，结果与按最终分箱一次性统计相同
+        index = np.clip(np.floor((values - histogram.low) / histogram.width).astype(np.int64), 0, histogram.bins - 1)
+        self.assertEqual(histogram.counts.tolist(), np.bincount(index, minlength=histogram.bins).tolist())
+
+    def test_chan_merge_matches_numpy(self):
+        rng = np.random.default_rng(1)
+        chunks = [rng.normal(loc, scale, size) for loc, scale, size in ((0, 1, 500), (1e6, 3, 2000), (-50, 0.1, 1))]
+        column = ColumnProfile(10)
+        for chunk in chunks:
+            column.add(pd.Series(chunk))
+        values = np.concatenate(chunks)
+        result = column.result('x', len(values), 5)
+        self.assertAlmostEqual(result['mean'], values.mean(), delta=1e-9 * abs(values.mean()))
+        self.assertAlmostEqual(result['std'], values.std(ddof=1), delta=1e-9 * values.std())
+        self.assertEqual((result['min'], result['max']), (values.min(), values.max()))
+
+    def test_non_finite_values_are_json_safe(self):
+        profiler = DatasetProfiler()
+        profiler.add(pd.DataFrame({'x': [1.0, math.inf, math.inf, -math.inf, None, 2.0]}))
+        profile = profiler.result('hash')
+        column = profile['columns'][0]
+        json.dumps(profile, allow_nan=False)
+        self.assertEqual(column['top_values'][0], {'value': 'inf', 'count': 2})
+        self.assertIn({'value': '-inf', 'count': 1}, column['top_values'])
+        self.assertEqual((column['min'], column['max'], column['null_count']), (1.0, 2.0, 1))
+
+
+class DatasetProfileTests(TestCase):
+    """统计在解析时或后台任务中计算，接口只返回保存的结果"""
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.directory, DATASET_INGEST_CHUNK_ROWS=7)
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user('u', password='p')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.frame = pd.DataFrame({
+            'id': range(30),
+            'group': ['a', 'b', 'c'] * 10,
+            'score': [i * 0.5 if i % 4 else None for i in range(30)],
+        })
+        os.makedirs(os.path.join(self.directory, 'datasets'))
+        self.frame.to_csv(os.path.join(self.directory, 'datasets', 'data.csv'), index=False)
+        self.dataset = Dataset.objects.create(
+            name='d', file='datasets/data.csv', file_format='csv', file_size=1, created_by=self.user
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def _get(self):
+        return self.client.get(f'/api/data-center/datasets/{self.dataset.id}/profile/')
+
+    def test_ingestion_stores_profile(self):
+        ingest_dataset(self.dataset.id)
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        profile = response.json()
+        self.assertEqual(profile['rows'], 30)
+        self.assertEqual(profile['content_hash'], Dataset.objects.get(pk=self.dataset.pk).content_hash)
+        columns = {column['name']: column for column in profile['columns']}
+        score = self.frame['score']
+        self.assertEqual(columns['score']['null_count'], int(score.isna().sum()))
+        self.assertAlmostEqual(columns['score']['mean'], score.mean())
+        self.assertAlmostEqual(columns['score']['std'], score.std())
+        self.assertEqual(columns['id']['distinct_count'], 30)
+        self.assertEqual(
+            sorted((item['value'], item['count']) for item in columns['group']['top_values']),
+            sorted(self.frame['group'].value_counts().items())
+        )
+
+    def test_old_dataset_is_profiled_in_background(self):
+        Dataset.objects.filter(pk=self.dataset.pk).update(status='ready')
+        with mock.patch('data_center.views.profile_dataset') as task:
+            first, second = self._get(), self._get()
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.json()['status'], 'pending')
+        task.delay.assert_called_once_with(self.dataset.id)
+
+        compute_profile(self.dataset.id)
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rows'], 30)
+        self.assertIsNotNone(Dataset.objects.get(pk=self.dataset.pk).content_hash)
+
+    def test_background_failure_is_reported(self):
+        Dataset.objects.filter(pk=self.dataset.pk).update(status='ready')
+        with mock.patch('data_center.views.profile_dataset'):
+            self.assertEqual(self._get().status_code, 202)
+        with mock.patch('data_center.profiling.profile_dataset', side_effect=ValueError('bad file')):
+            with self.assertRaises(ValueError):
+                compute_profile(self.dataset.id)
+        response = self._get()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['detail'], 'bad file')
+
+
+class DatasetIngestionTests(TestCase):
+    """分块解析各种格式，合并各块的schema，失败时标记为error"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.directory, DATASET_INGEST_CHUNK_ROWS=3)
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user('u', password='p')
+        os.makedirs(os.path.join(self.directory, 'datasets'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def _ingest(self, name, file_format, content=None):
+        if content is not None:
+            with open(os.path.join(self.directory, 'datasets', name), 'wb') as f:
+                f.write(content.encode('utf-8') if isinstance(content, str) else content)
+        dataset = Dataset.objects.create(
+            name='d', file=f'datasets/{name}', file_format=file_format, file_size=1, created_by=self.user
+        )
+        ingest_dataset(dataset.id)
+        return Dataset.objects.get(pk=dataset.pk)
+
+    def _schema(self, dataset):
+        return {column['name']: (column['dtype'], column['nullable']) for column in dataset.schema}
+
+    def _records(self):
+        # 第二块起 score 出现小数，extra 列从第二块才出现
+        return [
+            {'id': i, 'name': f'n{i}', 'score': i + 0.5 if i >= 3 else i, **({'extra': 'x'} if i >= 3 else {})}
+            for i in range(7)
+        ]
+
+    def _assert_merged_schema(self, dataset):
+        self.assertEqual(dataset.status, 'ready')
+        self.assertEqual((dataset.rows_count, dataset.columns_count), (7, 4))
+        self.assertEqual(self._schema(dataset), {
+            'id': ('int64', False),
+            'name': ('string', False),
+            'score': ('float64', False),
+            'extra': ('string', True),
+        })
+
+    def test_csv(self):
+        content = 'id,name,score\n' + ''.join(f'{i},n{i},{i + 0.5 if i >= 3 else i}\n' for i in range(7))
+        dataset = self._ingest('data.csv', 'csv', content)
+        self.assertEqual(dataset.status, 'ready')
+        self.assertEqual((dataset.rows_count, dataset.columns_count), (7, 3))
+        self.assertEqual(self._schema(dataset), {
+            'id': ('int64', False), 'name': ('string', False), 'score': ('float64', False),
+        })
+
+    def test_jsonl(self):
+        content = ''.join(json.dumps(record) + '\n' for record in self._records())
+        self._assert_merged_schema(self._ingest('data.jsonl', 'jsonl', content))
+
+    @skipUnless(ingestion.ijson, '需要安装 ijson')
+    def test_json_array_streamed(self):
+        self._assert_merged_schema(self._ingest('data.json', 'json', json.dumps(self._records())))
+
+    def test_json_array_without_ijson(self):
+        with mock.patch('data_center.ingestion.ijson', None):
+            self._assert_merged_schema(self._ingest('data.json', 'json', json.dumps(self._records())))
+
+    @skipUnless(ingestion.openpyxl, '需要安装 openpyxl')
+    def test_xlsx(self):
+        workbook = ingestion.openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['id', 'name', 'score', 'extra'])
+        for record in self._records():
+            sheet.append([record['id'], record['name'], record['score'], record.get('extra')])
+        workbook.save(os.path.join(self.directory, 'datasets', 'data.xlsx'))
+        self._assert_merged_schema(self._ingest('data.xlsx', 'xlsx'))
+
+    def test_parse_error_marks_dataset_failed(self):
+        content = ''.join(json.dumps(record) + '\n' for record in self._records()[:4]) + '{broken\n'
+        dataset = self._ingest('data.jsonl', 'jsonl', content)
+        self.assertEqual(dataset.status, 'error')
+        self.assertTrue(dataset.status_message.startswith('处理失败'))
+        self.assertIsNone(dataset.parquet_path)
+        self.assertFalse(any(name.endswith('.parquet') for _, _, names in os.walk(self.directory) for name in names))
+
+    @override_settings(DATASET_INGEST_CHUNK_ROWS=4)
+    def test_int_column_empty_in_later_chunk(self):
+        content = 'id,n\n' + ''.join(f'{i},{i * 10 if i < 4 else ""}\n' for i in range(8))
+        dataset = self._ingest('data.csv', 'csv', content)
+        self.assertEqual(dataset.status, 'ready')
+        self.assertEqual(self._schema(dataset), {'id': ('int64', False), 'n': ('int64', True)})
+        if columnar.available():
+            with override_settings(MEDIA_ROOT=self.directory):
+                table = columnar.read_columnar(dataset)
+            self.assertEqual(table.column('n').to_pylist(), [0, 10, 20, 30, None, None, None, None])
+
+    def test_row_index_with_wrong_row_count_is_removed(self):
+        content = 'id,name\n' + ''.join(f'{i},n{i}\n' for i in range(7))
+        with mock.patch('data_center.ingestion.build_row_index', return_value=6):
+            dataset = self._ingest('data.csv', 'csv', content)
+        self.assertEqual(dataset.status, 'ready')
+        path = os.path.join(self.directory, 'datasets', 'data.csv')
+        self.assertFalse(os.path.exists(f'{path}.idx'))
+        self.assertEqual(ingestion.read_rows(dataset, 5, 5)[1], [{'id': 5, 'name': 'n5'}, {'id': 6, 'name': 'n6'}])
+
+    def test_unsupported_format_marks_dataset_failed(self):
+        dataset = self._ingest('data.bin', 'bin', b'\x00')
+        self.assertEqual(dataset.status, 'error')
+        self.assertIn('bin', dataset.status_message)
+
+
+class DatasetUploadTests(TestCase):
+    """分片上传、续传和完成"""
+
+    part_size = 1024 * 1024
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.directory)
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('u', password='p'))
+        rows = ''.join(f'{i},row {i}\n' for i in range(250000))
+        # 2.5个分片，最后一个分片不满
+        self.content = f'id,text\n{rows}'.encode()[:self.part_size * 5 // 2]
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def _create(self, file_name='data.csv', part_size=None):
+        data = dict(name='d', file_name=file_name, file_size=len(self.content), part_size=part_size or self.part_size)
+        return self.client.post('/api/data-center/dataset-uploads/', data, format='json')
+
+    def _part(self, upload_id, number, body=None, checksum=None):
+        if body is None:
+            body = self.content[(number - 1) * self.part_size:number * self.part_size]
+        return self.client.generic(
+            'PUT', f'/api/data-center/dataset-uploads/{upload_id}/parts/{number}/', body,
+            content_type='application/octet-stream',
+            HTTP_X_CONTENT_SHA256=checksum or hashlib.sha256(body).hexdigest()
+        )
+
+    def _complete(self, upload_id):
+        with mock.patch('data_center.views.ingest_dataset') as task:
+            response = self.client.post(f'/api/data-center/dataset-uploads/{upload_id}/complete/')
+        return response, task
+
+    def test_resume_and_complete(self):
+        upload = self._create().json()
+        self.assertEqual(upload['parts_count'], 3)
+        upload_id = upload['id']
+
+        # 校验失败或大小不对的分片不会被记录
+        self.assertEqual(self._part(upload_id, 2, checksum='0' * 64).status_code, 400)
+        self.assertEqual(self._part(upload_id, 2, body=b'short').status_code, 400)
+        self.assertEqual(self._part(upload_id, 4, body=b'x').status_code, 400)
+        self.assertEqual(self._part(upload_id, 3).status_code, 200)
+        self.assertEqual(self._part(upload_id, 1).status_code, 200)
+
+        response, task = self._complete(upload_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], {'missing_parts': [2]})
+        task.delay.assert_not_called()
+
+        # 续传：查询已上传的分片，只补传缺少的
+        parts = self.client.get(f'/api/data-center/dataset-uploads/{upload_id}/').json()['parts']
+        self.assertEqual([part['part_number'] for part in parts], [1, 3])
+        self.assertEqual(self._part(upload_id, 2).status_code, 200)
+
+        response, task = self._complete(upload_id)
+        self.assertEqual(response.status_code, 201)
+        dataset = Dataset.objects.get(pk=response.json()['id'])
+        task.delay.assert_called_once_with(dataset.id)
+        self.assertEqual(dataset.file.name, f'datasets/{upload_id}_data.csv')
+        with open(os.path.join(self.directory, dataset.file.name), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'datasets', 'uploads', f'{upload_id}.part')))
+
+        self.assertEqual(self._complete(upload_id)[0].status_code, 409)
+        self.assertEqual(self._part(upload_id, 1).status_code, 409)
+
+    def test_same_file_name_gets_distinct_files(self):
+        names = []
+        for _ in range(2):
+            upload_id = self._create().json()['id']
+            for number in (1, 2, 3):
+                self._part(upload_id, number)
+            names.append(self._complete(upload_id)[0].json()['file'])
+        self.assertNotEqual(names[0], names[1])
+        self.assertEqual(Dataset.objects.count(), 2)
+
+    def test_long_file_name_fits_file_field(self):
+        upload_id = self._create(file_name='x' * 200 + '.csv').json()['id']
+        for number in (1, 2, 3):
+            self._part(upload_id, number)
+        dataset = Dataset.objects.get(pk=self._complete(upload_id)[0].json()['id'])
+        self.assertTrue(dataset.file.name.endswith('.csv'))
+        self.assertLessEqual(len(dataset.file.name), Dataset._meta.get_field('file').max_length)
+
+    @override_settings(DATASET_UPLOAD_MAX_PART_SIZE=512 * 1024 * 1024, DATASET_UPLOAD_PROXY_MAX_BODY_SIZE=2 * 1024 * 1024)
+    def test_part_size_is_clamped_to_proxy_limit(self):
+        upload = self._create(part_size=300 * 1024 * 1024).json()
+        self.assertEqual(upload['part_size'], 2 * 1024 * 1024)
+        self.assertEqual(upload['parts_count'], 2)
+
+    def test_abort_removes_file(self):
+        upload_id = self._create().json()['id']
+        self.assertEqual(self.client.delete(f'/api/data-center/dataset-uploads/{upload_id}/').status_code, 204)
+        self.assertFalse(DatasetUpload.objects.filter(pk=upload_id).exists())
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'datasets', 'uploads')), [])
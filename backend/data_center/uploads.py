@@ -0,0 +1,231 @@
+"""
+大数据集的可续传分片上传
+
+协议：
+1. 初始化（create_upload）：声明文件名和大小，服务端确定分片大小和分片数，并在
+   MEDIA_ROOT/datasets/uploads/<上传ID>.part 预先创建同样大小的稀疏文件
+2. 上传分片（write_part）：PUT 每个分片的原始字节，请求头 X-Content-SHA256 为分片的SHA-256；
+   分片边读边写入文件中对应的偏移位置，不经过临时文件，校验通过后记录到 DatasetUploadPart。
+   各分片写入的区域互不重叠，可以并行上传；失败的分片重新上传即可，已记录的分片不需要重传
+3. 完成（complete_upload）：所有分片都已记录时，把文件原子地重命名为 datasets/<上传ID>_<文件名>
+   并创建 Dataset，随后由调用方触发后台解析
+
+未完成的上传超过 DATASET_UPLOAD_EXPIRE_HOURS 后由定时任务清理。
+"""
+
+import os
+import math
+import shutil
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Dataset, DatasetUpload, DatasetUploadPart
+from .ingestion import SUPPORTED_FORMATS
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.path.join('datasets', 'uploads')
+MIN_PART_SIZE = 1024 * 1024
+READ_BLOCK = 1024 * 1024
+
+
+class UploadError(Exception):
+    """分片上传请求无效，status_code 为应返回的HTTP状态码"""
+
+    def __init__(self, message, status_code=400, details=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+def max_part_size():
+    """允许的最大分片大小，不超过反向代理允许的请求体大小，否则分片请求会被代理拒绝"""
+    return min(
+        getattr(settings, 'DATASET_UPLOAD_MAX_PART_SIZE', 96 * 1024 * 1024),
+        getattr(settings, 'DATASET_UPLOAD_PROXY_MAX_BODY_SIZE', 100 * 1024 * 1024),
+    )
+
+
+def default_part_size():
+    return min(getattr(settings, 'DATASET_UPLOAD_PART_SIZE', 64 * 1024 * 1024), max_part_size())
+
+
+def upload_path(upload):
+    """上传中的文件在磁盘上的路径"""
+    return os.path.join(settings.MEDIA_ROOT, UPLOAD_DIR, f'{upload.id}.part')
+
+
+def part_range(upload, part_number):
+    """分片在文件中的 (偏移, 大小)"""
+    if not 1 <= part_number <= upload.parts_count:
+        raise UploadError(f"分片序号必须在1到{upload.parts_count}之间")
+    offset = (part_number - 1) * upload.part_size
+    return offset, min(upload.part_size, upload.file_size - offset)
+
+
+def create_upload(user, name, file_name, file_size, part_size=None, description=None, is_public=False, tags=None):
+    """
+    初始化分片上传，预先创建目标文件
+
+    Raises:
+        UploadError: 文件格式不支持、大小无效或磁盘空间不足
+    """
+    file_name = default_storage.get_valid_name(os.path.basename(file_name))
+    _, ext = os.path.splitext(file_name)
+    if ext[1:].lower() not in SUPPORTED_FORMATS:
+        raise UploadError(f"不支持的文件格式: {ext[1:] or file_name}")
+    if file_size <= 0:
+        raise UploadError("文件大小必须大于0")
+
+    part_size = max(MIN_PART_SIZE, min(part_size or default_part_size(), max_part_size()))
+
+    directory = os.path.join(settings.MEDIA_ROOT, UPLOAD_DIR)
+    os.makedirs(directory, exist_ok=True)
+    if shutil.disk_usage(directory).free < file_size:
+        raise UploadError("磁盘空间不足", status_code=507)
+
+    upload = DatasetUpload.objects.create(
+        name=name, description=description, is_public=is_public, tags=tags,
+        file_name=file_name, file_size=file_size, part_size=part_size,
+        parts_count=math.ceil(file_size / part_size), created_by=user
+    )
+    # 稀疏文件，不实际占用磁盘空间，各分片直接写入对应的位置
+    with open(upload_path(upload), 'wb') as f:
+        f.truncate(file_size)
+    logger.info(f"用户 {user.username} 开始分片上传 {file_name}，{file_size} 字节，{upload.parts_count} 个分片")
+    return upload
+
+
+def write_part(upload, part_number, stream, content_length, checksum):
+    """
+    把请求体写入分片对应的位置并校验
+
+    Args:
+        upload: 上传会话
+        part_number: 分片序号，从1开始
+        stream: 请求体的文件对象
+        content_length: 请求体的长度
+        checksum: 客户端计算的分片SHA-256（十六进制）
+
+    Returns:
+        DatasetUploadPart
+    """
+    if upload.status != 'uploading':
+        raise UploadError("上传已完成", status_code=409)
+    if not checksum:
+        raise UploadError("缺少请求头 X-Content-SHA256")
+    offset, size = part_range(upload, part_number)
+    if content_length != size:
+        raise UploadError(f"分片{part_number}的大小应为{size}字节，实际为{content_length}字节")
+
+    # 先删除已有的记录：写入过程中失败时该分片需要重新上传
+    DatasetUploadPart.objects.filter(upload=upload, part_number=part_number).delete()
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(upload_path(upload), 'r+b') as f:
+        f.seek(offset)
+        while written < size:
+            block = stream.read(min(READ_BLOCK, size - written))
+            if not block:
+                break
+            digest.update(block)
+            f.write(block)
+            written += len(block)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if written != size:
+        raise UploadError(f"分片{part_number}的数据不完整：收到{written}字节，应为{size}字节")
+    if digest.hexdigest() != checksum.lower():
+        raise UploadError(f"分片{part_number}的SHA-256校验失败", details={'expected': checksum, 'actual': digest.hexdigest()})
+
+    part, _ = DatasetUploadPart.objects.update_or_create(
+        upload=upload, part_number=part_number, defaults={'size': size, 'checksum': digest.hexdigest()}
+    )
+    DatasetUpload.objects.filter(pk=upload.pk).update(updated_at=timezone.now())
+    return part
+
+
+def missing_parts(upload):
+    """尚未上传的分片序号"""
+    received = set(upload.parts.values_list('part_number', flat=True))
+    return [number for number in range(1, upload.parts_count + 1) if number not in received]
+
+
+def dataset_file_name(upload):
+    """
+    完成后的数据集文件名（相对 MEDIA_ROOT）：datasets/<上传ID>_<文件名>
+
+    以上传ID为前缀，同名文件的上传同时完成时也不会冲突；超出 Dataset.file 的长度限制时截短文件名，保留扩展名
+    """
+    prefix = os.path.join('datasets', f'{upload.id}_')
+    stem, ext = os.path.splitext(upload.file_name)
+    limit = Dataset._meta.get_field('file').max_length - len(prefix) - len(ext)
+    return f'{prefix}{stem[:max(limit, 0)]}{ext}'
+
+
+def complete_upload(upload_id):
+    """
+    完成上传：所有分片都已记录时把文件重命名为数据集文件，创建待解析的数据集
+
+    Returns:
+        Dataset
+    """
+    with transaction.atomic():
+        upload = DatasetUpload.objects.select_for_update().get(pk=upload_id)
+        if upload.status != 'uploading':
+            raise UploadError("上传已完成", status_code=409)
+        missing = missing_parts(upload)
+        if missing:
+            raise UploadError(f"还有{len(missing)}个分片未上传", details={'missing_parts': missing})
+
+        name = dataset_file_name(upload)
+        _, ext = os.path.splitext(upload.file_name)
+        dataset = Dataset.objects.create(
+            name=upload.name, description=upload.description, is_public=upload.is_public, tags=upload.tags,
+            file=name, file_format=ext[1:].lower(), file_size=upload.file_size,
+            status='pending', created_by=upload.created_by
+        )
+        upload.status = 'completed'
+        upload.dataset = dataset
+        upload.save(update_fields=['status', 'dataset', 'updated_at'])
+        # 最后重命名：失败时事务回滚，上传可以重试完成
+        os.replace(upload_path(upload), os.path.join(settings.MEDIA_ROOT, name))
+
+    logger.info(f"分片上传 {upload.id} 已完成，数据集 {dataset.id}")
+    return dataset
+
+
+def abort_upload(upload):
+    """取消上传，删除已写入的文件"""
+    try:
+        os.remove(upload_path(upload))
+    except OSError:
+        pass
+    upload.delete()
+
+
+def cleanup_expired_uploads(hours=None):
+    """
+    删除超过有效期仍未完成的上传
+
+    Returns:
+        删除的上传数
+    """
+    hours = hours or getattr(settings, 'DATASET_UPLOAD_EXPIRE_HOURS', 24)
+    expired = DatasetUpload.objects.filter(
+        status='uploading', updated_at__lt=timezone.now() - timedelta(hours=hours)
+    )
+    count = 0
+    for upload in expired:
+        abort_upload(upload)
+        count += 1
+    if count:
+        logger.info(f"已清理 {count} 个过期的分片上传")
+    return count
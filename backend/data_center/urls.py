@@ -4,11 +4,12 @@
 
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DatasetViewSet, KnowledgeBaseViewSet
+from .views import DatasetViewSet, KnowledgeBaseViewSet, DatasetUploadViewSet
 
 # 创建路由器
 router = DefaultRouter()
 router.register(r'datasets', DatasetViewSet)
+router.register(r'dataset-uploads', DatasetUploadViewSet)
 router.register(r'knowledge-bases', KnowledgeBaseViewSet)
 
 urlpatterns = [
@@ -2,14 +2,19 @@
 数据中心应用的视图
 """
 
-from rest_framework import viewsets, filters, status
+from rest_framework import viewsets, filters, status, mixins
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Dataset, KnowledgeBase
-from .serializers import DatasetSerializer, KnowledgeBaseSerializer
+from .models import Dataset, KnowledgeBase, DatasetUpload
+from .serializers import DatasetSerializer, KnowledgeBaseSerializer, DatasetUploadSerializer
+from .tasks import ingest_dataset, profile_dataset
+from .ingestion import read_rows
+from .profiling import get_profile, profile_state, claim_profile, release_profile
+from .uploads import UploadError, create_upload, write_part, complete_upload, abort_upload
 import logging
+import os
 import time
 
 logger = logging.getLogger(__name__)
@@ -33,8 +38,19 @@ class DatasetViewSet(viewsets.ModelViewSet):
         return Dataset.objects.all().order_by('-created_at')
     
     def perform_create(self, serializer):
-        """创建数据集时设置创建者"""
-        serializer.save(created_by=self.request.user)
+        """创建数据集时设置创建者，文件由后台任务分块解析"""
+        dataset = serializer.save(created_by=self.request.user, status='pending')
+        ingest_dataset.delay(dataset.id)
+    
+    def perform_update(self, serializer):
+        """更新时上传了新文件则重新解析"""
+        file = serializer.validated_data.get('file')
+        if file is None:
+            serializer.save()
+            return
+        _, ext = os.path.splitext(file.name)
+        dataset = serializer.save(status='pending', file_size=file.size, file_format=ext[1:].lower())
+        ingest_dataset.delay(dataset.id)
     
     @action(detail=False, methods=['get'])
     def formats(self, request):
@@ -44,23 +60,34 @@ class DatasetViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def preview(self, request, pk=None):
-        """获取数据集预览"""
+        """
+        获取数据集预览
+        
+        查询参数:
+            page: 页码，从1开始
+            page_size: 每页行数，最大1000
+        """
         try:
             dataset = self.get_object()
-            # 这里应该实现真实的数据预览逻辑
-            # 目前返回模拟数据
+            if dataset.status != 'ready':
+                return Response({
+                    'error': '数据集尚未解析完成',
+                    'detail': dataset.status_message
+                }, status=status.HTTP_409_CONFLICT)
+            
+            try:
+                page = max(1, int(request.query_params.get('page', 1)))
+                page_size = max(1, min(int(request.query_params.get('page_size', 10)), 1000))
+            except ValueError:
+                return Response({'error': 'page和page_size必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            columns, rows, total = read_rows(dataset, (page - 1) * page_size, page_size)
             preview_data = {
-                'data': [
-                    {'id': 1, 'text': '示例文本数据1', 'label': '类别A', 'score': 0.95},
-                    {'id': 2, 'text': '示例文本数据2', 'label': '类别B', 'score': 0.87},
-                    {'id': 3, 'text': '示例文本数据3', 'label': '类别A', 'score': 0.92},
-                    {'id': 4, 'text': '示例文本数据4', 'label': '类别C', 'score': 0.78},
-                    {'id': 5, 'text': '示例文本数据5', 'label': '类别B', 'score': 0.89}
-                ],
-                'total': 1000,
-                'page': 1,
-                'page_size': 10,
-                'columns': ['id', 'text', 'label', 'score']
+                'data': rows,
+                'total': total,
+                'page': page,
+                'page_size': page_size,
+                'columns': columns
             }
             return Response(preview_data, status=status.HTTP_200_OK)
         except Exception as e:
@@ -70,6 +97,45 @@ class DatasetViewSet(viewsets.ModelViewSet):
                 'detail': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=True, methods=['get'])
+    def profile(self, request, pk=None):
+        """
+        获取数据集的逐列统计
+        
+        统计在解析时计算；在此之前解析的数据集提交后台任务补算，返回202和计算状态，稍后再查询。
+        """
+        try:
+            dataset = self.get_object()
+            if dataset.status != 'ready':
+                return Response({
+                    'error': '数据集尚未解析完成',
+                    'detail': dataset.status_message
+                }, status=status.HTTP_409_CONFLICT)
+            
+            profile = get_profile(dataset)
+            if profile is not None:
+                return Response(profile, status=status.HTTP_200_OK)
+            
+            if claim_profile(dataset.id):
+                try:
+                    profile_dataset.delay(dataset.id)
+                except Exception:
+                    release_profile(dataset.id)
+                    raise
+            state = profile_state(dataset.id) or {'status': 'pending'}
+            if state['status'] == 'failed':
+                return Response({
+                    'error': '计算统计失败',
+                    'detail': state.get('error')
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response(state, status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            logger.error(f"获取数据集统计失败: {str(e)}")
+            return Response({
+                'error': '获取统计失败',
+                'detail': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
     @action(detail=True, methods=['get'])
     def usage(self, request, pk=None):
         """获取数据集使用情况"""
@@ -183,6 +249,79 @@ class DatasetViewSet(viewsets.ModelViewSet):
                 'error': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class DatasetUploadViewSet(mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    数据集分片上传视图集
+    
+    POST   /dataset-uploads/                       初始化上传
+    GET    /dataset-uploads/{id}/                  查询已上传的分片（用于续传）
+    PUT    /dataset-uploads/{id}/parts/{n}/        上传第n个分片，请求头 X-Content-SHA256
+    POST   /dataset-uploads/{id}/complete/         完成上传并开始解析
+    DELETE /dataset-uploads/{id}/                  取消上传
+    """
+    
+    queryset = DatasetUpload.objects.all()
+    serializer_class = DatasetUploadSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        """只能访问自己的上传"""
+        if getattr(self, 'swagger_fake_view', False):  # 处理swagger文档生成
+            return DatasetUpload.objects.none()
+        return DatasetUpload.objects.filter(created_by=self.request.user).prefetch_related('parts')
+    
+    def _error(self, e):
+        body = {'error': str(e)}
+        if e.details:
+            body['detail'] = e.details
+        return Response(body, status=e.status_code)
+    
+    def create(self, request, *args, **kwargs):
+        """初始化分片上传"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            upload = create_upload(request.user, **serializer.validated_data)
+        except UploadError as e:
+            return self._error(e)
+        return Response(self.get_serializer(upload).data, status=status.HTTP_201_CREATED)
+    
+    def destroy(self, request, *args, **kwargs):
+        """取消上传"""
+        upload = self.get_object()
+        if upload.status != 'uploading':
+            return Response({'error': '上传已完成'}, status=status.HTTP_409_CONFLICT)
+        abort_upload(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=['put'], url_path=r'parts/(?P<part_number>\d+)')
+    def parts(self, request, pk=None, part_number=None):
+        """上传一个分片，请求体为分片的原始字节"""
+        upload = self.get_object()
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+            # 直接读取请求体流，不经过解析器和临时文件
+            part = write_part(upload, int(part_number), request.stream, content_length,
+                              request.headers.get('X-Content-SHA256'))
+        except UploadError as e:
+            return self._error(e)
+        return Response({
+            'part_number': part.part_number,
+            'size': part.size,
+            'checksum': part.checksum
+        }, status=status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """完成上传，文件就位后开始后台解析"""
+        upload = self.get_object()
+        try:
+            dataset = complete_upload(upload.id)
+        except UploadError as e:
+            return self._error(e)
+        ingest_dataset.delay(dataset.id)
+        return Response(DatasetSerializer(dataset, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
 class KnowledgeBaseViewSet(viewsets.ModelViewSet):
     """知识库视图集"""
     
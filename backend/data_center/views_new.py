@@ -9,11 +9,8 @@ from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Dataset, KnowledgeBase
 from .serializers import DatasetSerializer, KnowledgeBaseSerializer, UserSerializer
+from .tasks import ingest_dataset
 import logging
-import pandas as pd
-import json
-import os
-from django.conf import settings
 from django.db.models import Q
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 
@@ -48,56 +45,9 @@ class DatasetViewSet(viewsets.ModelViewSet):
         ).distinct()
     
     def perform_create(self, serializer):
-        """创建数据集时设置创建者"""
-        dataset = serializer.save(created_by=self.request.user)
-        
-        # 异步处理数据集
-        self.process_dataset(dataset)
-        
-    def process_dataset(self, dataset):
-        """处理数据集，提取基本信息"""
-        try:
-            # 更新状态为处理中
-            dataset.status = 'processing'
-            dataset.save()
-            
-            file_path = os.path.join(settings.MEDIA_ROOT, dataset.file.name)
-            file_ext = dataset.file_format.lower()
-            
-            # 根据文件类型读取数据
-            if file_ext == 'csv':
-                df = pd.read_csv(file_path)
-            elif file_ext == 'xlsx' or file_ext == 'xls':
-                df = pd.read_excel(file_path)
-            elif file_ext == 'json':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                if isinstance(data, list):
-                    df = pd.DataFrame(data)
-                else:
-                    df = pd.DataFrame([data])
-            elif file_ext == 'txt' or file_ext == 'tsv':
-                df = pd.read_csv(file_path, sep='\t')
-            else:
-                # 不支持的格式
-                dataset.status = 'error'
-                dataset.status_message = f"不支持的文件格式: {file_ext}"
-                dataset.save()
-                return
-            
-            # 更新数据集信息
-            dataset.rows_count = len(df)
-            dataset.columns_count = len(df.columns)
-            dataset.status = 'ready'
-            dataset.save()
-            
-            logger.info(f"数据集 {dataset.id} 处理完成，行数: {dataset.rows_count}, 列数: {dataset.columns_count}")
-            
-        except Exception as e:
-            logger.error(f"处理数据集 {dataset.id} 失败: {str(e)}")
-            dataset.status = 'error'
-            dataset.status_message = f"处理失败: {str(e)}"
-            dataset.save()
+        """创建数据集时设置创建者，文件由后台任务分块解析"""
+        dataset = serializer.save(created_by=self.request.user, status='pending')
+        ingest_dataset.delay(dataset.id)
     
     @action(detail=False, methods=['get'])
     def formats(self, request):